@@ -0,0 +1,142 @@
+"""
+Admission control and load-adaptive degradation for the interactive endpoints.
+Requests over the concurrency limit are rejected (429) instead of piling up.
+As load rises, admitted requests are served at cheaper tiers: a smaller
+detection proxy, a single contour method, a cheaper filter profile and finally
+no straightening. A request's deadline can push it further down the ladder,
+and it is turned away (503) when even the cheapest tier cannot make it.
+"""
+import logging
+import math
+import os
+
+from model_logic import FILTER_PROFILES, DEFAULT_FILTER_PROFILE
+
+logger = logging.getLogger("pizel.admission")
+
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("PIZEL_MAX_CONCURRENT_REQUESTS", 32))
+# Load (0-1) at which each tier after "full" kicks in
+DEGRADE_THRESHOLDS = tuple(float(v) for v in
+                           os.environ.get("PIZEL_DEGRADE_THRESHOLDS", "0.5,0.75,0.9").split(","))
+# Starting estimate of one page's worker time at the full tier, until pages are observed
+INITIAL_PAGE_SECONDS = 1.0
+# Weight of the newest page in the running estimate
+PAGE_SECONDS_SMOOTHING = 0.1
+
+# The degrade ladder. cost is the rough share of a full-tier page's time, used
+# to estimate whether a deadline can be met; profile caps the filter profile.
+TIERS = (
+    {"name": "full", "cost": 1.0},
+    {"name": "reduced", "cost": 0.7, "detection_size": 480, "profile": "balanced"},
+    {"name": "degraded", "cost": 0.5, "detection_size": 480, "contour_methods": ("otsu",),
+     "profile": "fast"},
+    {"name": "minimal", "cost": 0.3, "detection_size": 320, "contour_methods": ("otsu",),
+     "profile": "fast", "straighten": False},
+)
+
+
+class AdmissionError(Exception):
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def cap_profile(requested, tier):
+    """The cheaper of the requested profile and the tier's cap"""
+    requested = requested or DEFAULT_FILTER_PROFILE
+    cap = tier.get("profile")
+    if cap is None:
+        return requested
+    return min(requested, cap, key=FILTER_PROFILES.index)
+
+
+def scan_options(tier, profile):
+    """process_uploaded_batch keyword arguments for a tier"""
+    return {"profile": cap_profile(profile, tier),
+            "detection_size": tier.get("detection_size"),
+            "contour_methods": tier.get("contour_methods"),
+            "straighten": tier.get("straighten", True)}
+
+
+class Ticket:
+    """An admitted request; release() frees its concurrency slot (idempotent)"""
+
+    def __init__(self, controller, tier):
+        self.controller = controller
+        self.tier = tier
+        self._released = False
+
+    @property
+    def tier_name(self):
+        return self.tier["name"]
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller.active -= 1
+
+
+class AdmissionController:
+    def __init__(self, pool, max_concurrent=MAX_CONCURRENT_REQUESTS,
+                 thresholds=DEGRADE_THRESHOLDS):
+        self.pool = pool
+        self.max_concurrent = max(1, max_concurrent)
+        self.thresholds = thresholds
+        self.active = 0
+        self.page_seconds = INITIAL_PAGE_SECONDS
+        self.admitted = {tier["name"]: 0 for tier in TIERS}
+        self.rejected = {"concurrency": 0, "deadline": 0}
+
+    def load(self):
+        """0-1: the fuller of the scan pool's page queue and the request slots"""
+        return max(self.pool.pending / max(1, self.pool.max_queued),
+                   self.active / self.max_concurrent)
+
+    def _load_tier(self, load):
+        tier = 0
+        for i, threshold in enumerate(self.thresholds[:len(TIERS) - 1]):
+            if load >= threshold:
+                tier = i + 1
+        return tier
+
+    def estimate_seconds(self, pages, tier):
+        """Rough time until a request of this many pages finishes at a tier"""
+        workers = max(1, self.pool.workers)
+        waves = math.ceil((self.pool.pending + pages) / workers)
+        return waves * self.page_seconds * TIERS[tier]["cost"]
+
+    def retry_after(self):
+        """Seconds until the queued work has likely drained"""
+        return max(1, math.ceil(self.estimate_seconds(0, 0)))
+
+    def admit(self, pages=1, deadline=None):
+        """
+        Admit a request of this many pages, picking its tier from the current load
+        and its deadline (seconds). Raises AdmissionError when it must be turned away.
+        """
+        if self.active >= self.max_concurrent:
+            self.rejected["concurrency"] += 1
+            raise AdmissionError(429, "Too many concurrent requests", self.retry_after())
+
+        load = self.load()
+        tier = self._load_tier(load)
+        if deadline is not None:
+            while tier < len(TIERS) - 1 and self.estimate_seconds(pages, tier) > deadline:
+                tier += 1
+            if self.estimate_seconds(pages, tier) > deadline:
+                self.rejected["deadline"] += 1
+                raise AdmissionError(503, "Deadline cannot be met at current load",
+                                     self.retry_after())
+
+        self.active += 1
+        self.admitted[TIERS[tier]["name"]] += 1
+        if tier:
+            logger.info("Serving at tier %s (load %.2f)", TIERS[tier]["name"], load)
+        return Ticket(self, TIERS[tier])
+
+    def observe(self, tier, timings):
+        """Feed a finished page's stage timings (ms) into the per-page estimate"""
+        seconds = sum(timings.values()) / 1000 / tier["cost"]
+        self.page_seconds += PAGE_SECONDS_SMOOTHING * (seconds - self.page_seconds)
@@ -0,0 +1,418 @@
+"""
+Reproducible benchmark of the scanning pipeline on synthetic document photos.
+
+Each scene is a generated text page composited onto a textured background with
+a known perspective, rotation, shadow and sensor noise, so the true corners are
+known and corner error can be reported next to the per-stage timings.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json      # compare against a saved run
+    python benchmark.py --no-detector --scenes 2   # classical path only, quick
+    python benchmark.py --startup --scenes 0       # cold import times only
+    python benchmark.py --detectors ultralytics,classical,onnx=yolov8n-int8.onnx
+
+Results are JSON; with --baseline, stage times, corner error and scan memory
+(peak RSS growth from decode to warp) are compared and the exit code is 1 when
+something regressed beyond --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import model_logic
+from encoding import encode_page
+from model_logic import (load_image_for_scan, detect_documents, locate_document, warp_document,
+                         render_page, get_detector, load_detector, order_points, FILTER_MODES,
+                         DEFAULT_FILTER_PROFILE, PIPELINE_VERSION)
+from timing import collect, stage
+from memory_usage import reset_peak_rss, peak_rss_mb
+
+DEFAULT_RESOLUTIONS = "1200x1600,3024x4032"
+# "quality" costs seconds per page, so it is only measured by default when it is
+# the production default (PIZEL_FILTER_PROFILE)
+DEFAULT_PROFILES = ",".join(dict.fromkeys(("fast", "balanced", DEFAULT_FILTER_PROFILE)))
+WORDS = ("invoice", "total", "amount", "date", "reference", "account", "payment", "the",
+         "document", "scanner", "page", "number", "customer", "address", "tax", "due")
+# Profiles only change the "enhanced" filter
+PROFILED_MODES = ("enhanced",)
+# Modules whose cold import time decides how fast a new worker or API process starts
+STARTUP_MODULES = ("model_logic", "main")
+# A detector "hits" a scene when the page is then located within this share of the diagonal
+HIT_ERROR_PCT = 1.0
+
+
+def text_page(rng, width, height):
+    """White page with lines of dark text, a heading and a table rule"""
+    page = np.full((height, width, 3), 245, dtype=np.uint8)
+    margin = width // 12
+    scale = width / 1400
+    line_height = max(12, int(42 * scale))
+    cv2.putText(page, "SYNTHETIC DOCUMENT", (margin, margin + line_height),
+                cv2.FONT_HERSHEY_DUPLEX, 1.6 * scale, (20, 20, 20), max(1, int(3 * scale)))
+    y = margin + 3 * line_height
+    while y < height - margin:
+        words = rng.choice(WORDS, size=rng.integers(4, 10))
+        cv2.putText(page, " ".join(words), (margin, y), cv2.FONT_HERSHEY_SIMPLEX,
+                    scale, (30, 30, 30), max(1, int(2 * scale)), cv2.LINE_AA)
+        y += line_height
+        if rng.random() < 0.08:
+            cv2.line(page, (margin, y - line_height // 2), (width - margin, y - line_height // 2),
+                     (60, 60, 60), max(1, int(2 * scale)))
+    return page
+
+
+def background(rng, width, height):
+    """Low-frequency textured surface (a desk) in a random color"""
+    noise = rng.random((max(2, height // 64), max(2, width // 64))).astype(np.float32)
+    texture = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    color = rng.uniform(40, 150, size=3)
+    scene = texture[..., None] * 60 + color
+    return np.clip(scene, 0, 255).astype(np.uint8)
+
+
+def make_scene(seed, width, height):
+    """
+    A synthetic photo of a page; returns (image, corners, params) where corners
+    are the page's true corners (tl, tr, br, bl) in image coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    params = {"seed": seed,
+              "coverage": float(rng.uniform(0.45, 0.8)),
+              "rotation": float(rng.uniform(-15, 15)),
+              "perspective": float(rng.uniform(0.0, 0.12)),
+              "shadow": float(rng.uniform(0.0, 0.45)),
+              "noise": float(rng.uniform(2, 10))}
+
+    # A4-proportioned page filling `coverage` of the frame's shorter side
+    page_h = int(min(width, height / 1.414) * params["coverage"] * 1.414)
+    page_w = int(page_h / 1.414)
+    page = text_page(rng, page_w, page_h)
+
+    # Rotate the page rectangle about the frame center, then push the corners
+    # around to simulate a tilted camera
+    center = np.float32([width / 2, height / 2])
+    rect = np.float32([[-page_w / 2, -page_h / 2], [page_w / 2, -page_h / 2],
+                       [page_w / 2, page_h / 2], [-page_w / 2, page_h / 2]])
+    angle = np.radians(params["rotation"])
+    rotation = np.float32([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    corners = rect @ rotation.T + center
+    jitter = rng.uniform(-1, 1, size=(4, 2)) * params["perspective"] * page_w
+    corners = (corners + jitter).astype(np.float32)
+
+    src = np.float32([[0, 0], [page_w, 0], [page_w, page_h], [0, page_h]])
+    matrix = cv2.getPerspectiveTransform(src, corners)
+    scene = background(rng, width, height)
+    warped = cv2.warpPerspective(page, matrix, (width, height), flags=cv2.INTER_LINEAR)
+    mask = cv2.warpPerspective(np.full((page_h, page_w), 255, np.uint8), matrix, (width, height))
+    scene[mask > 0] = warped[mask > 0]
+
+    # Soft shadow: darken along a random direction across the frame
+    direction = rng.uniform(-1, 1, size=2)
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    ramp = (xs / width - 0.5) * direction[0] + (ys / height - 0.5) * direction[1]
+    ramp = (ramp - ramp.min()) / max(float(np.ptp(ramp)), 1e-6)
+    shading = 1.0 - params["shadow"] * ramp
+    scene = scene.astype(np.float32) * shading[..., None]
+
+    scene += rng.normal(0, params["noise"], scene.shape).astype(np.float32)
+    scene = np.clip(scene, 0, 255).astype(np.uint8)
+    return scene, corners, params
+
+
+def corner_error(found, truth):
+    """Mean distance between matching corners, in pixels"""
+    found = order_points(np.asarray(found, dtype=np.float32))
+    truth = order_points(np.asarray(truth, dtype=np.float32))
+    return float(np.linalg.norm(found - truth, axis=1).mean())
+
+
+def _median_stages(runs):
+    stages = sorted({name for run in runs for name in run})
+    return {name: round(statistics.median(run.get(name, 0.0) for run in runs), 2)
+            for name in stages}
+
+
+def bench_scene(data, truth, model, filters, repeat, output_dpi):
+    """Time the scan stages (median over repeat runs) and every filter for one scene"""
+    scan_runs = []
+    location = None
+    # Peak RSS growth over the scan itself (decode to warp), not the scene generation
+    reset_peak_rss()
+    rss_before = peak_rss_mb()
+    for _ in range(repeat):
+        timings = {}
+        with collect(timings):
+            orig, proxy, proxy_scale = load_image_for_scan(data)
+            box = None
+            if model is not None:
+                with stage("detect"):
+                    box = detect_documents([proxy], model)[0]
+            location = locate_document(proxy, proxy_scale, box)
+            page = warp_document(orig, location, output_dpi)
+        scan_runs.append(timings)
+    scan_memory = peak_rss_mb()
+
+    result = {"method": location.method, "stages": _median_stages(scan_runs), "filters": {},
+              "scan_memory_mb": (round(scan_memory - rss_before, 1)
+                                 if scan_memory is not None else None)}
+    if location.corners is not None:
+        result["corner_error_px"] = round(corner_error(location.corners, truth), 2)
+    elif location.crop is not None:
+        x1, y1, x2, y2 = location.crop
+        result["corner_error_px"] = round(corner_error(
+            [[x1, y1], [x2, y1], [x2, y2], [x1, y2]], truth), 2)
+    else:
+        result["corner_error_px"] = None
+    if result["corner_error_px"] is not None:
+        diagonal = float(np.hypot(*orig.shape[:2]))
+        result["corner_error_pct"] = round(100 * result["corner_error_px"] / diagonal, 3)
+
+    if page is None:
+        return result
+    for mode, profile in filters:
+        runs = []
+        for _ in range(repeat):
+            timings = {}
+            with collect(timings):
+                image = render_page(page, mode, profile)
+                with stage("encode"):
+                    encode_page(image, mode)
+            runs.append(timings)
+        name = f"{mode}/{profile}" if profile else mode
+        result["filters"][name] = _median_stages(runs)
+    return result
+
+
+def bench_detectors(data, truth, detectors, repeat):
+    """
+    Per detector backend: detection time on the proxy (median over repeat runs),
+    whether it returned a box, and whether the corner search then located the page
+    within HIT_ERROR_PCT of the diagonal. For "classical", also whether the model was skipped.
+    """
+    orig, proxy, proxy_scale = load_image_for_scan(data)
+    diagonal = float(np.hypot(*orig.shape[:2]))
+    results = {}
+    for name, detector in detectors.items():
+        runs = []
+        skipped = detector.stats["classical"]
+        for _ in range(repeat):
+            start = time.perf_counter()
+            box = detector.detect([proxy])[0]
+            runs.append((time.perf_counter() - start) * 1000)
+        location = locate_document(proxy, proxy_scale, box)
+        error_pct = None
+        if location.corners is not None:
+            error_pct = 100 * corner_error(location.corners, truth) / diagonal
+        results[name] = {"detect_ms": round(statistics.median(runs), 2), "box": box is not None,
+                         "hit": error_pct is not None and error_pct <= HIT_ERROR_PCT}
+        if detector.name == "classical":
+            results[name]["model_free"] = detector.stats["classical"] - skipped == repeat
+    return results
+
+
+def measure_imports(modules=STARTUP_MODULES, runs=5):
+    """Median cold import time (ms) of each module, each run in a fresh interpreter"""
+    code = ("import time; started = time.perf_counter(); import {}; "
+            "print((time.perf_counter() - started) * 1000)")
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = {}
+    for module in modules:
+        samples = []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", code.format(module)], cwd=here,
+                                 capture_output=True, text=True, check=True).stdout
+            samples.append(float(out.strip().splitlines()[-1]))
+        times[module] = round(statistics.median(samples), 1)
+    return times
+
+
+def summarize(results):
+    """
+    Median of every stage and of the corner error, worst scan memory, and per
+    detector backend the median detection time and hit rates, per resolution
+    """
+    summary = {}
+    for resolution in sorted({r["resolution"] for r in results}):
+        rows = [r for r in results if r["resolution"] == resolution]
+        stages = _median_stages([r["stages"] for r in rows])
+        filters = {name: _median_stages([r["filters"][name] for r in rows
+                                         if name in r["filters"]])
+                   for name in sorted({name for r in rows for name in r["filters"]})}
+        errors = [r["corner_error_px"] for r in rows if r["corner_error_px"] is not None]
+        memory = [r["scan_memory_mb"] for r in rows if r.get("scan_memory_mb") is not None]
+        detectors = {}
+        for name in sorted({name for r in rows for name in r.get("detectors", {})}):
+            runs = [r["detectors"][name] for r in rows if name in r.get("detectors", {})]
+            detectors[name] = {
+                "detect_ms": round(statistics.median(run["detect_ms"] for run in runs), 2),
+                "box_rate": round(sum(run["box"] for run in runs) / len(runs), 3),
+                "hit_rate": round(sum(run["hit"] for run in runs) / len(runs), 3),
+            }
+            if "model_free" in runs[0]:
+                detectors[name]["model_free_rate"] = round(
+                    sum(run["model_free"] for run in runs) / len(runs), 3)
+        summary[resolution] = {
+            "detectors": detectors,
+            "scan_memory_mb": max(memory) if memory else None,
+            "stages": stages, "filters": filters,
+            "corner_error_px": round(statistics.median(errors), 2) if errors else None,
+            "located": f"{len(errors)}/{len(rows)}",
+        }
+    return summary
+
+
+def compare(current, baseline, tolerance):
+    """Print stage/accuracy changes against a baseline run; returns the regressions"""
+    regressions = []
+    for module, ms in current.get("startup", {}).items():
+        old = baseline.get("startup", {}).get(module)
+        if old is None:
+            continue
+        change = (ms - old) / old * 100 if old else 0.0
+        flag = ""
+        if change > tolerance and ms - old > 5.0:
+            flag = "  REGRESSION"
+            regressions.append(f"import {module}")
+        print(f"import {module}: {old:.1f} -> {ms:.1f} ms ({change:+.0f}%){flag}")
+    for resolution, now in current["summary"].items():
+        before = baseline.get("summary", {}).get(resolution)
+        if before is None:
+            print(f"{resolution}: not in baseline")
+            continue
+        print(f"{resolution}:")
+        rows = [("scan", name, now["stages"].get(name), before["stages"].get(name))
+                for name in now["stages"]]
+        for filter_name, stages in now["filters"].items():
+            old = before["filters"].get(filter_name, {})
+            rows.extend((filter_name, name, ms, old.get(name)) for name, ms in stages.items())
+        for name, detector in now.get("detectors", {}).items():
+            old = before.get("detectors", {}).get(name, {})
+            rows.append(("detector", name, detector["detect_ms"], old.get("detect_ms")))
+        for group, name, ms, old in rows:
+            if old is None or ms is None:
+                continue
+            change = (ms - old) / old * 100 if old else 0.0
+            flag = ""
+            # Sub-millisecond stages are too noisy to judge
+            if change > tolerance and ms - old > 1.0:
+                flag = "  REGRESSION"
+                regressions.append(f"{resolution} {group} {name}")
+            print(f"  {group:>18} {name:<11} {old:9.1f} -> {ms:9.1f} ms ({change:+.0f}%){flag}")
+
+        error, old_error = now["corner_error_px"], before.get("corner_error_px")
+        if error is not None and old_error is not None:
+            flag = ""
+            if error > old_error * (1 + tolerance / 100) and error - old_error > 1.0:
+                flag = "  REGRESSION"
+                regressions.append(f"{resolution} corner error")
+            print(f"  {'corner error':>18} {old_error:21.2f} -> {error:9.2f} px{flag}")
+        for name, detector in now.get("detectors", {}).items():
+            old_rate = before.get("detectors", {}).get(name, {}).get("hit_rate")
+            if old_rate is None:
+                continue
+            flag = ""
+            if detector["hit_rate"] < old_rate:
+                flag = "  REGRESSION"
+                regressions.append(f"{resolution} {name} hit rate")
+            print(f"  {name + ' hit rate':>18} {old_rate:21.3f} -> {detector['hit_rate']:9.3f}{flag}")
+        memory, old_memory = now.get("scan_memory_mb"), before.get("scan_memory_mb")
+        if memory is not None and old_memory is not None:
+            flag = ""
+            # RSS moves by allocator noise; only flag growth of a few megabytes or more
+            if memory > old_memory * (1 + tolerance / 100) and memory - old_memory > 8.0:
+                flag = "  REGRESSION"
+                regressions.append(f"{resolution} scan memory")
+            print(f"  {'scan memory':>18} {old_memory:21.1f} -> {memory:9.1f} MB{flag}")
+        if now["located"] != before.get("located"):
+            print(f"  {'located':>18} {before.get('located')} -> {now['located']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scanner on synthetic pages")
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS,
+                        help="comma-separated WxH photo sizes")
+    parser.add_argument("--scenes", type=int, default=5, help="scenes per resolution")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (median)")
+    parser.add_argument("--modes", default=",".join(FILTER_MODES))
+    parser.add_argument("--profiles", default=DEFAULT_PROFILES,
+                        help="filter profiles for the enhanced mode")
+    parser.add_argument("--output-dpi", type=int, default=None)
+    parser.add_argument("--no-detector", action="store_true",
+                        help="skip YOLO and benchmark the full-image contour path")
+    parser.add_argument("--detectors", default="",
+                        help="detector backends to compare, comma-separated, each "
+                             "backend or backend=model_path (e.g. classical,onnx=yolov8n.onnx)")
+    parser.add_argument("--startup", action="store_true",
+                        help="also measure cold import time of the serving modules")
+    parser.add_argument("--output", help="write results JSON here (default: stdout)")
+    parser.add_argument("--baseline", help="compare against a previous results JSON")
+    parser.add_argument("--tolerance", type=float, default=10.0,
+                        help="allowed slowdown / corner error increase, percent")
+    args = parser.parse_args(argv)
+
+    resolutions = [tuple(int(v) for v in r.lower().split("x")) for r in args.resolutions.split(",")]
+    modes = [m for m in args.modes.split(",") if m]
+    profiles = [p for p in args.profiles.split(",") if p]
+    filters = [(mode, profile) for mode in modes
+               for profile in (profiles if mode in PROFILED_MODES else [None])]
+    model = None if args.no_detector or args.scenes == 0 else get_detector()
+    detectors = {}
+    for spec in filter(None, args.detectors.split(",")):
+        backend, _, model_path = spec.partition("=")
+        detectors[spec] = load_detector(model_path or None, backend=backend)
+
+    results = []
+    for width, height in resolutions:
+        for i in range(args.scenes):
+            seed = args.seed * 1000 + i
+            scene, truth, params = make_scene(seed, width, height)
+            # Benchmark from JPEG bytes, as uploads arrive
+            data = cv2.imencode(".jpg", scene, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+            result = bench_scene(data, truth, model, filters, args.repeat, args.output_dpi)
+            if detectors:
+                result["detectors"] = bench_detectors(data, truth, detectors, args.repeat)
+            results.append({"scene": i, "resolution": f"{width}x{height}", "params": params,
+                            **result})
+            print(f"{width}x{height} scene {i}: {result['method']}, "
+                  f"corner error {result['corner_error_px']} px", file=sys.stderr)
+
+    report = {
+        "meta": {"pipeline_version": PIPELINE_VERSION, "opencv": cv2.__version__,
+                 "numpy": np.__version__, "python": platform.python_version(),
+                 "machine": platform.machine(), "cpus": os.cpu_count(),
+                 "detector": None if model is None else model_logic.active_model_path(),
+                 "detector_backend": None if model is None else model.name,
+                 "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)},
+        "startup": measure_imports() if args.startup else {},
+        "summary": summarize(results),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    elif not args.baseline:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
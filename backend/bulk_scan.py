@@ -0,0 +1,384 @@
+"""
+Offline bulk scanning of photo archives, without the HTTP server.
+
+Inputs are directories (walked recursively), globs, single images or zip
+archives. Pages are spread over worker processes that each preload the
+detector and scan in batches; finished pages are written to the output
+directory as they arrive, mirroring the input layout.
+
+    python bulk_scan.py photos/ archive.zip "more/*.jpg" -o scans/
+    python bulk_scan.py photos/ -o scans/ --pdf             # also one PDF per input
+    python bulk_scan.py photos/ -o scans/                   # again: resumes
+
+Every finished page is appended to scans/manifest.jsonl, so an interrupted run
+picks up where it stopped. At the end a JSON summary (pages/second, pages per
+detection path, worst per-page peak RSS) is printed.
+"""
+import argparse
+import glob
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+
+from encoding import OUTPUT_FORMATS
+from detectors import DETECTOR_BACKENDS
+from model_logic import (process_uploaded_batch, active_model_path, active_backend, FILTER_MODES,
+                         FILTER_PROFILES, MAX_BATCH_SIZE, OUTPUT_DPI)
+from pdf_writer import IncrementalPdfWriter, page_image, PDF_PAGE_SIZES
+from worker_pool import init_worker, SCAN_WORKERS
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+FILE_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp", "png": ".png"}
+MANIFEST_NAME = "manifest.jsonl"
+# PDF name for the pages given as single files or globs
+LOOSE_PDF_NAME = "scan"
+# Print progress every this many pages
+PROGRESS_EVERY = 50
+
+# key: unique name of the input (archive members as "archive.zip/member");
+# archive: zip path or None; path: file path, or member name inside the archive;
+# group: the input directory/archive it came from ("" for loose files);
+# output: output path without extension, relative to the output directory
+Source = namedtuple("Source", "key archive path group output")
+
+
+def _is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def _unique(stem, used):
+    candidate, n = stem, 1
+    while candidate in used:
+        n += 1
+        candidate = f"{stem}-{n}"
+    used.add(candidate)
+    return candidate
+
+
+def member_parts(member):
+    """
+    Path components of an archive member, or None for a name that would escape
+    the output directory (absolute, a drive letter, or any ".." component)
+    """
+    name = member.replace("\\", "/")
+    if name.startswith("/") or (len(name) > 1 and name[1] == ":"):
+        return None
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if not parts or ".." in parts:
+        return None
+    return parts
+
+
+def collect_sources(inputs):
+    """Expand directories, globs and zip archives into Sources, in a stable order"""
+    sources, keys, used_groups, used_outputs = [], set(), set(), set()
+
+    def add(key, archive, path, group, output):
+        if key not in keys:
+            keys.add(key)
+            sources.append(Source(key, archive, path, group,
+                                  _unique(os.path.splitext(output)[0], used_outputs)))
+
+    for spec in inputs:
+        if os.path.isdir(spec):
+            group = _unique(os.path.basename(os.path.normpath(os.path.abspath(spec))), used_groups)
+            for root, dirs, files in os.walk(spec):
+                dirs.sort()
+                for name in sorted(files):
+                    if _is_image(name):
+                        path = os.path.join(root, name)
+                        add(os.path.abspath(path), None, path, group,
+                            os.path.join(group, os.path.relpath(path, spec)))
+        elif spec.lower().endswith(".zip") and zipfile.is_zipfile(spec):
+            group = _unique(os.path.splitext(os.path.basename(spec))[0], used_groups)
+            with zipfile.ZipFile(spec) as archive:
+                members = sorted(info.filename for info in archive.infolist()
+                                 if not info.is_dir() and _is_image(info.filename)
+                                 and not info.filename.startswith("__MACOSX/"))
+            for member in members:
+                parts = member_parts(member)
+                if parts is None:
+                    print(f"{spec}: skipping unsafe member name {member!r}", file=sys.stderr)
+                    continue
+                add(f"{os.path.abspath(spec)}/{member}", spec, member, group,
+                    os.path.join(group, *parts))
+        else:
+            matches = sorted(glob.glob(spec, recursive=True)) if glob.has_magic(spec) else [spec]
+            if not matches or not all(os.path.isfile(m) for m in matches):
+                raise FileNotFoundError(f"No such image, directory or archive: {spec}")
+            for path in matches:
+                if _is_image(path):
+                    add(os.path.abspath(path), None, path, "", os.path.basename(path))
+    return sources
+
+
+def _read_source(source, archives):
+    if source.archive is None:
+        with open(source.path, "rb") as f:
+            return f.read()
+    if source.archive not in archives:
+        archives[source.archive] = zipfile.ZipFile(source.archive)
+    return archives[source.archive].read(source.path)
+
+
+def _scan_chunk(chunk, options):
+    """Worker side: read a chunk of sources and scan them in one batch"""
+    archives, pages, readable, outcomes = {}, [], [], {}
+    try:
+        for source in chunk:
+            try:
+                pages.append((_read_source(source, archives), None))
+                readable.append(source.key)
+            except (OSError, KeyError, zipfile.BadZipFile) as e:
+                outcomes[source.key] = (None, f"Could not read: {e}")
+    finally:
+        for archive in archives.values():
+            archive.close()
+    if pages:
+        for key, result in zip(readable, process_uploaded_batch(pages, **options)):
+            outcomes[key] = (result, None) if result else (None, "Scan failed")
+    return [(source.key,) + outcomes[source.key] for source in chunk]
+
+
+class Manifest:
+    """Append-only record of finished pages; the last line per source wins"""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.options = None
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by an interrupted run
+                    if "options" in entry:
+                        self.options = entry["options"]
+                    else:
+                        self.entries[entry["source"]] = entry
+        self._file = None
+
+    def open(self, options, restart=False):
+        if restart:
+            self.entries = {}
+        elif self.options not in (None, options):
+            raise ValueError("Output directory was scanned with other options; "
+                             "use --restart or another output directory")
+        self._file = open(self.path, "w" if restart else "a")
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write("\n")  # end a line cut short by an interrupted run
+        if restart or self.options is None:
+            self._write({"options": options})
+        self.options = options
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def done(self, source, directory):
+        entry = self.entries.get(source.key)
+        return (entry is not None and entry["status"] == "ok"
+                and os.path.exists(os.path.join(directory, entry["output"])))
+
+    def record(self, entry):
+        self.entries[entry["source"]] = entry
+        self._write(entry)
+
+    def _write(self, entry):
+        # One flushed line per page: an interrupted run loses at most the pages in flight
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def write_page(directory, source, result):
+    """
+    Write a finished page; returns its path relative to the output directory.
+    Raises ValueError if the path resolves outside the output directory.
+    """
+    output = source.output + FILE_EXTENSIONS[result["encoding"]["format"]]
+    path = os.path.join(directory, output)
+    root = os.path.realpath(directory)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        raise ValueError(f"Refusing to write outside the output directory: {output}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(result["image"])
+    return output
+
+
+def write_pdfs(directory, sources, manifest, page_size, dpi):
+    """One multi-page PDF per input directory/archive (plus one for loose files)"""
+    groups = {}
+    for source in sources:
+        entry = manifest.entries.get(source.key)
+        if entry is not None and entry["status"] == "ok":
+            groups.setdefault(source.group or LOOSE_PDF_NAME, []).append(entry["output"])
+
+    written = []
+    for group, outputs in groups.items():
+        path = os.path.join(directory, group + ".pdf")
+        writer = IncrementalPdfWriter(page_size, dpi)
+        # Pages are streamed into the file one at a time, never all held in memory
+        with open(path + ".tmp", "wb") as f:
+            f.write(writer.start())
+            for index, output in enumerate(outputs):
+                with open(os.path.join(directory, output), "rb") as page:
+                    data = page.read()
+                if output.endswith(".jpg"):
+                    # Embedded as-is, no re-encoding
+                    payload = page_image(None, data, bilevel=False)
+                else:
+                    payload = page_image(cv2.imread(os.path.join(directory, output),
+                                                    cv2.IMREAD_UNCHANGED))
+                f.write(writer.add_page(index, payload))
+            f.write(writer.finish())
+        os.replace(path + ".tmp", path)
+        written.append(os.path.relpath(path, directory))
+    return written
+
+
+def run(sources, directory, options, workers, batch_size, manifest):
+    """Scan every source not yet in the manifest; returns the summary dict"""
+    todo = [source for source in sources if not manifest.done(source, directory)]
+    by_key = {source.key: source for source in todo}
+    # Small runs: spread pages over every worker rather than filling one batch
+    batch_size = max(1, min(batch_size, math.ceil(len(todo) / workers))) if todo else 1
+    chunks = iter([todo[i:i + batch_size] for i in range(0, len(todo), batch_size)])
+    summary = {"pages": 0, "failed": 0, "skipped": len(sources) - len(todo),
+               "methods": Counter(), "peak_rss_mb": 0, "interrupted": False}
+    if not todo:
+        return summary
+
+    start = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=init_worker,
+                                   initargs=(options["model_path"], options["detector_backend"]))
+    in_flight = {}
+    reported = 0
+
+    def submit():
+        # Keep every worker busy with one chunk queued behind it, no more
+        while len(in_flight) < 2 * workers:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            in_flight[executor.submit(_scan_chunk, chunk, options)] = chunk
+
+    try:
+        submit()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                chunk = in_flight.pop(future)
+                try:
+                    outcomes = future.result()
+                except Exception as e:
+                    outcomes = [(source.key, None, f"Worker failed: {e}") for source in chunk]
+                for key, result, error in outcomes:
+                    if result is not None:
+                        try:
+                            output = write_page(directory, by_key[key], result)
+                        except ValueError as e:
+                            result, error = None, str(e)
+                    entry = {"source": key, "status": "failed", "error": error}
+                    if result is not None:
+                        entry = {"source": key, "status": "ok", "output": output,
+                                 "method": result["method"],
+                                 "ms": round(sum(result["timings"].values()), 1),
+                                 "peak_rss_mb": result["peak_rss_mb"]}
+                        summary["pages"] += 1
+                        summary["peak_rss_mb"] = max(summary["peak_rss_mb"],
+                                                     result["peak_rss_mb"] or 0)
+                        summary["methods"][result["method"]] += 1
+                    else:
+                        summary["failed"] += 1
+                        print(f"{key}: {error}", file=sys.stderr)
+                    manifest.record(entry)
+                done = summary["pages"] + summary["failed"]
+                if done - reported >= PROGRESS_EVERY or done == len(todo):
+                    reported = done
+                    print(f"{done}/{len(todo)} pages, "
+                          f"{done / (time.perf_counter() - start):.2f} pages/s", file=sys.stderr)
+            submit()
+    except KeyboardInterrupt:
+        summary["interrupted"] = True
+        executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        executor.shutdown()
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    summary["pages_per_second"] = round(summary["pages"] / max(summary["seconds"], 1e-9), 3)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan directories, globs or zip archives of photos")
+    parser.add_argument("inputs", nargs="+", help="directories, image files, globs or .zip archives")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("--filter-mode", default="enhanced", choices=FILTER_MODES)
+    parser.add_argument("--profile", default=None, choices=FILTER_PROFILES)
+    parser.add_argument("--output-dpi", type=int, default=None)
+    parser.add_argument("--output-format", default="auto", choices=OUTPUT_FORMATS)
+    parser.add_argument("--quality", type=int, default=None)
+    parser.add_argument("--target-kb", type=int, default=None)
+    parser.add_argument("--model-path", default=None)
+    parser.add_argument("--detector", default=None, choices=DETECTOR_BACKENDS,
+                        help="detector backend (default: PIZEL_DETECTOR)")
+    parser.add_argument("--workers", type=int, default=SCAN_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE,
+                        help="pages per batched detector pass")
+    parser.add_argument("--pdf", action="store_true",
+                        help="also write one PDF per input directory/archive")
+    parser.add_argument("--page-size", default="fit", choices=PDF_PAGE_SIZES)
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore the manifest and scan everything again")
+    args = parser.parse_args(argv)
+
+    try:
+        sources = collect_sources(args.inputs)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    os.makedirs(args.output, exist_ok=True)
+    options = {"filter_mode": args.filter_mode, "model_path": args.model_path or active_model_path(),
+               "detector_backend": args.detector or active_backend(),
+               "output_dpi": args.output_dpi, "profile": args.profile,
+               "encoding": {"fmt": args.output_format, "quality": args.quality,
+                            "target_bytes": args.target_kb * 1024 if args.target_kb else None}}
+    manifest = Manifest(args.output)
+    try:
+        manifest.open(options, args.restart)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        summary = run(sources, args.output, options, max(1, args.workers), args.batch_size,
+                      manifest)
+    finally:
+        manifest.close()
+    if args.pdf and not summary["interrupted"]:
+        summary["pdfs"] = write_pdfs(args.output, sources, manifest, args.page_size,
+                                     args.output_dpi or OUTPUT_DPI)
+    summary["methods"] = dict(summary["methods"].most_common())
+    print(json.dumps(summary, indent=2))
+    if summary["interrupted"]:
+        return 130
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+Document detector backends. Each one turns a list of small BGR images into
+one box (x1, y1, x2, y2) or None per image (a QuadBox when the page's exact
+corners are already known):
+
+- "ultralytics": the YOLO weights through ultralytics/PyTorch
+- "onnx": an exported YOLOv8 model (see `python detectors.py export`), run by
+  onnxruntime when installed (preferring its OpenVINO provider; INT8-quantized
+  exports run as-is) or else by OpenCV's DNN module, so no PyTorch is loaded
+- "classical": the contour search over the whole proxy first; the model
+  (ultralytics or onnx, by the weights' extension) only sees pages the
+  search is not confident about. With model path "none" it never loads one.
+
+"auto" picks "onnx" for .onnx weights and "ultralytics" otherwise.
+"""
+import argparse
+import logging
+import os
+import sys
+from collections import Counter
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("pizel.scanner")
+
+DETECTOR_BACKENDS = ("auto", "ultralytics", "onnx", "classical")
+DOCUMENT_CLASS_ID = 73  # 'book' in COCO
+WARMUP_SIZE = 640
+# Ultralytics' own defaults, so every backend picks the same boxes
+BOX_CONFIDENCE = 0.25
+NMS_IOU = 0.7
+# Letterbox padding value used by the YOLO exports
+PAD_VALUE = 114
+# Execution providers tried in order by the onnx backend
+ONNX_PROVIDERS = ("OpenVINOExecutionProvider", "CPUExecutionProvider")
+
+
+def resolve_backend(backend, model_path):
+    """Concrete backend name for "auto" (and for the model behind "classical")"""
+    if backend in (None, "auto"):
+        return "onnx" if str(model_path).lower().endswith(".onnx") else "ultralytics"
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend: {backend}")
+    return backend
+
+
+class Detector:
+    """Common counters; subclasses implement _detect(images)"""
+
+    name = None
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        # images seen, images with a box, and (classical) images the model never saw
+        self.stats = Counter()
+
+    def detect(self, images):
+        boxes = self._detect(images)
+        self.stats["images"] += len(images)
+        self.stats["boxes"] += sum(box is not None for box in boxes)
+        return boxes
+
+    def warmup(self):
+        # First inference pays for lazy layer init / fusing; do it now, not on a request
+        self._detect([np.zeros((WARMUP_SIZE, WARMUP_SIZE, 3), dtype=np.uint8)])
+
+
+class QuadBox(tuple):
+    """
+    A box (x1, y1, x2, y2) that also carries the page's four corners (4x2
+    float32, same pixels), so the corner search need not run again
+    """
+
+    def __new__(cls, box, corners):
+        self = super().__new__(cls, box)
+        self.corners = corners
+        return self
+
+    def __reduce__(self):
+        # Crosses process boundaries from the scan workers
+        return QuadBox, (tuple(self), self.corners)
+
+
+def largest_box(boxes, classes):
+    """Largest 'book' box among (x1, y1, x2, y2) boxes with their class ids"""
+    selected_box, max_area = None, 0
+    for box, cls in zip(boxes, classes):
+        if cls == DOCUMENT_CLASS_ID:
+            x1, y1, x2, y2 = map(int, box)
+            area = (x2 - x1) * (y2 - y1)
+            if area > max_area:
+                max_area = area
+                selected_box = (x1, y1, x2, y2)
+    return selected_box
+
+
+def select_document_box(result):
+    """Pick the largest 'book' box from one YOLO result"""
+    return largest_box(result.boxes.xyxy.cpu().numpy(),
+                       result.boxes.cls.cpu().numpy().astype(int))
+
+
+class UltralyticsDetector(Detector):
+    name = "ultralytics"
+
+    def __init__(self, model_path):
+        super().__init__(model_path)
+        # Imported on first use: ultralytics pulls in torch, which only the
+        # scan workers need, not the API process or tools importing this module
+        from ultralytics import YOLO
+        self.model = YOLO(model_path)
+
+    def _detect(self, images):
+        return [select_document_box(r) for r in self.model(images, verbose=False)]
+
+
+def letterbox(image, size):
+    """Fit image into a square model input, centered; returns (blob, scale, pad)"""
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    resized = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                         interpolation=cv2.INTER_LINEAR)
+    pad_x = (size - resized.shape[1]) // 2
+    pad_y = (size - resized.shape[0]) // 2
+    canvas = cv2.copyMakeBorder(resized, pad_y, size - resized.shape[0] - pad_y,
+                                pad_x, size - resized.shape[1] - pad_x,
+                                cv2.BORDER_CONSTANT, value=(PAD_VALUE,) * 3)
+    blob = cv2.dnn.blobFromImage(canvas, 1 / 255, swapRB=True)
+    return blob, scale, (pad_x, pad_y)
+
+
+class OnnxDetector(Detector):
+    """YOLOv8 ONNX export (output 1 x (4 + classes) x anchors), one image per run"""
+
+    name = "onnx"
+
+    def __init__(self, model_path):
+        super().__init__(model_path)
+        self.input_size = WARMUP_SIZE
+        try:
+            import onnxruntime
+        except ImportError:
+            onnxruntime = None
+        if onnxruntime is not None:
+            available = onnxruntime.get_available_providers()
+            providers = [p for p in ONNX_PROVIDERS if p in available] or available
+            self.session = onnxruntime.InferenceSession(model_path, providers=providers)
+            model_input = self.session.get_inputs()[0]
+            self.input_name = model_input.name
+            if isinstance(model_input.shape[-1], int):
+                self.input_size = model_input.shape[-1]
+            self.runtime = f"onnxruntime ({providers[0]})"
+        else:
+            self.session = None
+            self.net = cv2.dnn.readNetFromONNX(model_path)
+            self.runtime = "opencv-dnn"
+        logger.info("ONNX detector %s on %s", model_path, self.runtime)
+
+    def _run(self, blob):
+        if self.session is not None:
+            return self.session.run(None, {self.input_name: blob})[0]
+        self.net.setInput(blob)
+        return self.net.forward()
+
+    def _box(self, output, scale, pad, shape):
+        predictions = output[0]
+        if predictions.shape[0] < predictions.shape[1]:
+            predictions = predictions.T  # anchors x (4 + classes)
+        # Like ultralytics: each anchor is the class it scores highest, so only
+        # anchors whose best class is 'book' count, however they score on it
+        class_scores = predictions[:, 4:]
+        scores = class_scores[:, DOCUMENT_CLASS_ID]
+        keep = (class_scores.argmax(axis=1) == DOCUMENT_CLASS_ID) & (scores >= BOX_CONFIDENCE)
+        if not keep.any():
+            return None
+        cx, cy, w, h = predictions[keep, :4].T
+        rects = np.stack([cx - w / 2, cy - h / 2, w, h], axis=1)
+        kept = cv2.dnn.NMSBoxes(rects.tolist(), scores[keep].tolist(), BOX_CONFIDENCE, NMS_IOU)
+        if len(kept) == 0:
+            return None
+        rects = rects[np.asarray(kept).ravel()]
+        # Back to image pixels
+        x1 = np.clip((rects[:, 0] - pad[0]) / scale, 0, shape[1])
+        y1 = np.clip((rects[:, 1] - pad[1]) / scale, 0, shape[0])
+        x2 = np.clip((rects[:, 0] + rects[:, 2] - pad[0]) / scale, 0, shape[1])
+        y2 = np.clip((rects[:, 1] + rects[:, 3] - pad[1]) / scale, 0, shape[0])
+        return largest_box(np.stack([x1, y1, x2, y2], axis=1), [DOCUMENT_CLASS_ID] * len(rects))
+
+    def _detect(self, images):
+        boxes = []
+        for image in images:
+            blob, scale, pad = letterbox(image, self.input_size)
+            boxes.append(self._box(self._run(blob), scale, pad, image.shape))
+        return boxes
+
+
+class ClassicalFirstDetector(Detector):
+    """
+    locate(image) returns a box when the contour search is confident, else None;
+    pages without one go to the fallback detector (if any).
+    """
+
+    name = "classical"
+
+    def __init__(self, model_path, locate, fallback=None):
+        super().__init__(model_path)
+        self.locate = locate
+        self.fallback = fallback
+
+    def warmup(self):
+        if self.fallback is not None:
+            self.fallback.warmup()
+
+    def _detect(self, images):
+        boxes = [self.locate(image) for image in images]
+        missing = [i for i, box in enumerate(boxes) if box is None]
+        self.stats["classical"] += len(images) - len(missing)
+        if missing and self.fallback is not None:
+            for i, box in zip(missing, self.fallback.detect([images[i] for i in missing])):
+                boxes[i] = box
+        return boxes
+
+
+def create_detector(backend, model_path, locate=None):
+    """Build (not warm up) a detector; locate is the classical backend's contour search"""
+    backend = resolve_backend(backend, model_path)
+    if backend == "classical":
+        fallback = None
+        if model_path and model_path != "none":
+            fallback = create_detector("auto", model_path)
+        return ClassicalFirstDetector(model_path, locate, fallback)
+    if backend == "onnx":
+        return OnnxDetector(model_path)
+    return UltralyticsDetector(model_path)
+
+
+def export(model_path, int8=False, size=WARMUP_SIZE, calibration_images=32):
+    """Export YOLO weights to ONNX (optionally INT8-quantized); returns the .onnx path"""
+    from ultralytics import YOLO
+    onnx_path = YOLO(model_path).export(format="onnx", imgsz=size)
+    if not int8:
+        return onnx_path
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, quantize_static
+    from benchmark import make_scene
+
+    class SyntheticPages(CalibrationDataReader):
+        # Calibrate on the benchmark's synthetic document photos
+        def __init__(self):
+            self.blobs = (letterbox(make_scene(seed, 1200, 1600)[0], size)[0]
+                          for seed in range(calibration_images))
+
+        def get_next(self):
+            blob = next(self.blobs, None)
+            return None if blob is None else {"images": blob}  # the export's input name
+
+    int8_path = os.path.splitext(onnx_path)[0] + "-int8.onnx"
+    quantize_static(onnx_path, int8_path, SyntheticPages(),
+                    quant_format=QuantFormat.QDQ, per_channel=True)
+    return int8_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the detector for the onnx backend")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="YOLO weights -> ONNX")
+    export_parser.add_argument("model_path")
+    export_parser.add_argument("--int8", action="store_true",
+                               help="also quantize to INT8 (needs onnxruntime), calibrated "
+                                    "on synthetic document photos")
+    export_parser.add_argument("--size", type=int, default=WARMUP_SIZE, help="input size")
+    args = parser.parse_args(argv)
+    print(export(args.model_path, args.int8, args.size))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Near-duplicate uploads within one request (a shaky retake, a burst capture).
+Each photo gets a cheap signature from a reduced decode: a perceptual hash, a
+small thumbnail and its sharpness (variance of the Laplacian). Photos whose
+hashes are close are confirmed by phase-correlating their thumbnails, which
+tolerates the small shift of a retake but not a different page shot from the
+same spot. Only the sharpest photo of each group is scanned.
+"""
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from source_image import open_source
+
+# Opt-in: clients matching pages by position expect one result per upload
+DEDUPE_PAGES = os.environ.get("PIZEL_DEDUPE_PAGES", "0") == "1"
+# Max differing bits of the 64-bit hashes for two photos to be compared at all
+HASH_DISTANCE = int(os.environ.get("PIZEL_DUPLICATE_HASH_DISTANCE", 20))
+# Min phase-correlation peak of the thumbnails' fine detail to call them duplicates;
+# retakes score ~0.6-1, different pages below ~0.2
+MATCH_RESPONSE = float(os.environ.get("PIZEL_DUPLICATE_MATCH", 0.4))
+# Longest side of the grayscale frame sharpness is measured on
+SHARPNESS_SIZE = 768
+THUMBNAIL_SIZE = 256
+HASH_SIZE = 32  # DCT input; the hash keeps its 8x8 lowest frequencies
+# Photos whose aspect ratios differ by more than this are never duplicates
+ASPECT_TOLERANCE = 0.02
+
+Signature = namedtuple("Signature", ["hash", "thumbnail", "sharpness", "aspect"])
+
+
+def _resize_to(gray, size):
+    height, width = gray.shape
+    scale = min(1.0, size / max(height, width))
+    if scale == 1.0:
+        return gray
+    return cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def perceptual_hash(gray):
+    """64-bit DCT hash: which low frequencies are above their median"""
+    small = cv2.resize(gray, (HASH_SIZE, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(small.astype(np.float32))[:8, :8]
+    return np.packbits(low > np.median(low))
+
+
+def sharpness(gray):
+    """Variance of the Laplacian; higher is sharper"""
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+def page_signature(image_source):
+    """Signature of an upload (bytes, path or array), or None if it cannot be decoded"""
+    source = open_source(image_source)
+    if source is None:
+        return None
+    try:
+        image, _ = source.decode(min(1.0, SHARPNESS_SIZE / max(source.width, source.height)))
+    except ValueError:
+        return None
+    gray = _resize_to(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), SHARPNESS_SIZE)
+    # Fine detail only, so lighting changes between shots do not count
+    thumbnail = cv2.resize(gray, (THUMBNAIL_SIZE, THUMBNAIL_SIZE),
+                           interpolation=cv2.INTER_AREA).astype(np.float32)
+    thumbnail -= cv2.GaussianBlur(thumbnail, (0, 0), 3)
+    return Signature(perceptual_hash(gray), thumbnail, sharpness(gray),
+                     gray.shape[1] / gray.shape[0])
+
+
+def is_duplicate(a, b, hash_distance=HASH_DISTANCE, match_response=MATCH_RESPONSE):
+    """True when two signatures show the same page"""
+    if abs(a.aspect - b.aspect) > ASPECT_TOLERANCE * max(a.aspect, b.aspect):
+        return False
+    if np.unpackbits(a.hash ^ b.hash).sum() > hash_distance:
+        return False
+    window = cv2.createHanningWindow((THUMBNAIL_SIZE, THUMBNAIL_SIZE), cv2.CV_32F)
+    _, response = cv2.phaseCorrelate(a.thumbnail, b.thumbnail, window)
+    return response >= match_response
+
+
+def find_duplicates(signatures):
+    """
+    Group near-duplicate photos; returns {index: index of the photo kept in its
+    place} for every photo not worth scanning. The sharpest photo of a group is
+    kept. Signatures that are None (undecodable) are never grouped.
+    """
+    groups = []  # lists of indexes; the first one is the group's reference photo
+    for index, signature in enumerate(signatures):
+        if signature is None:
+            continue
+        for group in groups:
+            if is_duplicate(signatures[group[0]], signature):
+                group.append(index)
+                break
+        else:
+            groups.append([index])
+
+    duplicate_of = {}
+    for group in groups:
+        kept = max(group, key=lambda i: signatures[i].sharpness)
+        for index in group:
+            if index != kept:
+                duplicate_of[index] = kept
+    return duplicate_of
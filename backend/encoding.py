@@ -0,0 +1,102 @@
+"""
+Output encoding for finished pages.
+"auto" picks the format from the filter: bilevel "bw" pages become 1-bit PNG
+(far smaller than JPEG for text), everything else JPEG, single-channel when
+the page is gray. JPEG/WebP take an explicit quality or a target size that is
+met by a short binary search over the quality.
+"""
+import os
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+OUTPUT_FORMATS = ("auto", "jpeg", "webp", "png")
+DEFAULT_JPEG_QUALITY = int(os.environ.get("PIZEL_JPEG_QUALITY", 95))  # OpenCV's default
+MIN_SEARCH_QUALITY = 30
+MAX_SEARCH_STEPS = 6
+
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+# data: encoded bytes; quality: JPEG/WebP quality used (None for PNG);
+# encode_ms: wall time spent encoding, including any quality search
+EncodedPage = namedtuple("EncodedPage", "data format mime quality encode_ms")
+
+
+def is_gray(image):
+    """True if the page carries no color (single channel, or three equal channels)"""
+    if image.ndim == 2:
+        return True
+    # Cheap rejection on a sparse sample before checking every pixel
+    sample = image[::16, ::16]
+    if not (np.array_equal(sample[..., 0], sample[..., 1])
+            and np.array_equal(sample[..., 1], sample[..., 2])):
+        return False
+    return (np.array_equal(image[..., 0], image[..., 1])
+            and np.array_equal(image[..., 1], image[..., 2]))
+
+
+def _encode(image, fmt, quality=None):
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        ext = ".jpg"
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        ext = ".webp"
+    elif fmt == "png":
+        params = [cv2.IMWRITE_PNG_BILEVEL, 1] if quality == "bilevel" else []
+        ext = ".png"
+    else:
+        raise ValueError(f"Unknown output format: {fmt}")
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"Could not encode page as {fmt}")
+    return buffer.tobytes()
+
+
+def _search_quality(image, fmt, target_bytes):
+    """Highest quality whose output fits in target_bytes (or the smallest tried)"""
+    low, high = MIN_SEARCH_QUALITY, DEFAULT_JPEG_QUALITY
+    best = None
+    for _ in range(MAX_SEARCH_STEPS):
+        if low > high:
+            break
+        quality = (low + high) // 2
+        data = _encode(image, fmt, quality)
+        if len(data) <= target_bytes:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            high = quality - 1
+    if best is None:
+        best = (_encode(image, fmt, MIN_SEARCH_QUALITY), MIN_SEARCH_QUALITY)
+    return best
+
+
+def encode_page(image, filter_mode=None, fmt="auto", quality=None, target_bytes=None):
+    """Encode a finished page; returns an EncodedPage with payload size and encode time"""
+    start = time.perf_counter()
+
+    if is_gray(image) and image.ndim == 3:
+        # Gray content in a color container: keep one channel
+        image = np.ascontiguousarray(image[..., 0])
+
+    if fmt == "auto":
+        fmt = "png" if filter_mode == "bw" else "jpeg"
+
+    if fmt == "png":
+        bilevel = filter_mode == "bw"
+        if bilevel:
+            # Straightening may have softened the edges; snap back to pure black & white
+            image = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)[1]
+        data = _encode(image, "png", "bilevel" if bilevel else None)
+        used_quality = None
+    elif target_bytes and quality is None:
+        data, used_quality = _search_quality(image, fmt, target_bytes)
+    else:
+        used_quality = quality or DEFAULT_JPEG_QUALITY
+        data = _encode(image, fmt, used_quality)
+
+    encode_ms = (time.perf_counter() - start) * 1000
+    return EncodedPage(data, fmt, MIME_TYPES[fmt], used_quality, encode_ms)
@@ -0,0 +1,73 @@
+"""
+Per-image analysis context shared by the pipeline stages.
+Derived planes (gray, blur, Canny, Otsu) and Hough line sets are computed on
+first use and cached, so contour search, rotation and filtering never redo them.
+Cached planes are shared: callers must treat them as read-only.
+"""
+import cv2
+import numpy as np
+
+
+class ImageAnalysis:
+    def __init__(self, image, parent=None, region=None):
+        self.image = image
+        self._parent = parent
+        self._region = region  # (y1, y2, x1, x2) inside the parent
+        self._planes = {}
+        self._lines = {}
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    def _plane(self, key, compute):
+        plane = self._planes.get(key)
+        if plane is None:
+            # A crop reuses the parent's plane as a view when it is already computed
+            if self._parent is not None:
+                parent_plane = self._parent._planes.get(key)
+                if parent_plane is not None:
+                    y1, y2, x1, x2 = self._region
+                    plane = parent_plane[y1:y2, x1:x2]
+            if plane is None:
+                plane = compute()
+            self._planes[key] = plane
+        return plane
+
+    @property
+    def gray(self):
+        # Single-channel input is used as-is, never copied
+        if self.image.ndim == 2:
+            return self.image
+        return self._plane("gray", lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+
+    def blur(self, ksize=5):
+        return self._plane(("blur", ksize),
+                           lambda: cv2.GaussianBlur(self.gray, (ksize, ksize), 0))
+
+    def edges(self, low=50, high=150, blurred=True):
+        source = self.blur if blurred else (lambda: self.gray)
+        return self._plane(("edges", low, high, blurred),
+                           lambda: cv2.Canny(source(), low, high))
+
+    def otsu(self):
+        return self._plane("otsu", lambda: cv2.threshold(
+            self.blur(), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1])
+
+    def hough_lines(self, threshold, blurred=True):
+        key = (threshold, blurred)
+        if key not in self._lines:
+            self._lines[key] = cv2.HoughLines(self.edges(blurred=blurred), 1, np.pi / 180,
+                                              threshold=threshold)
+        return self._lines[key]
+
+    def crop(self, x1, y1, x2, y2):
+        """Analysis of a sub-region whose image (and cached planes) are views into this one"""
+        return ImageAnalysis(self.image[y1:y2, x1:x2], parent=self, region=(y1, y2, x1, x2))
+
+
+def as_analysis(image):
+    """Wrap a plain image; an existing ImageAnalysis is passed through"""
+    if isinstance(image, ImageAnalysis):
+        return image
+    return ImageAnalysis(image)
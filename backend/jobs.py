@@ -0,0 +1,248 @@
+"""
+Background scan jobs for large batches.
+Submitting returns a job ID at once; a bounded priority queue feeds the pages
+to the scan pool in chunks and clients poll or subscribe for per-page progress.
+Finished jobs are kept in a size-limited store until they expire, and their
+failed pages can be retried without re-running the pages that succeeded.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from worker_pool import PoolBusyError
+
+logger = logging.getLogger("pizel.jobs")
+
+JOB_QUEUE_PAGES = int(os.environ.get("PIZEL_JOB_QUEUE_PAGES", 512))
+JOB_RUNNERS = int(os.environ.get("PIZEL_JOB_RUNNERS", 2))
+JOB_STORE_MB = int(os.environ.get("PIZEL_JOB_STORE_MB", 256))
+JOB_TTL = float(os.environ.get("PIZEL_JOB_TTL", 3600))
+# Pages handed to the scan pool per call, each call with its own timeout, so a job
+# of any size fits the pool's queue and a long job is not cut off by one deadline
+JOB_CHUNK_PAGES = int(os.environ.get("PIZEL_JOB_CHUNK_PAGES", 16))
+JOB_CHUNK_TIMEOUT = float(os.environ.get("PIZEL_JOB_CHUNK_TIMEOUT", 120))
+# Pause before retrying when the scan pool is full of interactive requests
+POOL_BUSY_BACKOFF = 1.0
+
+RETRYABLE = ("failed", "timeout")
+
+
+class QueueFullError(Exception):
+    """Raised when a job would overflow the bounded job queue"""
+
+
+class Job:
+    def __init__(self, scan, pages, filenames, priority=0):
+        self.id = uuid.uuid4().hex
+        self.scan = scan  # fn(pages) -> one result per page, run in the scan pool
+        self.priority = priority
+        # Uploads are dropped page by page once scanned, so only failed pages keep theirs
+        self.pages = list(pages)
+        self.filenames = filenames
+        self.entries = [{"index": i, "filename": name, "status": "pending"}
+                        for i, name in enumerate(filenames)]
+        self.images = [None] * len(pages)
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at = None
+        self.expires_at = None
+        self.cancelled = False
+        self._subscribers = []
+
+    @property
+    def nbytes(self):
+        uploads = sum(len(page[0]) for page in self.pages if page is not None)
+        return uploads + sum(len(image) for image in self.images if image is not None)
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def counts(self):
+        counts = {}
+        for entry in self.entries:
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+    def summary(self):
+        return {"job_id": self.id, "status": self.status, "priority": self.priority,
+                "pages": len(self.entries), "counts": self.counts(),
+                "created_at": self.created_at, "finished_at": self.finished_at}
+
+    def subscribe(self):
+        queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def publish(self, event):
+        for queue in self._subscribers:
+            queue.put_nowait(dict(event))
+
+    def set_page(self, index, entry, image=None):
+        self.entries[index] = entry
+        self.images[index] = image
+        if entry["status"] == "ok":
+            self.pages[index] = None
+        self.publish({"event": "page", **entry})
+
+
+class JobManager:
+    def __init__(self, iter_pages, describe, max_queued_pages=JOB_QUEUE_PAGES,
+                 runners=JOB_RUNNERS, max_bytes=JOB_STORE_MB * 1024 * 1024, ttl=JOB_TTL,
+                 chunk_pages=JOB_CHUNK_PAGES, chunk_timeout=JOB_CHUNK_TIMEOUT, has_room=None):
+        # async iter_pages(scan, pages, timeout=...) -> async iterator of (position, result),
+        # like ScanWorkerPool's; raises PoolBusyError when the pool is full
+        self.iter_pages = iter_pages
+        # describe(index, filename, result) -> (entry, image), as for /process-multiple
+        self.describe = describe
+        self.chunk_pages = max(1, chunk_pages)
+        self.chunk_timeout = chunk_timeout
+        # has_room(pages) -> whether the pool can take that many pages right now
+        self.has_room = has_room or (lambda pages: True)
+        self.max_queued_pages = max_queued_pages
+        self.runners = max(1, runners)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._jobs = OrderedDict()  # job_id -> Job, oldest first
+        self._queue = None
+        self._queued_pages = 0
+        self._sequence = itertools.count()  # FIFO among jobs of equal priority
+        self._tasks = []
+
+    @property
+    def queued_pages(self):
+        return self._queued_pages
+
+    def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.runners)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _enqueue(self, job, indices):
+        if self._queued_pages + len(indices) > self.max_queued_pages:
+            raise QueueFullError(f"{self._queued_pages} pages already queued")
+        self._queued_pages += len(indices)
+        job.status = "queued"
+        job.finished_at = job.expires_at = None
+        # Higher priority first; PriorityQueue pops the smallest tuple
+        self._queue.put_nowait((-job.priority, next(self._sequence), job, indices))
+
+    def submit(self, scan, pages, filenames, priority=0):
+        """Queue a new job and return it; raises QueueFullError when the queue is full"""
+        job = Job(scan, pages, filenames, priority)
+        self._enqueue(job, list(range(len(pages))))
+        self._jobs[job.id] = job
+        self._evict()
+        return job
+
+    def get(self, job_id):
+        self._evict()
+        return self._jobs.get(job_id)
+
+    def retry(self, job):
+        """Re-queue the job's failed and timed-out pages; returns how many"""
+        indices = [i for i, entry in enumerate(job.entries) if entry["status"] in RETRYABLE]
+        if indices:
+            self._enqueue(job, indices)
+            for index in indices:
+                job.entries[index] = {"index": index, "filename": job.filenames[index],
+                                      "status": "pending"}
+        return len(indices)
+
+    def cancel(self, job):
+        """Forget a job; queued pages are skipped and a running job stops early"""
+        job.cancelled = True
+        self._jobs.pop(job.id, None)
+        if job.active:
+            self._finish(job, "cancelled")
+
+    def _evict(self):
+        # Expired jobs first, then the oldest finished ones until within the memory cap.
+        # Active jobs are never evicted.
+        now = time.time()
+        for job in [job for job in self._jobs.values()
+                    if job.expires_at is not None and job.expires_at <= now]:
+            del self._jobs[job.id]
+        total = sum(job.nbytes for job in self._jobs.values())
+        for job in list(self._jobs.values()):
+            if total <= self.max_bytes:
+                break
+            if not job.active:
+                total -= job.nbytes
+                del self._jobs[job.id]
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        job.expires_at = job.finished_at + self.ttl
+        job.publish({"event": "done", **job.summary()})
+
+    async def _run(self):
+        while True:
+            _, _, job, indices = await self._queue.get()
+            self._queued_pages -= len(indices)
+            if job.cancelled:
+                continue
+            job.status = "running"
+            try:
+                await self._scan(job, indices)
+            except Exception:
+                logger.exception("Job %s failed", job.id)
+                for index in indices:
+                    if job.entries[index]["status"] == "pending":
+                        job.set_page(index, {"index": index, "filename": job.filenames[index],
+                                             "status": "failed"})
+            if job.cancelled:
+                continue
+            counts = job.counts()
+            self._finish(job, "done" if counts.get("ok") == len(job.entries) else
+                         "partial" if counts.get("ok") else "failed")
+            logger.info("Job %s %s: %s", job.id, job.status, counts)
+            self._evict()
+
+    async def _scan(self, job, indices):
+        for start in range(0, len(indices), self.chunk_pages):
+            if job.cancelled:
+                return
+            await self._scan_chunk(job, indices[start:start + self.chunk_pages])
+
+    async def _scan_chunk(self, job, indices):
+        while True:
+            # Interactive requests have the pool; the job waits its turn. Room is
+            # checked first so a refused call does not redo its setup (hashing pages)
+            if self.has_room(len(indices)):
+                try:
+                    page_stream = await self.iter_pages(job.scan,
+                                                        [job.pages[i] for i in indices],
+                                                        timeout=self.chunk_timeout)
+                    break
+                except PoolBusyError:
+                    pass
+            await asyncio.sleep(POOL_BUSY_BACKOFF)
+        try:
+            async for position, result in page_stream:
+                index = indices[position]
+                entry, image = self.describe(index, job.filenames[index], result)
+                job.set_page(index, entry, image)
+                if job.cancelled:
+                    break
+        except asyncio.TimeoutError:
+            for index in indices:
+                if job.entries[index]["status"] == "pending":
+                    job.set_page(index, {"index": index, "filename": job.filenames[index],
+                                         "status": "timeout"})
+        finally:
+            await page_stream.aclose()
@@ -0,0 +1,35 @@
+"""
+Structured logging for the API process and scan workers.
+Records are written as one JSON object per line; the level comes from PIZEL_LOG_LEVEL.
+"""
+import json
+import logging
+import os
+
+LOG_LEVEL = os.environ.get("PIZEL_LOG_LEVEL", "INFO").upper()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(level=None):
+    """Attach the JSON handler to the 'pizel' logger tree (safe to call repeatedly)"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger("pizel")
+    root.handlers[:] = [handler]
+    root.setLevel(level or LOG_LEVEL)
+    root.propagate = False
+    return root
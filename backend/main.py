@@ -1,50 +1,893 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+import time
+STARTED = time.perf_counter()  # before the heavier imports below, to measure them
+
+from contextlib import asynccontextmanager
+from fastapi import (FastAPI, File, Form, Header, UploadFile, HTTPException, WebSocket,
+                     WebSocketDisconnect)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
+import functools
+import json
+import logging
 import os
 import base64
+import secrets
 import uuid
-from model_logic import process_uploaded_image
+from log_config import configure_logging
+from model_logic import (process_uploaded_batch, process_manual_corners, refilter_page,
+                         pack_page, resolve_batch_options, encoding_info, FILTER_MODES, FILTER_PROFILES, MAX_BATCH_SIZE,
+                         detect_document_box, OUTPUT_DPI, PIPELINE_VERSION)
+from encoding import encode_page, OUTPUT_FORMATS
+from jobs import JobManager, QueueFullError, JOB_CHUNK_PAGES
+from result_cache import ResultCache, result_key
+from timing import collect, merge_timings, server_timing
+import metrics
+from page_cache import PageCache
+from pdf_writer import IncrementalPdfWriter, PDF_PAGE_SIZES
+from preview import PreviewTracker, decode_preview_frame
+from worker_pool import ScanWorkerPool, PoolBusyError, REQUEST_TIMEOUT
+from detectors import DETECTOR_BACKENDS
+from duplicates import DEDUPE_PAGES, find_duplicates, page_signature
+from admission import AdmissionController, AdmissionError, TIERS, scan_options
+
+configure_logging()
+logger = logging.getLogger("pizel.api")
+
+# CPU-bound scanning runs in worker processes, each with the detector preloaded
+scan_pool = ScanWorkerPool()
+# Rectified pages kept for cheap re-filtering via /refilter
+page_cache = PageCache()
+# Finished results of identical uploads, so retries and re-exports skip the pipeline
+result_cache = ResultCache()
+# Concurrency limit and degrade ladder for the interactive endpoints
+admission_control = AdmissionController(scan_pool)
+
+# Cold-start phases in seconds (exported by /metrics): module imports, scan pool
+# warm-up, and the first scan request once the app is up
+startup_seconds = {"import": time.perf_counter() - STARTED}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Directory setup happens here rather than at import, so importing the app
+    # (reloads, tools, worker processes) never touches the filesystem
+    if PERSIST_FILES:
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+    result_cache.start()
+    # Start the workers and warm up their detectors before the first request arrives
+    started = time.perf_counter()
+    await scan_pool.start()
+    startup_seconds["pool"] = time.perf_counter() - started
+    job_manager.start()
+    logger.info("Startup: imports %.0f ms, scan pool warm-up %.0f ms",
+                startup_seconds["import"] * 1000, startup_seconds["pool"] * 1000)
+    yield
+    await job_manager.stop()
+    scan_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
 
-# Create folders
+def time_first_scan(endpoint):
+    """Record how long the process's first scan request takes (for pizel_startup_seconds)"""
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        if "first_request" in startup_seconds:
+            return await endpoint(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            # Until the response starts; streamed bodies keep going after this
+            if "first_request" not in startup_seconds:
+                startup_seconds["first_request"] = time.perf_counter() - started
+                logger.info("First scan request (%s) took %.0f ms", endpoint.__name__,
+                            startup_seconds["first_request"] * 1000)
+    return wrapper
+
+# Disk copies of uploads/results are optional; the request path is fully in memory
+PERSIST_FILES = os.environ.get("PIZEL_PERSIST_FILES", "0") == "1"
 UPLOAD_FOLDER = "uploads"
 PROCESSED_FOLDER = "processed"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
-@app.post("/process-multiple")
-async def process_multiple_images(files: list[UploadFile] = File(...)):
-    if not files:
-        raise HTTPException(status_code=400, detail="No files uploaded")
+# Requestable output resolution; 0 keeps the photo's native resolution
+MAX_OUTPUT_DPI = 600
 
-    processed_images_b64 = []
 
+def save_upload(data, upload_path):
+    with open(upload_path, "wb") as f:
+        f.write(data)
+
+
+async def read_uploads(files):
+    """(image_bytes, save_path) pages and their filenames; non-image files are skipped"""
+    pages = []
+    filenames = []
     for file in files:
         if file.content_type not in ["image/jpeg", "image/png"]:
             continue  # skip non-image files
 
-        # Save uploaded image
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(file_path, "wb") as f:
-            f.write(await file.read())
+        data = await file.read()
+        save_path = None
+        if PERSIST_FILES:
+            # Server-generated names so concurrent clients never overwrite each other
+            page_id = uuid.uuid4().hex
+            ext = ".png" if file.content_type == "image/png" else ".jpg"
+            await run_in_threadpool(save_upload, data, os.path.join(UPLOAD_FOLDER, page_id + ext))
+            save_path = os.path.join(PROCESSED_FOLDER, f"{page_id}.jpg")
+
+        pages.append((data, save_path))
+        filenames.append(file.filename)
+    return pages, filenames
+
+
+RESPONSE_FORMATS = ("json", "ndjson", "multipart", "pdf")
+MULTIPART_BOUNDARY = "pizel-page"
+MULTIPART_HEADERS = {"index": "X-Page-Index", "status": "X-Page-Status",
+                     "method": "X-Processing-Method", "page_id": "X-Page-Id",
+                     "duplicate_of": "X-Duplicate-Of"}
+MAX_QUALITY = 100
+
+
+def encoding_options(output_format, quality, target_kb):
+    """Validate the output encoding form fields into encode_page keyword arguments"""
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"output_format must be one of {OUTPUT_FORMATS}")
+    if quality is not None and not 1 <= quality <= MAX_QUALITY:
+        raise HTTPException(status_code=400, detail=f"quality must be 1-{MAX_QUALITY}")
+    if target_kb is not None and target_kb <= 0:
+        raise HTTPException(status_code=400, detail="target_kb must be positive")
+    return {"fmt": output_format, "quality": quality,
+            "target_bytes": target_kb * 1024 if target_kb else None}
+
+
+def page_entry(index, filename, result):
+    """Per-page outcome shared by every response format; caches the rectified page"""
+    if isinstance(result, dict) and "duplicate_of" in result:
+        return {"index": index, "filename": filename, "status": "duplicate",
+                "duplicate_of": result["duplicate_of"]}, None
+    if isinstance(result, Exception) or not result or not result["image"]:
+        if isinstance(result, Exception):
+            logger.error("Page %d failed: %s", index, result)
+        return {"index": index, "filename": filename, "status": "failed"}, None
+    entry = {"index": index, "filename": filename, "status": "ok",
+             "method": result["method"], "page_id": result["page_id"],
+             "encoding": result["encoding"]}
+    if result.get("timings"):
+        entry["timings"] = {name: round(ms, 1) for name, ms in result["timings"].items()}
+    return entry, result["image"]
+
+
+def cache_lookup(scan, pages):
+    """Result cache keys of the pages and {index: cached result}; hashes and may read disk"""
+    options = dict(resolve_batch_options(scan.keywords), model_path=scan_pool.model_path,
+                   detector_backend=scan_pool.backend, version=PIPELINE_VERSION)
+    keys = [result_key(data, options) for data, _ in pages]
+    hits = {}
+    for index, key in enumerate(keys):
+        result = result_cache.get(key)
+        if result is not None:
+            hits[index] = result
+    return keys, hits
+
+
+async def scan_pages(scan, pages, batch_size=MAX_BATCH_SIZE, timeout=REQUEST_TIMEOUT,
+                     tier=TIERS[0]):
+    """
+    scan_pool.iter_pages behind the result cache: cached pages are yielded first and
+    only the rest reach the pool. A rectified page kept by the scan (keep_pages)
+    moves into page_cache and is replaced by its "page_id". Raises PoolBusyError
+    before any work starts.
+    tier is the degrade tier the pages are scanned at (for the admission estimates).
+    """
+    keys, hits = await run_in_threadpool(cache_lookup, scan, pages)
+    misses = [index for index in range(len(pages)) if index not in hits]
+    page_stream = None
+    if misses:
+        page_stream = scan_pool.iter_pages(scan, [pages[i] for i in misses],
+                                           batch_size=batch_size, timeout=timeout)
+    return _cached_pages(hits, misses, keys, page_stream, tier)
+
+
+async def _cached_pages(hits, misses, keys, page_stream, tier):
+    for index, result in hits.items():
+        # The rectified page may have expired from page_cache even though the result has not
+        if result["page_id"] is not None and page_cache.get(result["page_id"]) is None:
+            result = dict(result, page_id=None)
+        yield index, result
+    if page_stream is None:
+        return
+    finished = 0
+    try:
+        async for position, result in page_stream:
+            index = misses[position]
+            finished += 1
+            if isinstance(result, dict):
+                result = dict(result)
+                result["page_id"] = page_cache.put(result.pop("page", None))
+                metrics.observe_page(result["method"], result["timings"],
+                                     result.get("peak_rss_mb"))
+                admission_control.observe(tier, result["timings"])
+                # Timings and memory describe this scan only; a later cache hit costs none
+                await run_in_threadpool(result_cache.put, keys[index],
+                                        {key: value for key, value in result.items()
+                                         if key not in ("timings", "peak_rss_mb")})
+            else:
+                metrics.page_failures_total.inc("error")
+            yield index, result
+    except asyncio.TimeoutError:
+        metrics.page_failures_total.inc("timeout", len(misses) - finished)
+        raise
+    finally:
+        await page_stream.aclose()
+
+
+# Background jobs share the scan pool (and the result cache) with the interactive
+# endpoints, but skip admission control: they are always scanned at the full tier.
+# Their chunks never exceed what the pool queues at once.
+job_manager = JobManager(scan_pages, page_entry,
+                         chunk_pages=min(JOB_CHUNK_PAGES, scan_pool.max_queued),
+                         has_room=lambda pages: scan_pool.pending + pages <= scan_pool.max_queued)
+
+
+def admit(pages=1, deadline=None):
+    """Admit a request or turn it away with 429/503 and a Retry-After estimate"""
+    try:
+        return admission_control.admit(pages, deadline)
+    except AdmissionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+async def release_after(stream, ticket):
+    """Hold the request's admission slot until its streamed body is finished"""
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        ticket.release()
+
+
+def check_deadline(deadline):
+    if deadline is not None and not 0 < deadline <= REQUEST_TIMEOUT:
+        raise HTTPException(status_code=400, detail=f"deadline must be 0-{REQUEST_TIMEOUT:g} seconds")
+
+
+async def stream_ndjson(page_stream, filenames):
+    """One JSON line per page as soon as it is done, then a summary line"""
+    done = set()
+    try:
+        async for index, result in page_stream:
+            entry, image = page_entry(index, filenames[index], result)
+            if image is not None:
+                entry["image"] = base64.b64encode(image).decode("utf-8")
+            done.add(index)
+            yield json.dumps(entry) + "\n"
+    except asyncio.TimeoutError:
+        for index in range(len(filenames)):
+            if index not in done:
+                yield json.dumps({"index": index, "filename": filenames[index],
+                                  "status": "timeout"}) + "\n"
+    yield json.dumps({"done": True, "pages": len(filenames)}) + "\n"
+
+
+async def dedupe_pages(pages):
+    """
+    {index: kept index} for uploads that are near-duplicates of a sharper one,
+    and the milliseconds spent finding them
+    """
+    if len(pages) < 2:
+        return {}, 0.0
+    started = time.perf_counter()
+    signatures = await asyncio.gather(*(run_in_threadpool(page_signature, data)
+                                        for data, _ in pages))
+    duplicate_of = await run_in_threadpool(find_duplicates, signatures)
+    if duplicate_of:
+        metrics.duplicate_pages_total.inc("process_multiple", len(duplicate_of))
+        logger.info("Skipping %d near-duplicate page(s)", len(duplicate_of))
+    return duplicate_of, (time.perf_counter() - started) * 1000
+
+
+async def with_duplicates(page_stream, kept, duplicate_of):
+    """
+    Map a stream over the kept pages back to upload indexes, and flag each
+    duplicate right after the page kept in its place
+    """
+    followers = {}
+    for index, kept_index in duplicate_of.items():
+        followers.setdefault(kept_index, []).append(index)
+    async for position, result in page_stream:
+        yield kept[position], result
+        for index in followers.get(kept[position], ()):
+            yield index, {"duplicate_of": kept[position]}
+
+
+def multipart_part(headers, body):
+    head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    return f"--{MULTIPART_BOUNDARY}\r\n{head}\r\n".encode() + body + b"\r\n"
+
+
+async def stream_multipart(page_stream, filenames):
+    """multipart/mixed with raw JPEG parts (no base64) as pages finish"""
+    done = set()
+    try:
+        async for index, result in page_stream:
+            entry, image = page_entry(index, filenames[index], result)
+            done.add(index)
+            headers = {header: entry[key] for key, header in MULTIPART_HEADERS.items()
+                       if entry.get(key) is not None}
+            if image is not None:
+                encoding = entry["encoding"]
+                headers["X-Encoded-Bytes"] = encoding["bytes"]
+                headers["X-Encode-Ms"] = encoding["encode_ms"]
+                yield multipart_part({"Content-Type": encoding["mime"], **headers}, image)
+            else:
+                yield multipart_part({"Content-Type": "application/json", **headers},
+                                     json.dumps(entry).encode())
+    except asyncio.TimeoutError:
+        for index in range(len(filenames)):
+            if index not in done:
+                yield multipart_part({"Content-Type": "application/json",
+                                      "X-Page-Index": index, "X-Page-Status": "timeout"},
+                                     json.dumps({"index": index, "status": "timeout"}).encode())
+    yield f"--{MULTIPART_BOUNDARY}--\r\n".encode()
+
+
+async def stream_pdf(page_stream, page_count, page_size, dpi):
+    """One PDF assembled while pages finish; page order follows the upload order"""
+    writer = IncrementalPdfWriter(page_size, dpi)
+    yield writer.start()
+    try:
+        async for index, result in page_stream:
+            if isinstance(result, dict) and "duplicate_of" in result:
+                continue
+            if isinstance(result, Exception) or not result or not result.get("pdf_image"):
+                logger.error("Page %d left out of PDF: %s", index, result)
+                continue
+            yield writer.add_page(index, result["pdf_image"])
+    except asyncio.TimeoutError:
+        logger.error("PDF timed out after %d of %d pages", writer.page_count, page_count)
+    yield writer.finish()
+
+
+@app.post("/process-multiple")
+@time_first_scan
+async def process_multiple_images(files: list[UploadFile] = File(...),
+                                  output_dpi: int | None = Form(None),
+                                  profile: str | None = Form(None),
+                                  response_format: str = Form("json"),
+                                  filter_mode: str = Form("enhanced"),
+                                  page_size: str = Form("fit"),
+                                  output_format: str = Form("auto"),
+                                  quality: int | None = Form(None),
+                                  target_kb: int | None = Form(None),
+                                  deadline: float | None = Form(None),
+                                  dedupe: bool = Form(DEDUPE_PAGES),
+                                  keep_pages: bool = Form(False)):
+    """
+    Scan every uploaded page. response_format "json" returns everything at the
+    end; "ndjson" and "multipart" stream each page as soon as it is finished;
+    "pdf" streams a single PDF (page_size "fit", "a4" or "letter").
+    output_format/quality/target_kb control how each page is encoded.
+    deadline (seconds) may lower the service tier; the tier used is reported in
+    the X-Service-Tier header. With dedupe (opt-in), near-duplicate photos (retakes,
+    burst shots) are not scanned; only the sharpest of each group is, and the others
+    are reported with status "duplicate" (left out of PDFs). In JSON they also stay
+    in the per-page lists, repeating the page kept in their place. keep_pages keeps each
+    rectified page for POST /refilter; its page_id is null otherwise.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    if output_dpi is not None and not 0 <= output_dpi <= MAX_OUTPUT_DPI:
+        raise HTTPException(status_code=400, detail=f"output_dpi must be 0-{MAX_OUTPUT_DPI}")
+    if profile is not None and profile not in FILTER_PROFILES:
+        raise HTTPException(status_code=400, detail=f"profile must be one of {FILTER_PROFILES}")
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"response_format must be one of {RESPONSE_FORMATS}")
+    if filter_mode not in FILTER_MODES:
+        raise HTTPException(status_code=400, detail=f"filter_mode must be one of {FILTER_MODES}")
+    if page_size not in PDF_PAGE_SIZES:
+        raise HTTPException(status_code=400, detail=f"page_size must be one of {PDF_PAGE_SIZES}")
+    check_deadline(deadline)
+    encoding = encoding_options(output_format, quality, target_kb)
+    page_jobs, filenames = await read_uploads(files)
+    if len(page_jobs) > scan_pool.max_queued:
+        # More than the scan pool ever queues at once: a retry would fail the same way
+        raise HTTPException(status_code=413,
+                            detail=f"At most {scan_pool.max_queued} pages per request; "
+                                   "use POST /jobs for larger batches")
+    # Admitted before deduplication, which decodes every upload: an overloaded
+    # server turns the request away before doing any work for it
+    ticket = admit(len(page_jobs), deadline)
+    try:
+        duplicate_of, dedupe_ms = await dedupe_pages(page_jobs) if dedupe else ({}, 0.0)
+    except BaseException:
+        ticket.release()
+        raise
+    kept = [index for index in range(len(page_jobs)) if index not in duplicate_of]
+    pdf = response_format == "pdf"
+    scan = functools.partial(process_uploaded_batch, filter_mode=filter_mode,
+                             output_dpi=output_dpi, keep_pages=keep_pages, pdf=pdf,
+                             encoding=encoding, **scan_options(ticket.tier, profile))
+    streaming = response_format != "json"
+    try:
+        # Spread pages across the worker pool; each worker detects its share in one
+        # batch. Streaming sends pages one per chunk so the first page is out early.
+        page_stream = await scan_pages(scan, [page_jobs[index] for index in kept],
+                                       batch_size=1 if streaming else MAX_BATCH_SIZE,
+                                       timeout=deadline or REQUEST_TIMEOUT, tier=ticket.tier)
+    except PoolBusyError:
+        ticket.release()
+        raise HTTPException(status_code=503, detail="Server busy, try again later",
+                            headers={"Retry-After": str(admission_control.retry_after())})
+    except BaseException:
+        ticket.release()
+        raise
+    page_stream = with_duplicates(page_stream, kept, duplicate_of)
+
+    tier_header = {"X-Service-Tier": ticket.tier_name}
+    if pdf:
+        return StreamingResponse(release_after(stream_pdf(page_stream, len(page_jobs), page_size,
+                                                          output_dpi or OUTPUT_DPI), ticket),
+                                 media_type="application/pdf",
+                                 headers={"Content-Disposition": 'inline; filename="scan.pdf"',
+                                          **tier_header})
+    if response_format == "ndjson":
+        return StreamingResponse(release_after(stream_ndjson(page_stream, filenames), ticket),
+                                 media_type="application/x-ndjson", headers=tier_header)
+    if response_format == "multipart":
+        return StreamingResponse(release_after(stream_multipart(page_stream, filenames), ticket),
+                                 media_type=f"multipart/mixed; boundary={MULTIPART_BOUNDARY}",
+                                 headers=tier_header)
 
-        # Generate unique output filename
-        output_filename = f"{uuid.uuid4().hex}.jpg"
-        output_path = os.path.join(PROCESSED_FOLDER, output_filename)
+    results = [None] * len(page_jobs)
+    try:
+        async for index, result in page_stream:
+            results[index] = result
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Processing timed out", headers=tier_header)
+    finally:
+        ticket.release()
 
-        # Process image and save to processed folder
-        result = process_uploaded_image(file_path, save_path=output_path, filter_mode="enhanced")
-        if result:
-            # Read processed file and encode to base64
-            with open(output_path, "rb") as img_file:
-                encoded_string = base64.b64encode(img_file.read()).decode("utf-8")
-            processed_images_b64.append(encoded_string)
+    processed_images_b64 = []
+    page_ids = []
+    methods = []
+    encodings = []
+    duplicates = []
+    for index, result in enumerate(results):
+        entry, image = page_entry(index, filenames[index], result)
+        if entry["status"] == "duplicate":
+            duplicates.append(entry)
+            # The lists stay positional: a duplicate repeats the page kept in its place
+            kept_index = entry["duplicate_of"]
+            entry, image = page_entry(kept_index, filenames[kept_index], results[kept_index])
+        if image is not None:
+            processed_images_b64.append(base64.b64encode(image).decode("utf-8"))
+            page_ids.append(entry["page_id"])
+            methods.append(entry["method"])
+            encodings.append(entry["encoding"])
 
     if not processed_images_b64:
-        raise HTTPException(status_code=500, detail="No images were processed")
+        raise HTTPException(status_code=500, detail="No images were processed",
+                            headers=tier_header)
+
+    timings = merge_timings(result.get("timings") for result in results
+                            if isinstance(result, dict))
+    if dedupe_ms:
+        timings["dedupe"] = dedupe_ms
+    return JSONResponse(content={"processed_images": processed_images_b64,
+                                 "page_ids": page_ids,
+                                 "methods": methods,
+                                 "encodings": encodings,
+                                 "duplicates": duplicates,
+                                 "tier": ticket.tier_name},
+                        # Cache hits cost no stage time, so a fully cached request has none
+                        headers={"Server-Timing": server_timing(timings), **tier_header}
+                        if timings else tier_header)
+
+
+MAX_JOB_PRIORITY = 9
+
+
+def job_or_404(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job expired or unknown")
+    return job
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(files: list[UploadFile] = File(...),
+                     filter_mode: str = Form("enhanced"),
+                     profile: str | None = Form(None),
+                     output_dpi: int | None = Form(None),
+                     priority: int = Form(0),
+                     output_format: str = Form("auto"),
+                     quality: int | None = Form(None),
+                     target_kb: int | None = Form(None)):
+    """
+    Queue a batch scan and return its job ID immediately. Poll GET /jobs/{id}
+    or subscribe to GET /jobs/{id}/events for per-page progress.
+    Higher priority jobs (0-9) are scanned first.
+    """
+    if filter_mode not in FILTER_MODES:
+        raise HTTPException(status_code=400, detail=f"filter_mode must be one of {FILTER_MODES}")
+    if profile is not None and profile not in FILTER_PROFILES:
+        raise HTTPException(status_code=400, detail=f"profile must be one of {FILTER_PROFILES}")
+    if output_dpi is not None and not 0 <= output_dpi <= MAX_OUTPUT_DPI:
+        raise HTTPException(status_code=400, detail=f"output_dpi must be 0-{MAX_OUTPUT_DPI}")
+    if not 0 <= priority <= MAX_JOB_PRIORITY:
+        raise HTTPException(status_code=400, detail=f"priority must be 0-{MAX_JOB_PRIORITY}")
+    encoding = encoding_options(output_format, quality, target_kb)
+
+    pages, filenames = await read_uploads(files)
+    if not pages:
+        raise HTTPException(status_code=400, detail="No image files uploaded")
+
+    # Job pages are not kept for /refilter: they would push live requests' pages out
+    scan = functools.partial(process_uploaded_batch, filter_mode=filter_mode,
+                             output_dpi=output_dpi, profile=profile, encoding=encoding)
+    try:
+        job = job_manager.submit(scan, pages, filenames, priority)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Job queue full, try again later",
+                            headers={"Retry-After": "30"})
+    return {"job_id": job.id, "status": job.status, "pages": len(pages)}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, include_images: bool = False):
+    """Job progress and per-page results; images are fetched per page unless include_images"""
+    job = job_or_404(job_id)
+    pages = []
+    for entry, image in zip(job.entries, job.images):
+        entry = dict(entry)
+        if include_images and image is not None:
+            entry["image"] = base64.b64encode(image).decode("utf-8")
+        pages.append(entry)
+    return {**job.summary(), "results": pages}
+
+
+@app.get("/jobs/{job_id}/pages/{index}")
+async def job_page(job_id: str, index: int):
+    """Raw encoded image of one finished page"""
+    job = job_or_404(job_id)
+    if not 0 <= index < len(job.entries):
+        raise HTTPException(status_code=404, detail="No such page")
+    image = job.images[index]
+    if image is None:
+        raise HTTPException(status_code=404, detail=f"Page is {job.entries[index]['status']}")
+    return Response(content=image, media_type=job.entries[index]["encoding"]["mime"])
+
+
+async def stream_job_events(job):
+    """Server-sent events: pages finished so far, then each page as it finishes"""
+    # Subscribing and snapshotting happen without an await in between, so no event is missed
+    queue = job.subscribe()
+    try:
+        for entry in job.entries:
+            if entry["status"] != "pending":
+                yield f"event: page\ndata: {json.dumps(entry)}\n\n"
+        if not job.active:
+            yield f"event: done\ndata: {json.dumps(job.summary())}\n\n"
+            return
+        while True:
+            event = await queue.get()
+            name = event["event"]
+            data = {key: value for key, value in event.items() if key != "event"}
+            yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+            if name == "done":
+                return
+    finally:
+        job.unsubscribe(queue)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    return StreamingResponse(stream_job_events(job_or_404(job_id)),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/jobs/{job_id}/retry", status_code=202)
+async def retry_job(job_id: str):
+    """Re-queue only the pages that failed or timed out"""
+    job = job_or_404(job_id)
+    if job.active:
+        raise HTTPException(status_code=409, detail="Job is still running")
+    try:
+        retried = job_manager.retry(job)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Job queue full, try again later",
+                            headers={"Retry-After": "30"})
+    return {"job_id": job.id, "status": job.status, "retried": retried}
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Cancel a job (if still running) and drop its results"""
+    job_manager.cancel(job_or_404(job_id))
+    return {"job_id": job_id, "status": "cancelled"}
+
+
+def with_timings(fn, *args):
+    """Call fn with a stage collector open on this thread; returns (result, timings)"""
+    with collect() as timings:
+        return fn(*args), timings
+
+
+@app.post("/refilter")
+async def refilter(page_id: str = Form(...), filter_mode: str = Form("enhanced"),
+                   profile: str | None = Form(None), straighten: bool = Form(True),
+                   output_format: str = Form("auto"), quality: int | None = Form(None),
+                   target_kb: int | None = Form(None)):
+    """
+    Re-render a page kept by a scan (keep_pages) with another filter, skipping
+    detection and warping. Like /process-manual it runs in the API's thread
+    pool, so it does not queue behind full scans.
+    """
+    if filter_mode not in FILTER_MODES:
+        raise HTTPException(status_code=400, detail=f"filter_mode must be one of {FILTER_MODES}")
+    if profile is not None and profile not in FILTER_PROFILES:
+        raise HTTPException(status_code=400, detail=f"profile must be one of {FILTER_PROFILES}")
+    encoding = encoding_options(output_format, quality, target_kb)
+
+    page = page_cache.get(page_id)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Page expired or unknown, upload it again")
+
+    ticket = admit()
+    options = scan_options(ticket.tier, profile)
+    try:
+        encoded, timings = await run_in_threadpool(refilter_page, page, filter_mode,
+                                                   options["profile"],
+                                                   straighten and options["straighten"],
+                                                   encoding)
+    finally:
+        ticket.release()
+    if encoded is None:
+        raise HTTPException(status_code=500, detail="Could not decode the cached page")
+    metrics.observe_stages(timings)
+    return JSONResponse(content={"page_id": page_id,
+                                 "processed_image": base64.b64encode(encoded.data).decode("utf-8"),
+                                 "encoding": encoding_info(encoded),
+                                 "tier": ticket.tier_name},
+                        headers={"Server-Timing": server_timing(timings),
+                                 "X-Service-Tier": ticket.tier_name})
+
+@app.post("/process-manual")
+@time_first_scan
+async def process_manual(file: UploadFile = File(...), points: str = Form(...),
+                         filter_mode: str = Form("enhanced"), profile: str | None = Form(None),
+                         output_dpi: int | None = Form(None), snap: bool = Form(False),
+                         normalized: bool = Form(False), output_format: str = Form("auto"),
+                         quality: int | None = Form(None), target_kb: int | None = Form(None),
+                         keep_page: bool = Form(False)):
+    """
+    Warp one page from four user-picked corners (JSON [[x, y], ...]) and filter it.
+    Skips the detector entirely, so it stays fast while the scan pool is busy.
+    keep_page keeps the rectified page for POST /refilter.
+    """
+    if file.content_type not in ["image/jpeg", "image/png"]:
+        raise HTTPException(status_code=400, detail="Only JPEG and PNG images are supported")
+    if filter_mode not in FILTER_MODES:
+        raise HTTPException(status_code=400, detail=f"filter_mode must be one of {FILTER_MODES}")
+    if profile is not None and profile not in FILTER_PROFILES:
+        raise HTTPException(status_code=400, detail=f"profile must be one of {FILTER_PROFILES}")
+    if output_dpi is not None and not 0 <= output_dpi <= MAX_OUTPUT_DPI:
+        raise HTTPException(status_code=400, detail=f"output_dpi must be 0-{MAX_OUTPUT_DPI}")
+    encoding = encoding_options(output_format, quality, target_kb)
+    try:
+        corners = json.loads(points)
+        if len(corners) != 4 or any(len(point) != 2 for point in corners):
+            raise ValueError
+        corners = [[float(x), float(y)] for x, y in corners]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="points must be four [x, y] pairs")
+
+    data = await file.read()
+    ticket = admit()
+    options = scan_options(ticket.tier, profile)
+    try:
+        # Runs in the API process's thread pool, not on the (possibly saturated) scan workers;
+        # the photo is decoded only as far as the output needs
+        try:
+            result, timings = await run_in_threadpool(with_timings, process_manual_corners, data,
+                                                      corners, filter_mode, options["profile"],
+                                                      output_dpi, snap, normalized,
+                                                      options["straighten"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if result is None:
+            raise HTTPException(status_code=400, detail="Could not decode image")
+        encoded = await run_in_threadpool(functools.partial(encode_page, result.image,
+                                                            filter_mode, **encoding))
+        page_id = page_cache.put(await run_in_threadpool(pack_page, result.page)) \
+            if keep_page else None
+    finally:
+        ticket.release()
+    timings["encode"] = encoded.encode_ms
+    metrics.observe_page(result.method, timings)
+
+    return JSONResponse(content={"processed_image": base64.b64encode(encoded.data).decode("utf-8"),
+                                 "page_id": page_id,
+                                 "method": result.method,
+                                 "encoding": encoding_info(encoded),
+                                 "tier": ticket.tier_name},
+                        headers={"Server-Timing": server_timing(timings),
+                                 "X-Service-Tier": ticket.tier_name})
+
+# Admin endpoints need this token in an X-Admin-Token header; unset disables them
+ADMIN_TOKEN = os.environ.get("PIZEL_ADMIN_TOKEN", "")
+# /admin/model only loads weights by file name from this directory
+MODEL_DIR = os.environ.get("PIZEL_MODEL_DIR", ".")
+MODEL_EXTENSIONS = (".pt", ".onnx")
+
+
+def require_admin(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if token is None or not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def model_file(name):
+    """Path of a weights file in MODEL_DIR by its bare file name ("none": no model)"""
+    if name == "none":
+        return name
+    if (os.path.basename(name) != name or name.startswith(".")
+            or not name.lower().endswith(MODEL_EXTENSIONS)):
+        raise HTTPException(status_code=400,
+                            detail=f"model_path must be a {'/'.join(MODEL_EXTENSIONS)} file name "
+                                   "in the model directory")
+    path = os.path.normpath(os.path.join(MODEL_DIR, name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=400, detail=f"No such model: {name}")
+    return path
+
+
+@app.get("/admin/cache")
+async def cache_stats(x_admin_token: str | None = Header(None)):
+    """Hit/miss counters and sizes of the result cache"""
+    require_admin(x_admin_token)
+    return result_cache.stats()
+
+
+# Longest wait for the detector during live preview before falling back to a
+# whole-frame contour search (the scan pool may be busy with uploads)
+PREVIEW_DETECT_TIMEOUT = 1.0
+
+
+async def preview_frame(tracker, data):
+    frame = await run_in_threadpool(decode_preview_frame, data)
+    if frame is None:
+        return {"frame": tracker.frames, "error": "Could not decode frame"}
+    if tracker.wants_detection():
+        try:
+            box = await asyncio.wait_for(scan_pool.run(detect_document_box, frame),
+                                         PREVIEW_DETECT_TIMEOUT)
+        except (asyncio.TimeoutError, PoolBusyError) as e:
+            # Expected whenever the pool is busy with uploads; a warning per frame would
+            # flood the log
+            logger.debug("Preview detection skipped: %s", e or type(e).__name__)
+            box = None
+        except Exception as e:
+            logger.warning("Preview detection failed: %s", e or type(e).__name__)
+            box = None
+        tracker.set_detection(box)
+    return await run_in_threadpool(tracker.update, frame)
+
+
+@app.websocket("/preview")
+async def live_preview(websocket: WebSocket):
+    """
+    Live camera preview: send small JPEG frames as binary messages, get one JSON
+    message per processed frame with normalized corners and a "capture" signal.
+    Frames that arrive while one is being processed replace each other, so the
+    reply is always about the newest frame. Send {"reset": true} to start over.
+    """
+    await websocket.accept()
+    tracker = PreviewTracker()
+    pending = {"data": None, "dropped": 0, "closed": False, "reset": False}
+    frame_ready = asyncio.Event()
+
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes"):
+                    if pending["data"] is not None:
+                        pending["dropped"] += 1  # stale, never processed
+                    pending["data"] = message["bytes"]
+                    frame_ready.set()
+                elif message.get("text"):
+                    try:
+                        control = json.loads(message["text"])
+                    except ValueError:
+                        continue
+                    if isinstance(control, dict) and control.get("reset"):
+                        # Applied between frames, never while the tracker is busy
+                        pending["reset"] = True
+        finally:
+            pending["closed"] = True
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            if pending["closed"]:
+                break
+            data, pending["data"] = pending["data"], None
+            if pending["reset"]:
+                tracker.reset()
+                pending["reset"] = False
+            if data is None:
+                continue
+            started = time.perf_counter()
+            result = await preview_frame(tracker, data)
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            result["dropped"] = pending["dropped"]
+            await websocket.send_json(result)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage-time histograms, pages per detection path, queue depths, cache and admission counters"""
+    cache = result_cache.stats()
+    extra = (metrics.snapshot("pizel_scan_pool_pending_pages", "Pages in flight in the scan pool",
+                              "gauge", scan_pool.pending)
+             + metrics.snapshot("pizel_job_queued_pages", "Pages waiting in the job queue",
+                                "gauge", job_manager.queued_pages)
+             + metrics.snapshot("pizel_result_cache_lookups_total", "Result cache lookups",
+                                "counter", {"memory_hit": cache["hits"]["memory"],
+                                            "disk_hit": cache["hits"]["disk"],
+                                            "miss": cache["misses"]}, label="result")
+             + metrics.snapshot("pizel_page_cache_bytes", "Memory held by rectified pages",
+                                "gauge", page_cache.nbytes)
+             + metrics.snapshot("pizel_startup_seconds", "Cold-start phases of this process",
+                                "gauge", {phase: round(seconds, 4)
+                                          for phase, seconds in startup_seconds.items()},
+                                label="phase")
+             + metrics.snapshot("pizel_admission_load", "Load seen by admission control (0-1)",
+                                "gauge", round(admission_control.load(), 4))
+             + metrics.snapshot("pizel_admitted_requests_total", "Admitted requests per tier",
+                                "counter", admission_control.admitted, label="tier")
+             + metrics.snapshot("pizel_rejected_requests_total", "Requests turned away",
+                                "counter", admission_control.rejected, label="reason"))
+    return Response(content=metrics.render(extra), media_type="text/plain; version=0.0.4")
+
 
-    return JSONResponse(content={"processed_images": processed_images_b64})
+@app.post("/admin/model")
+async def swap_model(model_path: str | None = Form(None), backend: str | None = Form(None),
+                     x_admin_token: str | None = Header(None)):
+    """
+    Switch the detector weights and/or backend without restarting the server.
+    Weights are only loaded by file name from PIZEL_MODEL_DIR: they are pickles,
+    so an arbitrary path would let the caller run code in the workers.
+    """
+    require_admin(x_admin_token)
+    if model_path is None and backend is None:
+        raise HTTPException(status_code=400, detail="Give a model_path and/or a backend")
+    if backend is not None and backend not in DETECTOR_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"backend must be one of {DETECTOR_BACKENDS}")
+    if model_path is not None:
+        model_path = model_file(model_path)
+    try:
+        # Spin up workers on the new detector; the old pool drains in the background
+        await scan_pool.start(model_path, backend)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not load model: {e}")
+    return {"model_path": scan_pool.model_path, "backend": scan_pool.backend}
 
 if __name__ == "__main__":
     import uvicorn
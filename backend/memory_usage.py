@@ -0,0 +1,34 @@
+"""
+Peak resident memory of the current process, per page.
+On Linux the kernel's high-water mark (VmHWM) can be reset between pages, so
+each page reports its own peak; elsewhere the process-lifetime peak is used.
+"""
+import sys
+
+
+def reset_peak_rss():
+    """Start a new peak measurement; False where the platform cannot reset it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak RSS in MB since the last reset_peak_rss() (or since process start)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
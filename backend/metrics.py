@@ -0,0 +1,128 @@
+"""
+Prometheus-style metrics of the API process, served as text by GET /metrics.
+Per-stage times arrive with every freshly scanned page (see timing.py) and are
+aggregated into histograms; pages are also counted by the detection path
+that produced them, so fallbacks show up as a share of traffic.
+"""
+import threading
+
+from model_logic import FALLBACK_METHOD
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RSS_BUCKETS = tuple(mb * 1024 * 1024 for mb in (128, 256, 512, 768, 1024, 1536, 2048, 4096))
+
+# Processing method -> path label
+METHOD_PATHS = {
+    "4-point contour": "four_point_contour",
+    "min area rectangle": "min_area_rect",
+    "YOLO crop with enhancement": "yolo_crop",
+    "Full image contour": "full_image",
+    FALLBACK_METHOD: "original",
+    "Manual corners": "manual",
+    "Manual corners (snapped)": "manual",
+}
+
+
+def _labels(name, value):
+    return f'{{{name}="{value}"}}'
+
+
+class Counter:
+    def __init__(self, name, description, label):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for value, count in sorted(self._values.items()):
+                yield f"{self.name}{_labels(self.label, value)} {count}"
+
+
+class Histogram:
+    def __init__(self, name, description, label, buckets):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> ([count per bucket], sum, count)
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            counts, total, count = self._series.get(label_value,
+                                                    ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._series[label_value] = (counts, total + value, count + 1)
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for value, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    yield f'{self.name}_bucket{{{self.label}="{value}",le="{bound}"}} {bucket_count}'
+                yield f'{self.name}_bucket{{{self.label}="{value}",le="+Inf"}} {count}'
+                yield f"{self.name}_sum{_labels(self.label, value)} {total:.6f}"
+                yield f"{self.name}_count{_labels(self.label, value)} {count}"
+
+
+stage_seconds = Histogram("pizel_stage_seconds", "Time spent per pipeline stage, per page",
+                          "stage", STAGE_BUCKETS)
+page_peak_rss_bytes = Histogram("pizel_page_peak_rss_bytes",
+                                "Scan worker peak resident memory while scanning a page",
+                                "path", RSS_BUCKETS)
+pages_total = Counter("pizel_pages_total", "Scanned pages by detection path", "path")
+page_failures_total = Counter("pizel_page_failures_total", "Pages that failed to scan",
+                              "reason")
+duplicate_pages_total = Counter("pizel_duplicate_pages_total",
+                                "Uploads not scanned as near-duplicates of a sharper one",
+                                "endpoint")
+
+
+def observe_stages(timings):
+    for name, ms in (timings or {}).items():
+        stage_seconds.observe(name, ms / 1000)
+
+
+def observe_page(method, timings, peak_rss_mb=None):
+    """Record one freshly scanned page"""
+    path = METHOD_PATHS.get(method, "other")
+    pages_total.inc(path)
+    observe_stages(timings)
+    if peak_rss_mb is not None:
+        page_peak_rss_bytes.observe(path, peak_rss_mb * 1024 * 1024)
+
+
+def snapshot(name, description, kind, values, label=None):
+    """
+    Lines for a value tracked elsewhere (queue depth, cache counters).
+    values is a number, or a dict of label value -> number when label is given.
+    """
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+    if label is None:
+        lines.append(f"{name} {values}")
+    else:
+        lines.extend(f"{name}{_labels(label, key)} {value}"
+                     for key, value in sorted(values.items()))
+    return lines
+
+
+def render(extra_lines=()):
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in (stage_seconds, page_peak_rss_bytes, pages_total, page_failures_total,
+                   duplicate_pages_total):
+        lines.extend(metric.lines())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
@@ -1,259 +1,256 @@
-from ultralytics import YOLO
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.ndimage import rotate
+import logging
 import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from image_analysis import ImageAnalysis, as_analysis
+from pdf_writer import page_image
+from encoding import encode_page
+from timing import collect, stage, timed
+from source_image import open_source
+from memory_usage import reset_peak_rss, peak_rss_mb
+from detectors import create_detector, resolve_backend, QuadBox
 
+logger = logging.getLogger("pizel.scanner")
 
-def order_points(pts):
-    rect = np.zeros((4, 2), dtype="float32")
-    s = pts.sum(axis=1)
-    rect[0] = pts[np.argmin(s)]   # top-left
-    rect[2] = pts[np.argmax(s)]   # bottom-right
+# Bump whenever a change alters the pages the pipeline produces; cached results
+# from older versions are then ignored
+PIPELINE_VERSION = 2
+
+# Visual debugging (matplotlib figures) is opt-in; the server always runs headless
+DEBUG_VISUALS = os.environ.get("PIZEL_DEBUG", "0") == "1"
+
+
+# Process-wide detector registry: each (backend, weights) pair is loaded (and
+# warmed up) once per worker process and reused for every image afterwards.
+# Backends are in detectors.py; "classical" runs the contour search first.
+DEFAULT_MODEL_PATH = os.environ.get("PIZEL_MODEL_PATH", "yolov8n.pt")
+DEFAULT_DETECTOR = os.environ.get("PIZEL_DETECTOR", "auto")
+
+_detectors = {}
+_active_model_path = DEFAULT_MODEL_PATH
+_active_backend = DEFAULT_DETECTOR
+_registry_lock = threading.Lock()
+
+
+def load_detector(model_path=None, warmup=True, backend=None):
+    """Load a detector into the registry once, optionally running a warm-up inference"""
+    model_path = model_path or _active_model_path
+    key = (resolve_backend(backend or _active_backend, model_path), model_path)
+    with _registry_lock:
+        detector = _detectors.get(key)
+        if detector is not None:
+            return detector
+
+        detector = create_detector(key[0], model_path, classical_document_box)
+        if warmup:
+            detector.warmup()
+        _detectors[key] = detector
+        logger.info("Loaded %s detector %s", key[0], model_path)
+        return detector
 
-    diff = np.diff(pts, axis=1)
-    rect[1] = pts[np.argmin(diff)]  # top-right
-    rect[3] = pts[np.argmax(diff)]  # bottom-left
-    return rect
 
+def get_detector(model_path=None, backend=None):
+    """Return the cached detector for model_path (defaults to the active model and backend)"""
+    return load_detector(model_path or _active_model_path, backend=backend)
 
-def enhanced_four_point_transform(image, pts):
+
+def set_active_detector(model_path, warmup=True, backend=None):
+    """Swap the active model/weights (and backend) without restarting; the old one is dropped"""
+    global _active_model_path, _active_backend
+    backend = backend or _active_backend
+    # Load the new model first so a bad path leaves the current one in service
+    detector = load_detector(model_path, warmup=warmup, backend=backend)
+    with _registry_lock:
+        previous = (resolve_backend(_active_backend, _active_model_path), _active_model_path)
+        _active_model_path, _active_backend = model_path, backend
+        if previous != (detector.name, model_path):
+            _detectors.pop(previous, None)
+    return detector
+
+
+def active_model_path():
+    return _active_model_path
+
+
+def active_backend():
+    return _active_backend
+
+
+def order_points(pts):
+    """Corners as top-left, top-right, bottom-right, bottom-left"""
+    pts = np.asarray(pts, dtype="float32").reshape(4, 2)
+    # Walk the corners clockwise by angle around the centroid, starting at the
+    # top-left one; unlike picking by x+y and y-x alone, this never returns the
+    # same corner twice (e.g. for a page rotated by 45 degrees)
+    center = pts.mean(axis=0)
+    angles = np.arctan2(pts[:, 1] - center[1], pts[:, 0] - center[0])
+    rect = pts[np.argsort(angles, kind="stable")]
+    return np.roll(rect, -int(np.argmin(rect.sum(axis=1))), axis=0)
+
+
+def enhanced_four_point_transform(image, pts, output_dpi=0):
     """Improved perspective transform that forces perfect rectangle"""
     # Use the perfect rectangle transform instead of the original
-    return perfect_rectangle_transform(image, pts)
+    return perfect_rectangle_transform(image, pts, output_dpi)
 
-def find_best_contour(cropped_image):
-    """Find the best document contour with multiple fallback methods"""
-    gray = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2GRAY)
-    
-    # Method 1: Multi-level thresholding for better edge detection
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+# Contour search: the threshold branches run on a small thread pool (OpenCV
+# releases the GIL) and the search stops as soon as one branch finds a clean quad
+CONTOUR_METHODS = ("otsu", "adaptive", "canny")
+# (1 = sequential, cheapest branch first; the sensible choice on single-core workers)
+CONTOUR_THREADS = int(os.environ.get("PIZEL_CONTOUR_THREADS", min(3, os.cpu_count() or 1)))
+CONTOUR_CONFIDENCE = float(os.environ.get("PIZEL_CONTOUR_CONFIDENCE", 0.85))
+MIN_DOCUMENT_COVERAGE = 0.2  # fraction of the frame a confident document must fill
+
+ContourResult = namedtuple("ContourResult", "contour method score confidence")
+
+_contour_executor = None
+
+
+def _get_contour_executor():
+    global _contour_executor
+    if _contour_executor is None:
+        _contour_executor = ThreadPoolExecutor(max_workers=CONTOUR_THREADS,
+                                               thread_name_prefix="contour")
+    return _contour_executor
+
+
+def _threshold_plane(analysis, method):
+    if method == "otsu":
+        # Otsu's threshold
+        return analysis.otsu()
+    if method == "adaptive":
+        # Adaptive threshold
+        return cv2.adaptiveThreshold(analysis.blur(), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                     cv2.THRESH_BINARY, 11, 2)
+    if method == "canny":
+        # Canny edge detection
+        return analysis.edges()
+    raise ValueError(f"Unknown contour method: {method}")
+
+
+def _search_contours(analysis, method):
+    """Run one threshold branch and return its best ContourResult"""
+    thresh = _threshold_plane(analysis, method)
     
-    # Try multiple threshold methods
-    thresh_methods = []
+    # Morphological operations to clean up the image
+    kernel = np.ones((5, 5), np.uint8)
+    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
+    thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
     
-    # Otsu's threshold
-    _, thresh_otsu = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    thresh_methods.append(thresh_otsu)
+    cnts, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
-    # Adaptive threshold
-    thresh_adapt = cv2.adaptiveThreshold(blur, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                        cv2.THRESH_BINARY, 11, 2)
-    thresh_methods.append(thresh_adapt)
+    best = ContourResult(None, method, 0, 0.0)
+    if not cnts:
+        return best
     
-    # Canny edge detection
-    edges = cv2.Canny(blur, 50, 150)
-    thresh_methods.append(edges)
+    frame_area = thresh.shape[0] * thresh.shape[1]
     
-    best_contour = None
-    best_score = 0
+    # Sort by area and check top contours
+    cnts = sorted(cnts, key=cv2.contourArea, reverse=True)[:3]
     
-    for thresh in thresh_methods:
-        # Morphological operations to clean up the image
-        kernel = np.ones((5, 5), np.uint8)
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-        thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
-        
-        cnts, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        if not cnts:
+    for cnt in cnts:
+        area = cv2.contourArea(cnt)
+        if area < 1000:  # Minimum area threshold
             continue
             
-        # Sort by area and check top contours
-        cnts = sorted(cnts, key=cv2.contourArea, reverse=True)[:3]
+        # Calculate contour score based on area and rectangularity
+        peri = cv2.arcLength(cnt, True)
+        approx = cv2.approxPolyDP(cnt, 0.02 * peri, True)
         
-        for cnt in cnts:
-            area = cv2.contourArea(cnt)
-            if area < 1000:  # Minimum area threshold
-                continue
-                
-            # Calculate contour score based on area and rectangularity
-            peri = cv2.arcLength(cnt, True)
-            approx = cv2.approxPolyDP(cnt, 0.02 * peri, True)
-            
-            # Score based on rectangularity and number of vertices
-            rectangularity = area / (peri * peri / 16) if peri > 0 else 0
-            vertex_score = 1 - min(abs(len(approx) - 4), 4) / 4  # Prefer 4 vertices
-            
-            score = area * rectangularity * vertex_score
-            
-            if score > best_score:
-                best_score = score
-                best_contour = approx if len(approx) >= 4 else cnt
+        # Score based on rectangularity and number of vertices
+        rectangularity = area / (peri * peri / 16) if peri > 0 else 0
+        vertex_score = 1 - min(abs(len(approx) - 4), 4) / 4  # Prefer 4 vertices
+        
+        score = area * rectangularity * vertex_score
+        
+        if score > best.score:
+            # Scale-free confidence in [0, 1] used for the early exit
+            coverage = min(1.0, area / (frame_area * MIN_DOCUMENT_COVERAGE))
+            confidence = min(1.0, rectangularity) * vertex_score * coverage
+            best = ContourResult(approx if len(approx) >= 4 else cnt, method, score, confidence)
     
-    return best_contour
+    return best
 
-def apply_filter(image, mode="original"):
+
+@timed("contours")
+def find_best_contour(cropped_image, methods=CONTOUR_METHODS, confidence_threshold=None):
     """
-    Apply different filters to the scanned image.
-    mode options: "original", "bw", "lighttext", "gray"
+    Find the best document contour with multiple fallback methods.
+    Returns a ContourResult (contour, winning method, score, confidence); the
+    search ends early once a candidate reaches confidence_threshold.
     """
-    if mode == "original":
-        return image
-
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    if mode == "bw":
-        # Black & White using adaptive threshold
-        return cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-            cv2.THRESH_BINARY, 15, 15
-        )
-
-    elif mode == "lighttext":
-        # Enhance faint/light text
-        inv = cv2.bitwise_not(gray)
-        norm = cv2.normalize(inv, None, 0, 255, cv2.NORM_MINMAX)
-        return cv2.bitwise_not(norm)
-
-    elif mode == "gray":
-        return gray
-
+    analysis = as_analysis(cropped_image)
+    if confidence_threshold is None:
+        confidence_threshold = CONTOUR_CONFIDENCE
+    
+    # Shared input of every branch; compute it once before fanning out
+    analysis.blur()
+    
+    best = ContourResult(None, None, 0, 0.0)
+    
+    if CONTOUR_THREADS > 1 and len(methods) > 1:
+        futures = [_get_contour_executor().submit(_search_contours, analysis, method)
+                   for method in methods]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if result.score > best.score:
+                    best = result
+                if best.confidence >= confidence_threshold:
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
     else:
-        raise ValueError(f"Unknown filter mode: {mode}")
+        for method in methods:
+            result = _search_contours(analysis, method)
+            if result.score > best.score:
+                best = result
+            if best.confidence >= confidence_threshold:
+                break
+    
+    return best
 
+@timed("snap")
 def refine_edges(image, points, margin=10):
     """Refine the selected points using edge detection"""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 50, 150)
+    analysis = as_analysis(image)
+    h, w = analysis.shape[:2]
     
     refined_points = []
     for point in points:
-        x, y = point
-        # Search in a small area around the selected point
-        roi = edges[y-margin:y+margin, x-margin:x+margin]
+        x, y = int(round(point[0])), int(round(point[1]))
+        # Search in a small area around the selected point (clamped to the image);
+        # edges are only computed for that window unless already cached
+        x1, y1 = max(0, x - margin), max(0, y - margin)
+        x2, y2 = min(w, x + margin), min(h, y + margin)
+        if x2 <= x1 or y2 <= y1:
+            refined_points.append(point)
+            continue
+        roi = analysis.crop(x1, y1, x2, y2).edges(blurred=False)
         
         # Find the strongest edge in this region
         indices = np.where(roi > 0)
         if len(indices[0]) > 0:
-            refined_y = y - margin + np.mean(indices[0]).astype(int)
-            refined_x = x - margin + np.mean(indices[1]).astype(int)
+            refined_y = y1 + np.mean(indices[0]).astype(int)
+            refined_x = x1 + np.mean(indices[1]).astype(int)
             refined_points.append([refined_x, refined_y])
         else:
             refined_points.append(point)
     
     return np.array(refined_points, dtype=np.float32)
 
-def ensure_perfect_rectangle(points, target_width, target_height):
-    """Force the output to be a perfect rectangle"""
-    # Calculate current dimensions
-    width_top = np.linalg.norm(points[1] - points[0])
-    width_bottom = np.linalg.norm(points[2] - points[3])
-    height_left = np.linalg.norm(points[3] - points[0])
-    height_right = np.linalg.norm(points[2] - points[1])
-    
-    # Use average dimensions
-    avg_width = int((width_top + width_bottom) / 2)
-    avg_height = int((height_left + height_right) / 2)
-    
-    # Create perfect rectangle points
-    perfect_points = np.array([
-        [0, 0],
-        [avg_width, 0],
-        [avg_width, avg_height],
-        [0, avg_height]
-    ], dtype=np.float32)
-    
-    return perfect_points, avg_width, avg_height
-
-def fix_rotation(image):
-    """Improved rotation fix with offset for better straightening"""
-    if len(image.shape) == 3:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = image.copy()
-    
-    # Enhanced edge detection for documents
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    edges = cv2.Canny(blur, 50, 150)
-    
-    # Detect lines with higher threshold for cleaner detection
-    lines = cv2.HoughLines(edges, 1, np.pi/180, threshold=150)
-    
-    if lines is not None:
-        horizontal_angles = []
-        vertical_angles = []
-        
-        for rho, theta in lines[:, 0]:
-            angle = np.degrees(theta)
-            
-            # Classify as horizontal (around 0° or 180°) or vertical (around 90°)
-            if abs(angle) < 30 or abs(angle - 180) < 30:
-                # Horizontal lines
-                if angle > 90:
-                    angle = angle - 180  # Convert to -90 to 90 range
-                horizontal_angles.append(angle)
-            elif abs(angle - 90) < 30:
-                # Vertical lines
-                vertical_angles.append(angle - 90)  # Convert to -90 to 90 range
-        
-        # Prefer horizontal lines for document straightening
-        if horizontal_angles:
-            # Use median for better outlier rejection
-            median_angle = np.median(horizontal_angles)
-            angle_std = np.std(horizontal_angles)
-            
-            print(f"📐 Detected tilt: {median_angle:.2f}° (std: {angle_std:.2f})")
-            
-            # Only rotate if:
-            # 1. Angle is significant enough (> 0.3 degrees)
-            # 2. Angle is reasonable (< 15 degrees) - documents rarely tilt more
-            # 3. Lines are consistent (low standard deviation)
-            if (0.3 < abs(median_angle) < 15.0 and 
-                angle_std < 10.0 and  # Good line consistency
-                len(horizontal_angles) >= 3):  # Enough lines detected
-                
-                # Apply offset/margin for better straightening
-                final_angle = apply_straightening_offset_simple(median_angle)
-                
-                (h, w) = image.shape[:2]
-                center = (w // 2, h // 2)
-                M = cv2.getRotationMatrix2D(center, final_angle, 1.0)
-                rotated = cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC,
-                                       borderMode=cv2.BORDER_REPLICATE)
-                print(f"🔄 Applied rotation: {median_angle:.1f}° → {final_angle:.1f}°")
-                return rotated
-            else:
-                if abs(median_angle) >= 15.0:
-                    print("⚠️  Tilt too large, likely perspective issue - skipping rotation")
-                elif angle_std >= 10.0:
-                    print("⚠️  Inconsistent lines detected - skipping rotation")
-                else:
-                    print("✅ Image already straight enough")
-        else:
-            print("📄 No strong horizontal lines found - likely already straight")
-    
-    else:
-        print("📄 No lines detected - image may be already straight or low contrast")
-    
-    return image
-
-def apply_straightening_offset_simple(angle):
-    """Simple proportional offset"""
-    abs_angle = abs(angle)
-    
-    # Add 10-15% overcorrection
-    offset_ratio = 0.12  # 12% overcorrection
-    offset = abs_angle * offset_ratio
-    
-    if angle > 0:
-        return angle + offset
-    else:
-        return angle - offset
-
 def auto_rotate_to_horizontal(image):
     """Automatically rotate image to make text/document horizontal"""
-    if len(image.shape) == 3:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = image.copy()
+    analysis = as_analysis(image)
+    image = analysis.image
     
-    # Apply Gaussian blur
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    
-    # Use Otsu's threshold
-    _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Use Otsu's threshold on the blurred gray plane
+    thresh = analysis.otsu()
     
     # Get the coordinates of all non-zero pixels
     coords = np.column_stack(np.where(thresh > 0))
@@ -278,24 +275,19 @@ def auto_rotate_to_horizontal(image):
         M = cv2.getRotationMatrix2D(center, angle, 1.0)
         rotated = cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC, 
                                 borderMode=cv2.BORDER_REPLICATE)
-        print(f"🔄 Auto-rotated by {angle:.2f} degrees")
+        logger.debug("Auto-rotated by %.2f degrees", angle)
         return rotated
     
     return image
 
+@timed("straighten")
 def balanced_straighten(image):
     """Balanced straightening - gentle corrections for all tilt sizes"""
-    if len(image.shape) == 3:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = image.copy()
+    analysis = as_analysis(image)
+    image = analysis.image
     
-    # Balanced edge detection
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    edges = cv2.Canny(blur, 50, 150)  # Balanced thresholds
-    
-    # Reasonable threshold for line detection
-    lines = cv2.HoughLines(edges, 1, np.pi/180, threshold=120)
+    # Reasonable threshold for line detection (blurred Canny, balanced thresholds)
+    lines = analysis.hough_lines(120)
     
     if lines is not None:
         angles = []
@@ -309,7 +301,7 @@ def balanced_straighten(image):
             median_angle = np.median(angles)
             angle_std = np.std(angles)
             
-            print(f"📐 Detected: {median_angle:.2f}° (std: {angle_std:.2f})")
+            logger.debug("Detected: %.2f° (std: %.2f)", median_angle, angle_std)
             
             # Apply same method regardless of tilt size, but only if consistent
             if (1.5 < abs(median_angle) and  # Only minimum threshold
@@ -328,13 +320,13 @@ def balanced_straighten(image):
                 M = cv2.getRotationMatrix2D(center, final_angle, 1.0)
                 straightened = cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC,
                                             borderMode=cv2.BORDER_REPLICATE)
-                print(f"🔄 Gentle correction: {median_angle:.1f}° → {final_angle:.1f}°")
+                logger.debug("Gentle correction: %.1f° -> %.1f°", median_angle, final_angle)
                 return straightened
             else:
                 if abs(median_angle) <= 1.5:
-                    print("✅ Already straight enough")
+                    logger.debug("Already straight enough")
                 elif angle_std >= 5.0:
-                    print("⚠️  Lines inconsistent - skipping")
+                    logger.debug("Lines inconsistent - skipping")
     
     return image
 
@@ -362,7 +354,37 @@ def force_perfect_rectangle(points):
     
     return perfect_rect, avg_width, avg_height
 
-def perfect_rectangle_transform(image, pts):
+# Output resolution is decoupled from detection: pages are rendered for a
+# physical page size at OUTPUT_DPI (0 keeps the source's native resolution)
+OUTPUT_DPI = int(os.environ.get("PIZEL_OUTPUT_DPI", 200))
+PAGE_SIZES_INCHES = {"a4": (8.27, 11.69), "letter": (8.5, 11.0)}
+DEFAULT_PAGE_SIZE = "a4"
+
+
+def output_scale(width, height, output_dpi=None, page_size=DEFAULT_PAGE_SIZE):
+    """Scale that fits a width x height page onto page_size at output_dpi (never upsamples)"""
+    if output_dpi is None:
+        output_dpi = OUTPUT_DPI
+    if not output_dpi or width <= 0 or height <= 0:
+        return 1.0
+    page_w, page_h = PAGE_SIZES_INCHES[page_size]
+    # Match the paper orientation to the document's
+    if width > height:
+        page_w, page_h = page_h, page_w
+    return min(1.0, page_w * output_dpi / width, page_h * output_dpi / height)
+
+
+def resize_to_dpi(image, output_dpi=None):
+    """Downscale an already rectified page to the requested output DPI"""
+    h, w = image.shape[:2]
+    scale = output_scale(w, h, output_dpi)
+    if scale >= 1.0:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+@timed("warp")
+def perfect_rectangle_transform(image, pts, output_dpi=0):
     """Perspective transform that forces perfect rectangular output"""
     # Get the original ordered points
     src_rect = order_points(pts)
@@ -370,59 +392,271 @@ def perfect_rectangle_transform(image, pts):
     # Calculate perfect rectangle dimensions
     dst_rect, width, height = force_perfect_rectangle(pts)
     
+    # Render straight at the output DPI instead of warping at full size and resizing
+    scale = output_scale(width, height, output_dpi)
+    if scale < 1.0:
+        width, height = max(1, int(width * scale)), max(1, int(height * scale))
+        dst_rect = np.array([[0, 0], [width, 0], [width, height], [0, height]],
+                            dtype=np.float32)
+        if scale < 0.5:
+            # warpPerspective has no area filter; shrink the document region first
+            # so heavy downsampling does not alias fine text
+            x, y, w, h = cv2.boundingRect(src_rect)
+            x, y = max(0, x), max(0, y)
+            region = image[y:y + h, x:x + w]
+            pre = 2 * scale
+            image = cv2.resize(region, None, fx=pre, fy=pre, interpolation=cv2.INTER_AREA)
+            src_rect = (src_rect - np.float32([x, y])) * pre
+    
     # Calculate transformation matrix
     M = cv2.getPerspectiveTransform(src_rect, dst_rect)
     
     # Apply transformation
-    warped = cv2.warpPerspective(image, M, (width, height),
-                                borderMode=cv2.BORDER_REPLICATE,
-                                flags=cv2.INTER_CUBIC)
+    warped = warp_in_strips(image, M, width, height)
     
-    print(f"📐 Perfect rectangle: {width}x{height}")
+    logger.debug("Perfect rectangle: %dx%d", width, height)
     return warped
 
-def scan_document_optimized(image_path, model_path="yolov8n.pt", 
-                           save_path="scanned_doc.jpg", filter_mode="original"):
-       
-    # Load YOLO model
-    model = YOLO(model_path)
+
+# Output rows rendered per warpPerspective call
+WARP_STRIP_ROWS = 256
+
+
+def warp_in_strips(image, M, width, height, rows=WARP_STRIP_ROWS):
+    """
+    warpPerspective in horizontal output strips, each reading only the source
+    region it maps from (a view, no copy), so OpenCV's temporary maps stay
+    strip-sized. Matches a single warpPerspective call up to rounding.
+    """
+    warped = np.empty((height, width) + image.shape[2:], dtype=image.dtype)
+    inverse = np.linalg.inv(M)
+    image_h, image_w = image.shape[:2]
+    for y0 in range(0, height, rows):
+        y1 = min(height, y0 + rows)
+        strip = np.float32([[0, y0], [width, y0], [width, y1], [0, y1]]).reshape(-1, 1, 2)
+        src = cv2.perspectiveTransform(strip, inverse).reshape(-1, 2)
+        # Margin for the bicubic kernel
+        x_min = int(np.clip(np.floor(src[:, 0].min()) - 2, 0, image_w - 1))
+        y_min = int(np.clip(np.floor(src[:, 1].min()) - 2, 0, image_h - 1))
+        x_max = int(np.clip(np.ceil(src[:, 0].max()) + 3, x_min + 1, image_w))
+        y_max = int(np.clip(np.ceil(src[:, 1].max()) + 3, y_min + 1, image_h))
+        # Source region -> strip: shift into the region, apply M, shift up by y0
+        shift = np.array([[1, 0, x_min], [0, 1, y_min], [0, 0, 1]], dtype=np.float64)
+        lift = np.array([[1, 0, 0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+        cv2.warpPerspective(image[y_min:y_max, x_min:x_max], lift @ M @ shift, (width, y1 - y0),
+                            dst=warped[y0:y1], borderMode=cv2.BORDER_REPLICATE,
+                            flags=cv2.INTER_CUBIC)
+    return warped
+
+MAX_BATCH_SIZE = int(os.environ.get("PIZEL_MAX_BATCH_SIZE", 8))
+# Longest side of the small copy that YOLO and the contour search run on
+DETECTION_SIZE = int(os.environ.get("PIZEL_DETECTION_SIZE", 640))
+
+
+def decode_image(data):
+    """Decode encoded image bytes (JPEG/PNG upload body) straight from memory"""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def load_image_for_scan(image_source, detection_size=None):
+    """
+    Load an image plus a small detection proxy; returns (orig, proxy, proxy_scale)
+    or None. image_source may be a file path or the raw encoded bytes of an upload.
+    orig is a SourceImage: the full-resolution frame is only decoded by the warp.
+    """
+    detection_size = detection_size or DETECTION_SIZE
+    frame = None
+    with stage("decode"):
+        orig = open_source(image_source)
+        if orig is not None:
+            try:
+                # JPEGs decode straight at a fraction of their size (DCT scaling)
+                frame, (proxy_scale, _) = orig.decode(detection_size / max(orig.width,
+                                                                           orig.height))
+            except ValueError:
+                pass
+    if frame is None:
+        logger.warning("Could not load image")
+        return None
     
-    # Load image with better preprocessing
-    image = cv2.imread(image_path)
-    if image is None:
-        print("❌ Error: Could not load image")
+    # Detection only needs a small proxy
+    proxy = frame
+    if max(frame.shape[:2]) > detection_size:
+        scale = detection_size / max(frame.shape[:2])
+        with stage("resize"):
+            proxy = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        proxy_scale *= scale
+        logger.debug("Detection proxy %dx%d", proxy.shape[1], proxy.shape[0])
+    
+    return orig, proxy, proxy_scale
+
+
+def decode_for_output(source, width, height, output_dpi=None):
+    """
+    Decode a SourceImage (or pass an array through) with just enough resolution for
+    a width x height region at output_dpi. Returns (image, (sx, sy)).
+    """
+    source = open_source(source)
+    with stage("decode"):
+        return source.decode(output_scale(width, height, output_dpi))
+
+
+# Contour confidence at which the "classical" detector skips the model
+CLASSICAL_CONFIDENCE = float(os.environ.get("PIZEL_CLASSICAL_CONFIDENCE", 0.9))
+
+
+def classical_document_box(image):
+    """
+    QuadBox around a confident 4-point contour on a whole proxy image, or None;
+    the contour's corners go along so locate_document does not search again
+    """
+    result = find_best_contour(image, confidence_threshold=CLASSICAL_CONFIDENCE)
+    if result.contour is None or result.confidence < CLASSICAL_CONFIDENCE:
         return None
-        
-    orig = image.copy()
-    orig_height, orig_width = image.shape[:2]
+    peri = cv2.arcLength(result.contour, True)
+    approx = cv2.approxPolyDP(result.contour, 0.02 * peri, True)
+    if len(approx) != 4:
+        return None
+    x, y, w, h = cv2.boundingRect(approx)
+    height, width = image.shape[:2]
+    if x <= 1 and y <= 1 and x + w >= width - 1 and y + h >= height - 1:
+        # The threshold traced the frame's own border, not a page inside it
+        return None
+    return QuadBox((x, y, x + w, y + h), approx.reshape(4, 2).astype(np.float32))
+
+
+def detect_documents(images, model=None, max_batch_size=None):
+    """
+    Detection stage: run the detector (see detectors.py) over a list of
+    (already resized) images in batches of at most max_batch_size. Returns one
+    box (or None) per image.
+    """
+    if model is None:
+        model = get_detector()
+    max_batch_size = max(1, max_batch_size or MAX_BATCH_SIZE)
     
-    # Resize image for faster processing if too large
-    if max(orig_height, orig_width) > 1500:
-        scale = 1500 / max(orig_height, orig_width)
-        image = cv2.resize(image, None, fx=scale, fy=scale)
-        print(f"📐 Image resized to {image.shape[1]}x{image.shape[0]}")
+    boxes = []
+    for i in range(0, len(images), max_batch_size):
+        boxes.extend(model.detect(images[i:i + max_batch_size]))
+    return boxes
+
+
+def detect_document_box(image):
+    """Detector box for one (already small) image, or None; e.g. a live preview frame"""
+    return detect_documents([image])[0]
+
+
+def scan_document_optimized(image_path, model_path=None, 
+                           save_path="scanned_doc.jpg", filter_mode="original",
+                           model=None, debug=None, output_dpi=None, detection_size=None,
+                           profile=None):
+    """
+    Scan one page. image_path may also be the upload's raw bytes;
+    pass save_path=None to keep the result in memory only.
+    debug=True shows matplotlib before/after figures (defaults to PIZEL_DEBUG).
+    """
+    if debug is None:
+        debug = DEBUG_VISUALS
+    loaded = load_image_for_scan(image_path, detection_size)
+    if loaded is None:
+        return None
+    orig, proxy, proxy_scale = loaded
     
-    # Run YOLO detection
+    # Run detection (a batch of one)
     try:
-        results = model(image)
-        boxes = results[0].boxes.xyxy.cpu().numpy()
-        classes = results[0].boxes.cls.cpu().numpy().astype(int)
+        selected_box = detect_documents([proxy], model or get_detector(model_path))[0]
     except Exception as e:
-        print(f"❌ YOLO detection failed: {e}")
+        logger.error("Document detection failed: %s", e)
         return None
     
-    # Pick largest 'book' box (class 73 in COCO)
-    selected_box, max_area = None, 0
-    for box, cls in zip(boxes, classes):
-        if cls == 73:
-            x1, y1, x2, y2 = map(int, box)
-            area = (x2 - x1) * (y2 - y1)
-            if area > max_area:
-                max_area = area
-                selected_box = (x1, y1, x2, y2)
+    return finish_scan(orig, proxy, proxy_scale, selected_box, save_path, filter_mode,
+                       debug, output_dpi, profile).image
+
+
+def scan_documents_batch(image_sources, save_paths=None, filter_mode="original",
+                         model=None, max_batch_size=None, output_dpi=None,
+                         detection_size=None, profile=None, contour_methods=None,
+                         straighten=True):
+    """
+    Scan several pages (paths or upload bytes) with one batched detector pass, then
+    run the per-page contour, warp and filter stages. Returns one ScanResult
+    (or None on failure) per page, with per-stage timings in milliseconds.
+    contour_methods and straighten trade accuracy for speed under load.
+    """
+    if save_paths is None:
+        save_paths = [None] * len(image_sources)
+    timings = [{} for _ in image_sources]
+    peaks = []
+    loaded = []
+    for source, page_timings in zip(image_sources, timings):
+        reset_peak_rss()
+        with collect(page_timings):
+            loaded.append(load_image_for_scan(source, detection_size))
+        peaks.append(peak_rss_mb())
+    valid = [i for i, item in enumerate(loaded) if item is not None]
     
-    warped = None
-    processing_method = "Unknown"
+    results = [None] * len(image_sources)
+    if not valid:
+        return results
+    
+    try:
+        start = time.perf_counter()
+        boxes = detect_documents([loaded[i][1] for i in valid], model, max_batch_size)
+        # One batched pass serves every page; each page is charged an equal share
+        detect_ms = (time.perf_counter() - start) * 1000 / len(valid)
+    except Exception as e:
+        logger.error("Document detection failed: %s", e)
+        return results
+    
+    for i, selected_box in zip(valid, boxes):
+        orig, proxy, proxy_scale = loaded[i]
+        # Drop our reference as we go so finished pages can be freed
+        loaded[i] = None
+        timings[i]["detect"] = detect_ms
+        try:
+            reset_peak_rss()
+            with collect(timings[i]):
+                result = finish_scan(orig, proxy, proxy_scale, selected_box, save_paths[i],
+                                     filter_mode, output_dpi=output_dpi, profile=profile,
+                                     contour_methods=contour_methods, straighten=straighten)
+            peak = round(max(peaks[i] or 0, peak_rss_mb() or 0), 1) or None
+            results[i] = result._replace(timings=timings[i], peak_rss_mb=peak)
+        except Exception as e:
+            logger.exception("Page %d failed: %s", i, e)
+    return results
+
+
+# image: the finished page; page: the rectified page before filtering (what
+# re-filtering starts from); method: which detection path produced it;
+# timings: milliseconds per pipeline stage, when they were collected;
+# peak_rss_mb: the worker's peak resident memory while scanning the page
+ScanResult = namedtuple("ScanResult", "image page method timings peak_rss_mb",
+                        defaults=(None, None))
+FALLBACK_METHOD = "Original image (fallback)"
+
+
+# corners: the page's four corners in original image coordinates (None if not
+# found); crop: the padded detector box in original coordinates, used when no
+# corners were found; method: the processing path
+DocumentLocation = namedtuple("DocumentLocation", "corners crop method")
+
+
+def locate_document(proxy, proxy_scale, selected_box, contour_methods=None):
+    """
+    Corner search on the detection proxy, inside the detector's box when there
+    is one, else over the whole frame. A QuadBox already has its corners, so
+    no search runs. Returns a DocumentLocation.
+    """
+    corners = getattr(selected_box, "corners", None)
+    if corners is not None:
+        logger.debug("Corners found by the detector")
+        return DocumentLocation(corners / proxy_scale, None, "4-point contour")
+
+    contour_methods = contour_methods or CONTOUR_METHODS
+    proxy_analysis = ImageAnalysis(proxy)
     
     if selected_box is not None:
         x1, y1, x2, y2 = selected_box
@@ -433,13 +667,15 @@ def scan_document_optimized(image_path, model_path="yolov8n.pt",
         
         x1 = max(0, x1 - PAD_X)
         y1 = max(0, y1 - PAD_Y)
-        x2 = min(image.shape[1], x2 + PAD_X)
-        y2 = min(image.shape[0], y2 + PAD_Y)
+        x2 = min(proxy.shape[1], x2 + PAD_X)
+        y2 = min(proxy.shape[0], y2 + PAD_Y)
         
-        cropped = image[y1:y2, x1:x2]
+        # Crop as a view into the proxy (and any planes already computed for it)
+        cropped = proxy_analysis.crop(x1, y1, x2, y2)
         
         # Find best contour
-        contour = find_best_contour(cropped)
+        contour_result = find_best_contour(cropped, contour_methods)
+        contour = contour_result.contour
         
         if contour is not None and len(contour) >= 3:
             # Simplify contour
@@ -447,7 +683,7 @@ def scan_document_optimized(image_path, model_path="yolov8n.pt",
             approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
             
             if len(approx) == 4:
-                pts = approx.reshape(4, 2)
+                pts = approx.reshape(4, 2).astype(np.float32)
                 processing_method = "4-point contour"
             else:
                 # Fit minimum area rectangle for non-quadrilateral contours
@@ -459,60 +695,122 @@ def scan_document_optimized(image_path, model_path="yolov8n.pt",
             # Convert points back to original image coordinates
             pts[:, 0] += x1
             pts[:, 1] += y1
-            
-            # Apply enhanced perspective transform
-            warped = enhanced_four_point_transform(image, pts)
-            print(f"📐 Perspective correction applied ({processing_method})")
-            
-        else:
-            # Fallback: Use YOLO crop with edge detection
-            warped = enhance_cropped_document(cropped)
-            processing_method = "YOLO crop with enhancement"
-            print("⚠️ No good contour found, using enhanced YOLO crop")
-            
-    else:
-        print("⚠️ No document detected, trying full image processing")
-        # Try to find document in entire image
-        contour = find_best_contour(image)
-        if contour is not None:
-            peri = cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
-            if len(approx) == 4:
-                pts = approx.reshape(4, 2)
-                warped = enhanced_four_point_transform(image, pts)
-                processing_method = "Full image contour"
+            pts /= proxy_scale
+            logger.debug("Corners found (%s, %s method, confidence %.2f)",
+                         processing_method, contour_result.method, contour_result.confidence)
+            return DocumentLocation(pts, None, processing_method)
+        
+        logger.debug("No good contour found, using enhanced YOLO crop")
+        crop = (int(x1 / proxy_scale), int(y1 / proxy_scale),
+                int(x2 / proxy_scale), int(y2 / proxy_scale))
+        return DocumentLocation(None, crop, "YOLO crop with enhancement")
+    
+    logger.debug("No document detected, trying full image processing")
+    # Try to find document in entire image
+    contour = find_best_contour(proxy_analysis, contour_methods).contour
+    if contour is not None:
+        peri = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
+        if len(approx) == 4:
+            pts = approx.reshape(4, 2).astype(np.float32) / proxy_scale
+            return DocumentLocation(pts, None, "Full image contour")
+    return DocumentLocation(None, None, "Unknown")
+
+
+def rectify_page(orig, proxy, proxy_scale, selected_box, output_dpi=None, contour_methods=None):
+    """
+    Find the document and warp it flat. Contour search runs on the proxy; the
+    corners are scaled back and the original is warped once at output_dpi.
+    Returns (page, processing_method); page is None when nothing was found.
+    """
+    location = locate_document(proxy, proxy_scale, selected_box, contour_methods)
+    return warp_document(orig, location, output_dpi), location.method
+
+
+def warp_document(orig, location, output_dpi=None):
+    """
+    Cut the located page out of the original (None if not located). orig (a
+    SourceImage or an array) is decoded only at the resolution the output needs.
+    """
+    if output_dpi is None:
+        output_dpi = OUTPUT_DPI
+    if location.corners is not None:
+        # Apply enhanced perspective transform on the original
+        _, width, height = force_perfect_rectangle(location.corners)
+        image, (sx, sy) = decode_for_output(orig, width, height, output_dpi)
+        return enhanced_four_point_transform(image, location.corners * np.float32([sx, sy]),
+                                             output_dpi)
+    if location.crop is not None:
+        # Fallback: Use YOLO crop with edge detection, cut from the original
+        x1, y1, x2, y2 = location.crop
+        image, (sx, sy) = decode_for_output(orig, x2 - x1, y2 - y1, output_dpi)
+        crop = image[int(y1 * sy):int(y2 * sy), int(x1 * sx):int(x2 * sx)]
+        return enhance_cropped_document(resize_to_dpi(crop, output_dpi))
+    return None
+
+
+def original_at_dpi(orig, output_dpi=None):
+    """The whole original (SourceImage or array) rendered at output_dpi"""
+    source = open_source(orig)
+    image, _ = decode_for_output(source, source.width, source.height, output_dpi)
+    return resize_to_dpi(image, output_dpi)
+
+
+def render_page(page, filter_mode="original", profile=None, straighten=True):
+    """Apply the output filter (and gentle straightening) to a rectified page"""
+    page_analysis = ImageAnalysis(page)
+    processed = apply_enhanced_filter(page_analysis, filter_mode, profile)
+    if straighten:
+        # Conservative straightening only if clearly needed; when the filter left the
+        # page untouched, reuse the planes already derived from it
+        processed = balanced_straighten(page_analysis if processed is page else processed)
+    return processed
+
+
+def finish_scan(orig, proxy, proxy_scale, selected_box, save_path, filter_mode,
+                debug=False, output_dpi=None, profile=None, contour_methods=None,
+                straighten=True):
+    """Per-page stages after detection: rectify, filter and (optionally) save"""
+    if output_dpi is None:
+        output_dpi = OUTPUT_DPI
+    warped, processing_method = rectify_page(orig, proxy, proxy_scale, selected_box, output_dpi,
+                                             contour_methods)
     
     # Apply filter and save
     if warped is not None:
-        processed = apply_enhanced_filter(warped, filter_mode)
-        # Conservative straightening only if clearly needed
-        processed = balanced_straighten(processed)
-        cv2.imwrite(save_path, processed)
-        print(f"💾 Saved {filter_mode} scan at {save_path}")
+        processed = render_page(warped, filter_mode, profile, straighten)
+        if save_path:
+            cv2.imwrite(save_path, processed)
+            logger.debug("Saved %s scan at %s", filter_mode, save_path)
         
         # Show results
-        display_results(orig, processed, filter_mode, processing_method)
-        return processed
+        if debug:
+            display_results(original_at_dpi(orig, output_dpi), processed, filter_mode,
+                            processing_method)
+        return ScanResult(processed, warped, processing_method)
     else:
-        print("❌ Document processing failed")
-        final_fallback_image = orig
-        cv2.imwrite(save_path, final_fallback_image)
-        display_results(orig, final_fallback_image, "original (fallback)", "Failed Document Detection")
-        print(f"💾 Saved original image as fallback at {save_path}")
-        return final_fallback_image
-        return None
+        logger.warning("Document processing failed, returning original image")
+        final_fallback_image = original_at_dpi(orig, output_dpi)
+        if debug:
+            display_results(final_fallback_image, final_fallback_image, "original (fallback)", "Failed Document Detection")
+        if save_path:
+            cv2.imwrite(save_path, final_fallback_image)
+            logger.debug("Saved original image as fallback at %s", save_path)
+        return ScanResult(final_fallback_image, final_fallback_image, FALLBACK_METHOD)
 
+@timed("warp")
 def enhance_cropped_document(cropped):
     """Enhance cropped document when contour detection fails"""
+    analysis = as_analysis(cropped)
+    cropped = analysis.image
+    
     # First try the improved rotation correction
-    result = auto_rotate_to_horizontal(cropped)
+    result = auto_rotate_to_horizontal(analysis)
     
-    # If auto-rotation didn't work, fall back to Hough Lines method
-    if np.array_equal(result, cropped):
-        gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150, apertureSize=3)
-        
-        lines = cv2.HoughLines(edges, 1, np.pi/180, threshold=100)
+    # If auto-rotation didn't work (same image back), fall back to Hough Lines method
+    if result is cropped:
+        # Unblurred Canny edges from the shared gray plane
+        lines = analysis.hough_lines(100, blurred=False)
         
         if lines is not None:
             angles = []
@@ -530,19 +828,44 @@ def enhance_cropped_document(cropped):
                     result = cv2.warpAffine(cropped, M, (w, h), 
                                            flags=cv2.INTER_CUBIC,
                                            borderMode=cv2.BORDER_REPLICATE)
-                    print(f"🔄 Hough-based rotation by {median_angle:.2f} degrees")
+                    logger.debug("Hough-based rotation by %.2f degrees", median_angle)
     
     return result
 
-def apply_enhanced_filter(image, mode="original"):
+# Named speed/quality profiles for the denoising step of "enhanced" mode.
+# Per-page cost of the whole enhanced filter on a 200 DPI A4 page
+# (1654x2339, single core):
+#   fast       ~35 ms   no denoising, CLAHE only
+#   balanced   ~55 ms   edge-preserving bilateral filter + CLAHE
+#   quality    ~6 s     fastNlMeansDenoising + CLAHE (the original filter)
+# "balanced" is the default: at 200 DPI "quality" alone costs more than the
+# whole pipeline did at the old 1500 px output cap.
+FILTER_PROFILES = ("fast", "balanced", "quality")
+DEFAULT_FILTER_PROFILE = os.environ.get("PIZEL_FILTER_PROFILE", "balanced")
+
+
+def denoise(gray, profile=None):
+    """Denoise a gray page with the cost/quality trade-off of the given profile"""
+    profile = profile or DEFAULT_FILTER_PROFILE
+    if profile == "fast":
+        return gray
+    elif profile == "balanced":
+        return cv2.bilateralFilter(gray, 5, 30, 5)
+    elif profile == "quality":
+        return cv2.fastNlMeansDenoising(gray)
+    else:
+        raise ValueError(f"Unknown filter profile: {profile}")
+
+FILTER_MODES = ("original", "bw", "lighttext", "gray", "enhanced")
+
+@timed("filter")
+def apply_enhanced_filter(image, mode="original", profile=None):
     """Enhanced filters with better document processing"""
+    analysis = as_analysis(image)
     if mode == "original":
-        return image
+        return analysis.image
     
-    if len(image.shape) == 3:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = image.copy()
+    gray = analysis.gray
 
     if mode == "bw":
         # Improved adaptive threshold
@@ -562,8 +885,8 @@ def apply_enhanced_filter(image, mode="original"):
     
     elif mode == "enhanced":
         # Comprehensive enhancement
-        # Noise reduction
-        denoised = cv2.fastNlMeansDenoising(gray)
+        # Noise reduction (cost depends on the profile)
+        denoised = denoise(gray, profile)
         # Contrast enhancement
         clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
         enhanced = clahe.apply(denoised)
@@ -573,8 +896,11 @@ def apply_enhanced_filter(image, mode="original"):
         raise ValueError(f"Unknown filter mode: {mode}")
 
 def display_results(original, processed, filter_mode, method):
-    """Display original and processed images"""
-    plt.figure(figsize=(15, 6))
+    """Display original and processed images (debug only)"""
+    # Imported here so headless runs never load matplotlib
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(15, 6))
     
     plt.subplot(1, 2, 1)
     plt.imshow(cv2.cvtColor(original, cv2.COLOR_BGR2RGB))
@@ -591,18 +917,204 @@ def display_results(original, processed, filter_mode, method):
     
     plt.tight_layout()
     plt.show()
+    plt.close(fig)
 
-PROCESSED_FOLDER = "processed"
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
-
-def process_uploaded_image(image_path, save_path="processed_image.jpg", filter_mode="enhanced"):
+def process_uploaded_image(image_path, save_path="processed_image.jpg", filter_mode="enhanced",
+                           model_path=None, output_dpi=None, profile=None):
     """
     Process the uploaded image and save the result to save_path.
+    Uses the shared detector from the registry instead of loading weights per call.
+    Returns save_path, or the processed image itself when save_path is None;
+    None means the scan failed.
     """
     result = scan_document_optimized(
         image_path=image_path,
+        model=get_detector(model_path),
         save_path=save_path,
-        filter_mode=filter_mode
+        filter_mode=filter_mode,
+        debug=False,
+        output_dpi=output_dpi,
+        profile=profile
     )
-    return save_path if result is not None else None
+    if result is None:
+        return None
+    return save_path or result
+
+
+# Smallest page a manual quad may outline, as a share of the photo's area
+MIN_MANUAL_AREA = 0.01
+
+
+def check_quad(pts, width, height):
+    """
+    Raise ValueError unless pts outline a usable page in a width x height photo:
+    four distinct corners forming a convex quad of at least MIN_MANUAL_AREA
+    (collinear or repeated points would make the perspective transform singular).
+    """
+    rect = order_points(pts)
+    if len(np.unique(rect, axis=0)) < 4:
+        raise ValueError("points must be four distinct corners")
+    if not cv2.isContourConvex(rect.reshape(-1, 1, 2)):
+        raise ValueError("points must outline a convex quadrilateral")
+    if cv2.contourArea(rect) < MIN_MANUAL_AREA * width * height:
+        raise ValueError(f"points must enclose at least {MIN_MANUAL_AREA:.0%} of the image")
+
+
+def process_manual_corners(image_data, points, filter_mode="enhanced", profile=None,
+                           output_dpi=None, snap=False, normalized=False, straighten=True):
+    """
+    Warp and filter a page from user-picked corners; no model is involved.
+    points are four (x, y) pairs in image pixels, or in 0-1 if normalized.
+    With snap, each corner moves to nearby detected edges first; straighten=False
+    skips the final straightening. The photo is decoded only at the resolution
+    the output needs (see decode_for_output).
+    Returns a ScanResult, or None if the image cannot be decoded. Raises
+    ValueError if the corners do not outline a usable page (see check_quad).
+    """
+    with stage("decode"):
+        source = open_source(image_data)
+    if source is None:
+        logger.warning("Could not load image")
+        return None
+    w, h = source.width, source.height
+    
+    pts = np.array(points, dtype=np.float32).reshape(4, 2)
+    if normalized:
+        pts *= np.float32([w, h])
+    pts[:, 0] = np.clip(pts[:, 0], 0, w - 1)
+    pts[:, 1] = np.clip(pts[:, 1], 0, h - 1)
+    check_quad(pts, w, h)
+    
+    if output_dpi is None:
+        output_dpi = OUTPUT_DPI
+    _, width, height = force_perfect_rectangle(pts)
+    try:
+        image, (sx, sy) = decode_for_output(source, width, height, output_dpi)
+    except ValueError:
+        logger.warning("Could not load image")
+        return None
+    pts *= np.float32([sx, sy])
+    
+    if snap:
+        # Search window grows with the photo so the snap distance stays comparable
+        frame_h, frame_w = image.shape[:2]
+        pts = refine_edges(image, pts, margin=max(10, max(frame_h, frame_w) // 100))
+        check_quad(pts, frame_w, frame_h)
+    
+    page = perfect_rectangle_transform(image, pts, output_dpi)
+    processed = render_page(page, filter_mode, profile, straighten)
+    return ScanResult(processed, page, "Manual corners (snapped)" if snap else "Manual corners")
+
+
+def process_uploaded_batch(pages, filter_mode="enhanced", model_path=None, output_dpi=None,
+                           profile=None, keep_pages=False, pdf=False, encoding=None,
+                           detection_size=None, contour_methods=None, straighten=True,
+                           detector_backend=None):
+    """
+    Process a list of (image_bytes, save_path) pages entirely in memory with
+    batched detection. save_path may be None (no disk copy is written).
+    output_dpi sets the rendered page resolution (None: PIZEL_OUTPUT_DPI, 0: native);
+    profile picks the filter's speed/quality trade-off (see FILTER_PROFILES).
+    Returns a dict per page, in order (None on failure): "image" holds the
+    encoded bytes, "encoding" their format, size and encode time (encoding
+    takes encode_page's fmt/quality/target_bytes options), "method" the
+    processing path and "timings" the per-stage milliseconds; with keep_pages the
+    rectified, unfiltered page is included as "page" (JPEG bytes, see pack_page)
+    so it can be re-filtered.
+    With pdf, "pdf_image" carries the page ready for embedding by pdf_writer.
+    detection_size, contour_methods and straighten are the load-shedding knobs
+    (see admission.py); detector_backend overrides the active one (see detectors.py).
+    """
+    image_data = [data for data, _ in pages]
+    save_paths = [save_path for _, save_path in pages]
+    results = scan_documents_batch(image_data, save_paths, filter_mode,
+                                   model=get_detector(model_path, detector_backend),
+                                   output_dpi=output_dpi,
+                                   detection_size=detection_size, profile=profile,
+                                   contour_methods=contour_methods, straighten=straighten)
+    return [_page_response(result, filter_mode, keep_pages, pdf, encoding or {})
+            if result is not None else None
+            for result in results]
+
+
+# What process_uploaded_batch (and encode_page) do with an option left as None
+BATCH_DEFAULTS = {"filter_mode": "enhanced", "keep_pages": False, "pdf": False,
+                  "straighten": True}
+ENCODING_DEFAULTS = {"fmt": "auto", "quality": None, "target_bytes": None}
+
+
+def resolve_batch_options(options):
+    """
+    process_uploaded_batch keyword arguments with every default filled in, so
+    scans that produce the same output compare (and hash) equal whether an
+    option was given explicitly or left to its default.
+    """
+    options = dict(BATCH_DEFAULTS, **{key: value for key, value in options.items()
+                                      if value is not None})
+    options["profile"] = options.get("profile") or DEFAULT_FILTER_PROFILE
+    options.setdefault("output_dpi", OUTPUT_DPI)
+    options["detection_size"] = options.get("detection_size") or DETECTION_SIZE
+    options["contour_methods"] = tuple(options.get("contour_methods") or CONTOUR_METHODS)
+    options["encoding"] = dict(ENCODING_DEFAULTS, **(options.get("encoding") or {}))
+    return options
+
+
+def encoding_info(encoded):
+    """JSON-friendly summary of an EncodedPage"""
+    return {"format": encoded.format, "mime": encoded.mime, "bytes": len(encoded.data),
+            "quality": encoded.quality, "encode_ms": round(encoded.encode_ms, 2)}
+
+
+# Rectified pages kept for re-filtering are stored as JPEG at this quality:
+# about a tenth of the raw array, and no visible difference once filtered
+KEPT_PAGE_QUALITY = 95
+
+
+def pack_page(page):
+    """Compact bytes of a rectified page kept for re-filtering (see refilter_page)"""
+    ok, buffer = cv2.imencode(".jpg", page, [cv2.IMWRITE_JPEG_QUALITY, KEPT_PAGE_QUALITY])
+    return buffer.tobytes() if ok else None
+
+
+def refilter_page(page_data, filter_mode="original", profile=None, straighten=True,
+                  encoding=None):
+    """
+    Re-render a page kept by pack_page with another filter (run in the API's thread pool).
+    Returns (EncodedPage, per-stage timings), or (None, timings) if undecodable.
+    """
+    with collect() as timings:
+        with stage("decode"):
+            page = decode_image(page_data)
+        if page is None:
+            return None, timings
+        image = render_page(page, filter_mode, profile, straighten)
+        with stage("encode"):
+            return encode_page(image, filter_mode, **(encoding or {})), timings
+
+
+def _page_response(result, filter_mode, keep_pages, pdf, encoding):
+    page = {"method": result.method, "timings": dict(result.timings or {}),
+            "peak_rss_mb": result.peak_rss_mb}
+    with collect(page["timings"]), stage("encode"):
+        _encode_response(page, result, filter_mode, pdf, encoding)
+        if keep_pages:
+            page["page"] = pack_page(result.page)
+    return page
+
+
+def _encode_response(page, result, filter_mode, pdf, encoding):
+    if pdf and filter_mode == "bw":
+        # Black & white pages go into the PDF as 1-bit bitmaps, no JPEG needed
+        page["image"] = None
+        page["pdf_image"] = page_image(result.image, bilevel=True)
+    else:
+        if pdf:
+            # PDF pages embed JPEG bytes directly, whatever format was asked for
+            encoding = dict(encoding, fmt="jpeg")
+        encoded = encode_page(result.image, filter_mode, **encoding)
+        page["image"] = encoded.data
+        page["encoding"] = encoding_info(encoded)
+        if pdf:
+            # The same JPEG bytes are embedded in the PDF without re-encoding
+            page["pdf_image"] = page_image(result.image, encoded.data, bilevel=False)
 
@@ -0,0 +1,71 @@
+"""
+Bounded in-memory cache of rectified (warped, unfiltered) pages, held as
+encoded bytes (see model_logic.pack_page). Lets clients re-filter a page by ID
+without re-running detection and warping.
+Entries are evicted least-recently-used first, by count, total bytes and age.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+PAGE_CACHE_ITEMS = int(os.environ.get("PIZEL_PAGE_CACHE_ITEMS", 256))
+PAGE_CACHE_MB = int(os.environ.get("PIZEL_PAGE_CACHE_MB", 512))
+PAGE_CACHE_TTL = float(os.environ.get("PIZEL_PAGE_CACHE_TTL", 600))
+
+
+class PageCache:
+    def __init__(self, max_items=PAGE_CACHE_ITEMS, max_bytes=PAGE_CACHE_MB * 1024 * 1024,
+                 ttl=PAGE_CACHE_TTL):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # page_id -> (expires_at, page)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def _drop(self, page_id):
+        _, page = self._entries.pop(page_id)
+        self._bytes -= len(page)
+
+    def _evict(self, now):
+        # Expired entries first, then least recently used until within limits
+        for page_id in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            self._drop(page_id)
+        while self._entries and (len(self._entries) > self.max_items
+                                 or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+
+    def put(self, page):
+        """Store page bytes and return their new ID (None if the page alone exceeds the cap)"""
+        if page is None or len(page) > self.max_bytes:
+            return None
+        page_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._entries[page_id] = (now + self.ttl, page)
+            self._bytes += len(page)
+            self._evict(now)
+        return page_id
+
+    def get(self, page_id):
+        """Return the cached page (refreshing its LRU position and TTL) or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(page_id)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                self._drop(page_id)
+                return None
+            self._entries[page_id] = (now + self.ttl, entry[1])
+            self._entries.move_to_end(page_id)
+            return entry[1]
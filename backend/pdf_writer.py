@@ -0,0 +1,174 @@
+"""
+Minimal incremental PDF writer for scanned pages.
+Pages are written as soon as they are ready and never re-encoded: color/gray
+pages embed the JPEG bytes as-is (DCTDecode), bilevel pages are stored as
+1-bit Flate-compressed bitmaps. The page tree, xref and trailer go out last,
+so pages may be added in any order and still end up in index order.
+"""
+import zlib
+
+import cv2
+import numpy as np
+
+POINTS_PER_INCH = 72
+# Paper sizes in points; "fit" makes every page exactly the image size at the given DPI
+PAGE_SIZES = {"a4": (595.28, 841.89), "letter": (612.0, 792.0)}
+PDF_PAGE_SIZES = ("fit",) + tuple(PAGE_SIZES)
+DEFAULT_PDF_DPI = 200
+
+
+def is_bilevel(image):
+    """True for single-channel pages that only contain pure black and white"""
+    if image.ndim != 2:
+        return False
+    hist = cv2.calcHist([image], [0], None, [256], [0, 256]).ravel()
+    return hist[1:255].sum() == 0
+
+
+def jpeg_image(data, width, height, channels):
+    """PDF image payload that embeds already encoded JPEG bytes unchanged"""
+    return {"width": width, "height": height, "bits": 8,
+            "colorspace": "/DeviceGray" if channels == 1 else "/DeviceRGB",
+            "filter": "/DCTDecode", "data": data}
+
+
+def bilevel_image(image):
+    """PDF image payload for a black & white page: 1 bit per pixel, Flate-compressed"""
+    height, width = image.shape[:2]
+    # In 1-bit DeviceGray a set bit is white
+    bits = np.packbits(image > 127, axis=1)
+    return {"width": width, "height": height, "bits": 1, "colorspace": "/DeviceGray",
+            "filter": "/FlateDecode", "data": zlib.compress(bits.tobytes(), 9)}
+
+
+def jpeg_header(data):
+    """(width, height, components) from a JPEG's start-of-frame marker"""
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            raise ValueError("Malformed JPEG")
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        # SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height, data[i + 9]
+        i += 2 + length
+    raise ValueError("No JPEG frame header found")
+
+
+def page_image(image, jpeg_data=None, bilevel=None):
+    """
+    Choose the PDF embedding for a rendered page (reusing jpeg_data when given).
+    bilevel=True forces 1-bit output (e.g. "bw" pages softened by straightening);
+    None detects pure black & white pages.
+    """
+    if bilevel or (bilevel is None and is_bilevel(image)):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return bilevel_image(image)
+    if jpeg_data is None:
+        ok, buffer = cv2.imencode(".jpg", image)
+        if not ok:
+            raise ValueError("Could not encode page as JPEG")
+        jpeg_data = buffer.tobytes()
+    # Dimensions and channel count come from the JPEG itself, which may be
+    # single-channel even when the page array is not
+    return jpeg_image(jpeg_data, *jpeg_header(jpeg_data))
+
+
+def _number(value):
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+class IncrementalPdfWriter:
+    def __init__(self, page_size="fit", dpi=DEFAULT_PDF_DPI):
+        if page_size not in PDF_PAGE_SIZES:
+            raise ValueError(f"Unknown page size: {page_size}")
+        self.page_size = page_size
+        self.dpi = dpi or DEFAULT_PDF_DPI
+        self._offset = 0
+        self._offsets = {}  # object number -> byte offset
+        self._next_object = 3  # 1 = catalog, 2 = page tree
+        self._pages = []  # (index, page object number)
+
+    def _emit(self, data):
+        self._offset += len(data)
+        return data
+
+    def _object(self, number, body, stream=None):
+        self._offsets[number] = self._offset
+        data = f"{number} 0 obj\n".encode() + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        return self._emit(data + b"\nendobj\n")
+
+    def _allocate(self):
+        number = self._next_object
+        self._next_object += 1
+        return number
+
+    def start(self):
+        """File header; must be the first chunk written"""
+        return self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _placement(self, width, height):
+        """Page size and image rectangle (x, y, w, h) in points"""
+        image_w = width * POINTS_PER_INCH / self.dpi
+        image_h = height * POINTS_PER_INCH / self.dpi
+        if self.page_size == "fit":
+            return (image_w, image_h), (0, 0, image_w, image_h)
+
+        page_w, page_h = PAGE_SIZES[self.page_size]
+        if width > height:
+            page_w, page_h = page_h, page_w
+        # Scale down (never up) to fit the paper, centered
+        scale = min(1.0, page_w / image_w, page_h / image_h)
+        image_w, image_h = image_w * scale, image_h * scale
+        return (page_w, page_h), ((page_w - image_w) / 2, (page_h - image_h) / 2, image_w, image_h)
+
+    def add_page(self, index, image):
+        """Write one page (an image payload from page_image) and return its bytes"""
+        image_number = self._allocate()
+        content_number = self._allocate()
+        page_number = self._allocate()
+        (page_w, page_h), (x, y, w, h) = self._placement(image["width"], image["height"])
+
+        header = (f"<< /Type /XObject /Subtype /Image /Width {image['width']} "
+                  f"/Height {image['height']} /ColorSpace {image['colorspace']} "
+                  f"/BitsPerComponent {image['bits']} /Filter {image['filter']} "
+                  f"/Length {len(image['data'])} >>")
+        content = (f"q {_number(w)} 0 0 {_number(h)} {_number(x)} {_number(y)} cm "
+                   f"/Im0 Do Q").encode()
+        page = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_number(page_w)} "
+                f"{_number(page_h)}] /Resources << /XObject << /Im0 {image_number} 0 R >> >> "
+                f"/Contents {content_number} 0 R >>")
+
+        chunk = self._object(image_number, header.encode(), image["data"])
+        chunk += self._object(content_number, f"<< /Length {len(content)} >>".encode(), content)
+        chunk += self._object(page_number, page.encode())
+        self._pages.append((index, page_number))
+        return chunk
+
+    @property
+    def page_count(self):
+        return len(self._pages)
+
+    def finish(self):
+        """Page tree (in index order), catalog, xref table and trailer"""
+        kids = " ".join(f"{number} 0 R" for _, number in sorted(self._pages))
+        chunk = self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>".encode())
+        chunk += self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_offset = self._offset
+        size = self._next_object
+        xref = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for number in range(1, size):
+            offset = self._offsets.get(number)
+            xref.append(f"{offset:010d} 00000 n \n" if offset is not None else "0000000000 65535 f \n")
+        xref.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        return chunk + self._emit("".join(xref).encode())
@@ -0,0 +1,117 @@
+"""
+Live camera preview support: document corners per preview frame, fast enough
+for auto-capture. Corners come from the contour search on a tiny proxy; the
+detector only runs every few frames or after tracking is lost, and in between
+the search is confined to the area around the last quad. Corners are smoothed
+over time and a capture signal fires once they have settled.
+"""
+import os
+
+import cv2
+import numpy as np
+
+from model_logic import load_image_for_scan, locate_document, order_points
+
+PREVIEW_SIZE = int(os.environ.get("PIZEL_PREVIEW_SIZE", 320))
+PREVIEW_DETECT_EVERY = int(os.environ.get("PIZEL_PREVIEW_DETECT_EVERY", 10))
+# Weight of the newest quad in the moving average (1 = no smoothing)
+SMOOTHING = 0.5
+# A corner jump beyond this fraction of the frame diagonal restarts the average
+RESET_MOTION = 0.1
+# Corners count as still when they move less than this fraction of the diagonal per frame...
+STABLE_MOTION = 0.004
+# ...for this many frames in a row
+STABLE_FRAMES = 8
+# Only 4-point contours are trusted for a preview quad
+TRACKED_METHODS = ("4-point contour", "Full image contour")
+
+
+class PreviewTracker:
+    """Per-connection tracking state; feed it frames in order"""
+
+    def __init__(self, detect_every=PREVIEW_DETECT_EVERY):
+        self.detect_every = max(1, detect_every)
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.box = None  # search area for the next frame, in proxy pixels
+        self.corners = None  # smoothed quad, normalized to 0-1
+        self.still_frames = 0
+        self.captured = False
+        self._since_detection = None
+
+    @property
+    def tracking(self):
+        return self.corners is not None
+
+    def wants_detection(self):
+        """True when this frame should go through the detector"""
+        return (not self.tracking or self._since_detection is None
+                or self._since_detection >= self.detect_every)
+
+    def set_detection(self, box):
+        """Detector box (proxy pixels) for the next frame; None means search the whole frame"""
+        self.box = box
+        self._since_detection = 0
+
+    def _lost(self):
+        self.box = None
+        self.corners = None
+        self.still_frames = 0
+        self.captured = False
+
+    def update(self, frame):
+        """Locate the page in a decoded preview frame and return the per-frame result"""
+        self.frames += 1
+        if self._since_detection is not None:
+            self._since_detection += 1
+        height, width = frame.shape[:2]
+        location = locate_document(frame, 1.0, self.box)
+        if location.corners is None or location.method not in TRACKED_METHODS:
+            self._lost()
+            return self._result(location.method)
+
+        # Consistent corner order (tl, tr, br, bl) so quads can be averaged
+        corners = order_points(location.corners) / np.float32([width, height])
+        diagonal = np.hypot(1.0, 1.0)
+        if self.corners is None:
+            motion = None
+            self.corners = corners
+        else:
+            motion = float(np.linalg.norm(corners - self.corners, axis=1).max()) / diagonal
+            if motion > RESET_MOTION:
+                self.corners = corners
+            else:
+                self.corners = SMOOTHING * corners + (1 - SMOOTHING) * self.corners
+
+        if motion is not None and motion < STABLE_MOTION:
+            self.still_frames += 1
+        else:
+            self.still_frames = 0
+            self.captured = False
+
+        # Next frame: search around this quad instead of running the detector
+        x, y, w, h = cv2.boundingRect(location.corners.astype(np.int32))
+        self.box = (x, y, x + w, y + h)
+        return self._result(location.method)
+
+    def _result(self, method):
+        stable = self.still_frames >= STABLE_FRAMES
+        # Fire "capture" once per settled quad, not on every stable frame
+        capture = stable and not self.captured
+        if capture:
+            self.captured = True
+        corners = None
+        if self.corners is not None:
+            corners = [[round(float(x), 4), round(float(y), 4)] for x, y in self.corners]
+        return {"frame": self.frames, "corners": corners, "method": method,
+                "tracking": self.tracking, "stable": stable, "capture": capture}
+
+
+def decode_preview_frame(data, size=PREVIEW_SIZE):
+    """Decode a preview frame and shrink it to the tracking size (None if undecodable)"""
+    loaded = load_image_for_scan(data, size)
+    if loaded is None:
+        return None
+    return loaded[1]
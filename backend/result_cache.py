@@ -0,0 +1,197 @@
+"""
+Cache of finished scan results keyed on the upload's content.
+Clients retry on flaky networks and re-export the same photos; a hit skips
+detection, warping and filtering entirely. The key covers the image bytes,
+every scan option, the detector weights and the pipeline version.
+Results live in a memory LRU and, optionally, in a size-capped disk tier.
+Disk entries are a JSON header followed by the raw image bytes, never pickles:
+the directory may be shared, and loading a pickle can run arbitrary code.
+get() and put() may touch the disk; call them off the event loop.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("pizel.cache")
+
+RESULT_CACHE_MB = int(os.environ.get("PIZEL_RESULT_CACHE_MB", 128))
+RESULT_CACHE_DIR = os.environ.get("PIZEL_RESULT_CACHE_DIR", "")  # empty: no disk tier
+RESULT_CACHE_DISK_MB = int(os.environ.get("PIZEL_RESULT_CACHE_DISK_MB", 1024))
+CACHE_FILE_SUFFIX = ".result"
+
+
+def result_key(data, options):
+    """
+    Hex digest of the image bytes plus the options that shape the output.
+    Options should have their defaults filled in (model_logic.resolve_batch_options).
+    """
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def dump_result(result):
+    """
+    Serialise a result dict: a 4-byte header length, a JSON header in which
+    every bytes value is replaced by {"$blob": n}, then the blobs back to back.
+    """
+    blobs = []
+
+    def strip(value):
+        if isinstance(value, (bytes, bytearray)):
+            blobs.append(bytes(value))
+            return {"$blob": len(blobs) - 1}
+        if isinstance(value, dict):
+            return {key: strip(item) for key, item in value.items()}
+        return value
+
+    header = json.dumps({"result": strip(result),
+                         "sizes": [len(blob) for blob in blobs]}).encode()
+    return len(header).to_bytes(4, "big") + header + b"".join(blobs)
+
+
+def load_result(data):
+    """Inverse of dump_result; raises ValueError on malformed data"""
+    try:
+        size = int.from_bytes(data[:4], "big")
+        header = json.loads(data[4:4 + size])
+        blobs, offset = [], 4 + size
+        for length in header["sizes"]:
+            blobs.append(data[offset:offset + length])
+            offset += length
+        if offset != len(data):
+            raise ValueError("Blob sizes do not match the file")
+
+        def restore(value):
+            if isinstance(value, dict):
+                if set(value) == {"$blob"}:
+                    return blobs[value["$blob"]]
+                return {key: restore(item) for key, item in value.items()}
+            return value
+
+        return restore(header["result"])
+    except (KeyError, IndexError, TypeError) as e:
+        raise ValueError(f"Malformed cache entry: {e!r}")
+
+
+def _result_size(result):
+    size = len(result.get("image") or b"")
+    if result.get("pdf_image"):
+        size += len(result["pdf_image"]["data"])
+    return size
+
+
+class ResultCache:
+    def __init__(self, max_bytes=RESULT_CACHE_MB * 1024 * 1024, directory=RESULT_CACHE_DIR,
+                 max_disk_bytes=RESULT_CACHE_DISK_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.configured_directory = directory or None
+        self.directory = None  # set by start(); no disk access before that
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()  # key -> result
+        self._bytes = 0
+        self._disk = OrderedDict()  # key -> file size, least recently used first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    def start(self):
+        """Open the disk tier (if configured): create the directory and index what it holds"""
+        if self.configured_directory and self.directory is None:
+            self.directory = self.configured_directory
+            self._load_disk_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + CACHE_FILE_SUFFIX)
+
+    def _load_disk_index(self):
+        # Rebuild the LRU order from modification times (touched on every hit)
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_FILE_SUFFIX):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, name[:-len(CACHE_FILE_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def stats(self):
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": self.misses,
+                    "memory_entries": len(self._entries), "memory_bytes": self._bytes,
+                    "disk_entries": len(self._disk), "disk_bytes": self._disk_bytes}
+
+    def _remember(self, key, result):
+        if key in self._entries:
+            self._bytes -= _result_size(self._entries.pop(key))
+        self._entries[key] = result
+        self._bytes += _result_size(result)
+        while self._bytes > self.max_bytes:
+            _, dropped = self._entries.popitem(last=False)
+            self._bytes -= _result_size(dropped)
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                result = load_result(f.read())
+            os.utime(self._path(key))
+        except (OSError, ValueError) as e:
+            logger.warning("Dropping unreadable cache file %s: %s", key, e)
+            self._forget_disk(key)
+            return None
+        self._disk.move_to_end(key)
+        return result
+
+    def _forget_disk(self, key):
+        self._disk_bytes -= self._disk.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _write_disk(self, key, result):
+        data = dump_result(result)
+        if len(data) > self.max_disk_bytes:
+            return
+        # Write then rename, so a crash never leaves a truncated entry behind
+        tmp_path = self._path(key) + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning("Could not write cache file %s: %s", key, e)
+            return
+        self._disk_bytes += len(data) - self._disk.pop(key, 0)
+        self._disk[key] = len(data)
+        while self._disk_bytes > self.max_disk_bytes:
+            self._forget_disk(next(iter(self._disk)))
+
+    def get(self, key):
+        """Cached result for key (promoted to the memory tier on a disk hit) or None"""
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits["memory"] += 1
+                return result
+            if key in self._disk:
+                result = self._read_disk(key)
+                if result is not None:
+                    self._remember(key, result)
+                    self.hits["disk"] += 1
+                    return result
+            self.misses += 1
+            return None
+
+    def put(self, key, result):
+        """Store a finished page result (a dict of plain values and bytes)"""
+        with self._lock:
+            self._remember(key, result)
+            if self.directory:
+                self._write_disk(key, result)
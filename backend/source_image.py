@@ -0,0 +1,139 @@
+"""
+Encoded source photos, decoded only as far as each stage needs.
+A 48-200 MP upload is never held fully decoded while it waits for detection:
+the detection proxy comes from a DCT-scaled JPEG decode (1/2, 1/4 or 1/8
+resolution straight out of the decoder), and the page warp decodes at the
+coarsest resolution that still covers the output DPI. Every decoded frame is
+also capped by the per-worker memory budget: JPEGs are reduced in the decoder,
+other formats (PNG, WebP, ...) are decoded in full once and shrunk to the
+budget straight away.
+"""
+import logging
+import math
+import os
+
+import cv2
+import numpy as np
+
+from pdf_writer import jpeg_header
+
+logger = logging.getLogger("pizel.scanner")
+
+WORKER_MEMORY_MB = int(os.environ.get("PIZEL_WORKER_MEMORY_MB", 1024))
+# Share of the budget a decoded frame may take; the rest covers the warped page,
+# the filter's planes and the detector
+FRAME_BUDGET_SHARE = 0.25
+# JPEG decoder reductions (DCT scaling); other formats decode fully and are shrunk after
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def image_size(data):
+    """(width, height) from an encoded JPEG or PNG header, or None"""
+    if data[:2] == b"\xff\xd8":
+        try:
+            width, height, _ = jpeg_header(data)
+            return width, height
+        except ValueError:
+            return None
+    if data[:8] == PNG_SIGNATURE and data[12:16] == b"IHDR":
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    return None
+
+
+class SourceImage:
+    """
+    A photo kept encoded until a stage asks for pixels. width/height are the
+    full-resolution size; decode(scale) returns the cheapest frame with at
+    least that share of it.
+    """
+
+    def __init__(self, data=None, image=None, max_frame_bytes=None):
+        self.data = data
+        if max_frame_bytes is None:
+            max_frame_bytes = int(WORKER_MEMORY_MB * 1024 * 1024 * FRAME_BUDGET_SHARE)
+        self.max_frame_bytes = max_frame_bytes
+        size = None if data is None else image_size(data)
+        if image is None and size is None:
+            # No readable header: decode once and keep the frame
+            image = _decode(data, 1)
+        self._image = image  # already decoded
+        if image is not None:
+            size = image.shape[1], image.shape[0]
+        self.width, self.height = size or (None, None)  # None: undecodable
+        self.reducible = image is None and data[:2] == b"\xff\xd8"
+
+    @property
+    def shape(self):
+        return (self.height, self.width, 3)
+
+    def _frame_bytes(self, reduction):
+        return math.ceil(self.width / reduction) * math.ceil(self.height / reduction) * 3
+
+    def _reduction(self, scale):
+        if not self.reducible:
+            return 1
+        reduction = next((r for r in (8, 4, 2) if 1 / r >= scale), 1)
+        wanted = reduction
+        while reduction < 8 and self._frame_bytes(reduction) > self.max_frame_bytes:
+            reduction *= 2
+        if reduction != wanted:
+            logger.warning("Decoding %dx%d at 1/%d to stay within PIZEL_WORKER_MEMORY_MB",
+                           self.width, self.height, reduction)
+        return reduction
+
+    def _fit_budget(self, image):
+        """Shrink a fully decoded frame that is over the memory budget"""
+        height, width = image.shape[:2]
+        factor = math.sqrt(self.max_frame_bytes / (width * height * 3))
+        if factor >= 1:
+            return image
+        logger.warning("Shrinking %dx%d to stay within PIZEL_WORKER_MEMORY_MB", width, height)
+        size = max(1, int(width * factor)), max(1, int(height * factor))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def decode(self, scale=1.0):
+        """
+        Decode with at least scale of the full resolution (less only when the
+        memory budget demands it). Returns (image, (sx, sy)), the decoded size
+        relative to the full-resolution one. Raises ValueError if undecodable.
+        """
+        if self._image is not None:
+            return self._image, (1.0, 1.0)
+        image = _decode(self.data, self._reduction(scale))
+        if image is None:
+            raise ValueError("Could not decode image")
+        if not self.reducible:
+            image = self._fit_budget(image)
+        height, width = image.shape[:2]
+        # The decoder applies EXIF rotation; the header size does not
+        if (width > height and self.height > self.width) or \
+                (height > width and self.width > self.height):
+            self.width, self.height = self.height, self.width
+        return image, (width / self.width, height / self.height)
+
+
+def _decode(data, reduction):
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, REDUCED_FLAGS[reduction])
+
+
+def open_source(image_source):
+    """SourceImage from upload bytes, a file path or a decoded array (None if unreadable)"""
+    if isinstance(image_source, SourceImage):
+        return image_source
+    if isinstance(image_source, np.ndarray):
+        return SourceImage(image=image_source)
+    if not isinstance(image_source, (bytes, bytearray, memoryview)):
+        try:
+            with open(image_source, "rb") as f:
+                image_source = f.read()
+        except OSError:
+            return None
+    source = SourceImage(image_source)
+    if not source.width or not source.height:
+        return None
+    return source
@@ -0,0 +1,41 @@
+"""
+Shared fixtures. The API tests run the real app with one scan worker on the
+"classical" detector and no model, so neither ultralytics nor weights are needed.
+"""
+import os
+
+os.environ.setdefault("PIZEL_DETECTOR", "classical")
+os.environ.setdefault("PIZEL_MODEL_PATH", "none")
+os.environ.setdefault("PIZEL_SCAN_WORKERS", "1")
+os.environ.setdefault("PIZEL_CONTOUR_THREADS", "1")
+os.environ.setdefault("PIZEL_ADMIN_TOKEN", "test-token")
+
+import cv2
+import pytest
+
+from benchmark import make_scene
+
+
+def encode_jpeg(image):
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+@pytest.fixture(scope="session")
+def scene():
+    """A 600x800 synthetic page photo: (image, true corners)"""
+    image, corners, _ = make_scene(0, 600, 800)
+    return image, corners
+
+
+@pytest.fixture(scope="session")
+def photo(scene):
+    """The synthetic photo as upload bytes"""
+    return encode_jpeg(scene[0])
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
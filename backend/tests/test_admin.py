@@ -0,0 +1,33 @@
+import pytest
+
+import main
+
+TOKEN = {"X-Admin-Token": "test-token"}
+
+
+def test_admin_needs_token(client):
+    assert client.get("/admin/cache").status_code == 401
+    assert client.get("/admin/cache", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    assert client.post("/admin/model", data={"backend": "classical"}).status_code == 401
+    assert client.get("/admin/cache", headers=TOKEN).status_code == 200
+
+
+def test_admin_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    assert client.get("/admin/cache", headers=TOKEN).status_code == 403
+
+
+@pytest.mark.parametrize("model_path", ["/etc/passwd", "../yolov8n.pt", "sub/model.pt",
+                                        ".hidden.pt", "weights.pkl", "missing.pt"])
+def test_model_path_must_be_a_file_in_the_model_dir(client, model_path):
+    response = client.post("/admin/model", data={"model_path": model_path}, headers=TOKEN)
+    assert response.status_code == 400
+
+
+def test_model_from_model_dir(client, tmp_path, monkeypatch):
+    (tmp_path / "custom.pt").write_bytes(b"")
+    monkeypatch.setattr(main, "MODEL_DIR", str(tmp_path))
+    assert main.model_file("custom.pt") == str(tmp_path / "custom.pt")
+    response = client.post("/admin/model", data={"model_path": "none", "backend": "classical"},
+                           headers=TOKEN)
+    assert response.json() == {"model_path": "none", "backend": "classical"}
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import pytest
+
+from admission import AdmissionController, AdmissionError, TIERS, cap_profile, scan_options
+
+
+def controller(pending=0, max_queued=10, workers=2, **kwargs):
+    pool = SimpleNamespace(pending=pending, max_queued=max_queued, workers=workers)
+    return AdmissionController(pool, **kwargs)
+
+
+def test_idle_server_serves_the_full_tier():
+    ticket = controller().admit()
+    assert ticket.tier_name == "full"
+    assert scan_options(ticket.tier, None)["straighten"]
+
+
+def test_load_picks_cheaper_tiers():
+    assert controller(pending=5).admit().tier_name == "reduced"
+    assert controller(pending=8).admit().tier_name == "degraded"
+    assert controller(pending=9).admit().tier_name == "minimal"
+
+
+def test_concurrency_limit_and_release():
+    admission = controller(max_concurrent=1)
+    ticket = admission.admit()
+    with pytest.raises(AdmissionError) as error:
+        admission.admit()
+    assert error.value.status_code == 429
+    ticket.release()
+    ticket.release()  # idempotent
+    assert admission.active == 0
+    admission.admit()
+
+
+def test_deadline_lowers_the_tier_or_rejects():
+    admission = controller(workers=1)
+    admission.page_seconds = 1.0
+    assert admission.admit(pages=1, deadline=0.6).tier_name == "degraded"
+    with pytest.raises(AdmissionError) as error:
+        admission.admit(pages=1, deadline=0.1)
+    assert error.value.status_code == 503
+    assert admission.rejected["deadline"] == 1
+
+
+def test_observed_pages_update_the_estimate():
+    admission = controller()
+    admission.observe(TIERS[0], {"detect": 3000.0})
+    assert admission.page_seconds == pytest.approx(1.2)
+
+
+def test_tier_caps_the_filter_profile():
+    degraded = TIERS[2]
+    assert cap_profile("quality", degraded) == "fast"
+    assert cap_profile("fast", TIERS[1]) == "fast"
+    assert cap_profile("quality", TIERS[0]) == "quality"
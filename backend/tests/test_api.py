@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+import main
+
+
+def uploads(photo, count):
+    return [("files", (f"page{i}.jpg", photo, "image/jpeg")) for i in range(count)]
+
+
+def test_process_multiple(client, photo):
+    response = client.post("/process-multiple", files=uploads(photo, 2),
+                           data={"profile": "fast"})
+    assert response.status_code == 200
+    body = response.json()
+    assert len(body["processed_images"]) == 2
+    # No model: the synthetic page is below the classical shortcut's confidence,
+    # so the whole-frame contour search finds it
+    assert body["methods"] == ["Full image contour"] * 2
+    assert body["tier"] == "full"
+    assert "Server-Timing" in response.headers
+
+
+def test_request_over_the_pool_queue_gets_413(client, photo, monkeypatch):
+    monkeypatch.setattr(main.scan_pool, "max_queued", 1)
+    response = client.post("/process-multiple", files=uploads(photo, 2))
+    assert response.status_code == 413
+    assert "At most 1 pages" in response.json()["detail"]
+
+
+def test_failed_scan_releases_its_admission_slot(client, photo, monkeypatch):
+    def broken(scan, pages):
+        raise RuntimeError("cache unavailable")
+    monkeypatch.setattr(main, "cache_lookup", broken)
+    with pytest.raises(RuntimeError):
+        client.post("/process-multiple", files=uploads(photo, 1))
+    assert main.admission_control.active == 0
+
+
+def test_pages_are_kept_only_on_request(client, photo):
+    response = client.post("/process-multiple", files=uploads(photo, 1),
+                           data={"profile": "fast", "output_dpi": "100"})
+    assert response.json()["page_ids"] == [None]
+
+    response = client.post("/process-multiple", files=uploads(photo, 1),
+                           data={"profile": "fast", "output_dpi": "100", "keep_pages": "true"})
+    page_id = response.json()["page_ids"][0]
+    assert page_id is not None
+
+    response = client.post("/refilter", data={"page_id": page_id, "filter_mode": "bw"})
+    assert response.status_code == 200
+    assert response.json()["encoding"]["format"] == "png"
+
+
+def test_refilter_does_not_wait_for_the_scan_pool(client, photo, monkeypatch):
+    response = client.post("/process-multiple", files=uploads(photo, 1),
+                           data={"profile": "fast", "output_dpi": "100", "keep_pages": "true"})
+    page_id = response.json()["page_ids"][0]
+
+    async def busy(*args, **kwargs):
+        raise main.PoolBusyError("busy")
+    monkeypatch.setattr(main.scan_pool, "run_page", busy)
+    response = client.post("/refilter", data={"page_id": page_id, "filter_mode": "gray"})
+    assert response.status_code == 200
+
+
+def test_refilter_unknown_page_gets_404(client):
+    response = client.post("/refilter", data={"page_id": "unknown"})
+    assert response.status_code == 404
+
+
+def test_manual_corners(client, photo, scene):
+    points = json.dumps(scene[1].tolist())
+    response = client.post("/process-manual", data={"points": points, "output_dpi": "100"},
+                           files={"file": ("page.jpg", photo, "image/jpeg")})
+    assert response.status_code == 200
+    assert response.json()["method"] == "Manual corners"
+
+
+def test_degenerate_manual_corners_get_400(client, photo):
+    response = client.post("/process-manual", data={"points": json.dumps([[5, 5]] * 4)},
+                           files={"file": ("page.jpg", photo, "image/jpeg")})
+    assert response.status_code == 400
+
+
+def test_duplicates_keep_their_position(client, photo):
+    response = client.post("/process-multiple", files=uploads(photo, 2),
+                           data={"profile": "fast", "output_dpi": "100", "dedupe": "true"})
+    body = response.json()
+    assert len(body["processed_images"]) == 2
+    assert body["processed_images"][0] == body["processed_images"][1]
+    assert [entry["index"] for entry in body["duplicates"]] == [1]
+
+
+def test_pdf_response(client, photo):
+    response = client.post("/process-multiple", files=uploads(photo, 2),
+                           data={"profile": "fast", "output_dpi": "100",
+                                 "response_format": "pdf"})
+    assert response.headers["content-type"] == "application/pdf"
+    assert response.content.startswith(b"%PDF") and b"/Count 2" in response.content
+
+
+def test_ndjson_stream(client, photo):
+    response = client.post("/process-multiple",
+                           files=uploads(photo, 1) + [("files", ("bad.jpg", b"junk", "image/jpeg"))],
+                           data={"profile": "fast", "output_dpi": "100",
+                                 "response_format": "ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    statuses = {line["index"]: line["status"] for line in lines[:-1]}
+    assert statuses == {0: "ok", 1: "failed"}
+    assert "image" in lines[0] or "image" in lines[1]
+    assert lines[-1] == {"done": True, "pages": 2}
+
+
+def test_multipart_stream(client, photo):
+    response = client.post("/process-multiple", files=uploads(photo, 2),
+                           data={"profile": "fast", "output_dpi": "100",
+                                 "response_format": "multipart"})
+    assert response.headers["content-type"].startswith("multipart/mixed")
+    boundary = f"--{main.MULTIPART_BOUNDARY}".encode()
+    parts = response.content.split(boundary)[1:-1]
+    assert len(parts) == 2
+    assert all(b"Content-Type: image/jpeg" in part for part in parts)
+    assert response.content.endswith(boundary + b"--\r\n")
@@ -0,0 +1,26 @@
+import json
+
+import numpy as np
+
+import benchmark
+from benchmark import corner_error, make_scene
+
+
+def test_scenes_are_reproducible():
+    first, corners, params = make_scene(3, 300, 400)
+    second, same_corners, _ = make_scene(3, 300, 400)
+    assert first.shape == (400, 300, 3)
+    assert np.array_equal(first, second) and np.array_equal(corners, same_corners)
+    assert corner_error(corners, corners) == 0
+
+
+def test_quick_run_and_baseline_comparison(tmp_path):
+    output = str(tmp_path / "baseline.json")
+    args = ["--no-detector", "--scenes", "1", "--repeat", "1", "--resolutions", "300x400",
+            "--modes", "enhanced", "--profiles", "fast"]
+    assert benchmark.main(args + ["--output", output]) == 0
+    with open(output) as f:
+        report = json.load(f)
+    assert report["results"][0]["corner_error_px"] < 10
+    # Against itself nothing can regress
+    assert benchmark.main(args + ["--baseline", output, "--tolerance", "1000"]) == 0
@@ -0,0 +1,51 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+import bulk_scan
+from bulk_scan import Source, collect_sources, write_page
+
+RESULT = {"image": b"page", "encoding": {"format": "jpeg"}}
+
+
+def make_zip(path, names, data=b"photo"):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name in names:
+            archive.writestr(name, data)
+    return str(path)
+
+
+def test_unsafe_archive_members_are_skipped(tmp_path):
+    archive = make_zip(tmp_path / "photos.zip", ["ok/page.jpg", "../evil.jpg", "/etc/evil.jpg",
+                                                 "a/../../evil.jpg", "C:/evil.jpg"])
+    sources = collect_sources([archive])
+    assert [source.path for source in sources] == ["ok/page.jpg"]
+    assert sources[0].output == os.path.join("photos", "ok", "page")
+
+
+def test_write_page_stays_in_the_output_directory(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    assert write_page(str(out), Source("k", None, "p", "", "a/page"), RESULT) == "a/page.jpg"
+    with pytest.raises(ValueError):
+        write_page(str(out), Source("k", None, "p", "", "../evil"), RESULT)
+    # A symlink inside the output directory must not lead outside either
+    os.symlink(tmp_path, out / "link")
+    with pytest.raises(ValueError):
+        write_page(str(out), Source("k", None, "p", "", "link/evil"), RESULT)
+    assert not (tmp_path / "evil.jpg").exists()
+
+
+def test_scan_archive_and_resume(tmp_path, photo, capsys):
+    archive = make_zip(tmp_path / "photos.zip", ["p1.jpg", "sub/p2.jpg"], photo)
+    out = str(tmp_path / "out")
+    args = [archive, "-o", out, "--workers", "1", "--profile", "fast", "--output-dpi", "100"]
+    assert bulk_scan.main(args) == 0
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["pages"] == 2
+    assert os.path.exists(os.path.join(out, "photos", "sub", "p2.jpg"))
+
+    assert bulk_scan.main(args) == 0
+    assert json.loads(capsys.readouterr().out)["skipped"] == 2
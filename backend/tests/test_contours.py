@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+
+import model_logic
+from model_logic import find_best_contour, order_points
+
+
+def page_on_dark(corners):
+    image = np.full((640, 480, 3), 40, dtype=np.uint8)
+    cv2.fillPoly(image, [np.int32(corners)], (235, 235, 235))
+    return image
+
+
+CORNERS = [[60, 80], [420, 60], [440, 580], [50, 600]]
+
+
+def test_clean_quad_is_found_confidently():
+    result = find_best_contour(page_on_dark(CORNERS))
+    assert result.confidence >= model_logic.CONTOUR_CONFIDENCE
+    found = order_points(result.contour.reshape(-1, 2).astype(np.float32))
+    assert np.abs(found - order_points(np.float32(CORNERS))).max() < 3
+
+
+def test_search_stops_at_the_first_confident_method(monkeypatch):
+    monkeypatch.setattr(model_logic, "CONTOUR_THREADS", 1)
+    tried = []
+    search = model_logic._search_contours
+    monkeypatch.setattr(model_logic, "_search_contours",
+                        lambda analysis, method: tried.append(method) or search(analysis, method))
+    find_best_contour(page_on_dark(CORNERS))
+    assert tried == ["otsu"]
+
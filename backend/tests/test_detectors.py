@@ -0,0 +1,56 @@
+import pickle
+
+import cv2
+import numpy as np
+
+from detectors import DOCUMENT_CLASS_ID, OnnxDetector, QuadBox
+from model_logic import classical_document_box, locate_document, order_points
+
+
+def test_quad_box_keeps_its_corners_across_processes():
+    corners = np.float32([[0, 0], [4, 0], [4, 3], [0, 3]])
+    box = pickle.loads(pickle.dumps(QuadBox((0, 0, 4, 3), corners)))
+    assert box == (0, 0, 4, 3)
+    assert np.array_equal(box.corners, corners)
+
+
+def test_classical_box_carries_the_contour():
+    image = np.full((640, 480, 3), 40, dtype=np.uint8)
+    corners = np.float32([[60, 80], [420, 60], [440, 580], [50, 600]])
+    cv2.fillPoly(image, [corners.astype(np.int32)], (235, 235, 235))
+    box = classical_document_box(image)
+    assert isinstance(box, QuadBox)
+    assert np.abs(order_points(box.corners) - order_points(corners)).max() < 3
+
+
+def test_classical_box_ignores_the_frame_border():
+    # A plain frame has no page; its outline must not pass for one
+    assert classical_document_box(np.full((640, 480, 3), 200, dtype=np.uint8)) is None
+
+
+def test_locate_document_uses_the_box_corners(scene):
+    image, _ = scene
+    corners = np.float32([[10, 10], [100, 12], [98, 150], [12, 148]])
+    location = locate_document(image, 0.5, QuadBox((10, 10, 100, 150), corners))
+    assert location.method == "4-point contour"
+    assert np.array_equal(location.corners, corners * 2)
+
+
+def onnx_output(class_scores):
+    """One YOLOv8 output (1 x (4 + 80) x anchors) with a box per row of class_scores"""
+    # Real exports have thousands of anchors; pad so the layout is unambiguous
+    predictions = np.zeros((max(len(class_scores), 100), 84), dtype=np.float32)
+    predictions[:, :4] = [320, 320, 200, 300]  # cx, cy, w, h
+    for anchor, scores in enumerate(class_scores):
+        for cls, score in scores.items():
+            predictions[anchor, 4 + cls] = score
+    return predictions.T[None]
+
+
+def test_onnx_box_needs_book_to_be_the_best_class():
+    detector = object.__new__(OnnxDetector)
+    shape = (640, 640, 3)
+    book_second = onnx_output([{0: 0.9, DOCUMENT_CLASS_ID: 0.3}])
+    assert detector._box(book_second, 1.0, (0, 0), shape) is None
+    book_first = onnx_output([{0: 0.2, DOCUMENT_CLASS_ID: 0.6}])
+    assert detector._box(book_first, 1.0, (0, 0), shape) == (220, 170, 420, 470)
@@ -0,0 +1,32 @@
+import cv2
+import numpy as np
+
+from benchmark import make_scene
+from conftest import encode_jpeg
+from duplicates import find_duplicates, is_duplicate, page_signature
+
+
+def shifted(image, dx, dy):
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(image, matrix, (image.shape[1], image.shape[0]),
+                          borderMode=cv2.BORDER_REPLICATE)
+
+
+def test_retake_is_a_duplicate(scene):
+    image, _ = scene
+    assert is_duplicate(page_signature(encode_jpeg(image)),
+                        page_signature(encode_jpeg(shifted(image, 6, -4))))
+
+
+def test_different_page_is_not(scene):
+    other, _, _ = make_scene(1, 600, 800)
+    assert not is_duplicate(page_signature(encode_jpeg(scene[0])),
+                            page_signature(encode_jpeg(other)))
+
+
+def test_sharpest_photo_is_kept(scene):
+    image, _ = scene
+    blurred = cv2.GaussianBlur(image, (0, 0), 2)
+    signatures = [page_signature(encode_jpeg(blurred)), page_signature(encode_jpeg(image)),
+                  None, page_signature(b"not an image")]
+    assert find_duplicates(signatures) == {0: 1}
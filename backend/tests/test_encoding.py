@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import pytest
+
+from encoding import DEFAULT_JPEG_QUALITY, encode_page, is_gray
+
+
+@pytest.fixture(scope="module")
+def page():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (200, 150, 3), dtype=np.uint8)
+
+
+def decode(data):
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+def test_auto_picks_bilevel_png_for_bw():
+    page = np.full((40, 40), 250, dtype=np.uint8)
+    page[10:20] = 5
+    encoded = encode_page(page, "bw")
+    assert (encoded.format, encoded.mime, encoded.quality) == ("png", "image/png", None)
+    assert set(np.unique(decode(encoded.data))) == {0, 255}
+
+
+def test_gray_content_is_stored_single_channel(page):
+    gray = np.repeat(page[..., :1], 3, axis=2)
+    assert is_gray(gray) and not is_gray(page)
+    encoded = encode_page(gray, "gray")
+    assert encoded.format == "jpeg" and decode(encoded.data).ndim == 2
+
+
+def test_explicit_format_and_quality(page):
+    encoded = encode_page(page, "enhanced", fmt="webp", quality=50)
+    assert (encoded.format, encoded.quality) == ("webp", 50)
+    assert encode_page(page, "enhanced").quality == DEFAULT_JPEG_QUALITY
+
+
+def test_target_size_lowers_the_quality(page):
+    full = encode_page(page, "enhanced")
+    target = len(full.data) // 2
+    encoded = encode_page(page, "enhanced", target_bytes=target)
+    assert encoded.quality < DEFAULT_JPEG_QUALITY
+    assert len(encoded.data) <= target
+
+
+def test_unknown_format(page):
+    with pytest.raises(ValueError):
+        encode_page(page, "enhanced", fmt="gif")
@@ -0,0 +1,31 @@
+import numpy as np
+
+from image_analysis import ImageAnalysis, as_analysis
+
+
+def test_planes_are_computed_once(scene):
+    analysis = ImageAnalysis(scene[0])
+    assert analysis.blur() is analysis.blur()
+    assert analysis.edges() is analysis.edges()
+    assert analysis.edges(blurred=False) is not analysis.edges()
+    assert analysis.hough_lines(100) is analysis.hough_lines(100)
+
+
+def test_gray_input_is_not_copied():
+    gray = np.zeros((10, 10), dtype=np.uint8)
+    assert ImageAnalysis(gray).gray is gray
+
+
+def test_crop_reuses_the_parent_planes_as_views(scene):
+    analysis = ImageAnalysis(scene[0])
+    otsu = analysis.otsu()
+    crop = analysis.crop(10, 20, 110, 220)
+    assert crop.shape[:2] == (200, 100)
+    assert np.shares_memory(crop.otsu(), otsu)
+    assert np.array_equal(crop.otsu(), otsu[20:220, 10:110])
+
+
+def test_as_analysis_passes_an_analysis_through(scene):
+    analysis = ImageAnalysis(scene[0])
+    assert as_analysis(analysis) is analysis
+    assert as_analysis(scene[0]).image is scene[0]
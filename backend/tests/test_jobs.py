@@ -0,0 +1,101 @@
+import asyncio
+
+from jobs import JobManager, QueueFullError
+from worker_pool import PoolBusyError
+
+
+def describe(index, filename, result):
+    if result is None:
+        return {"index": index, "filename": filename, "status": "failed"}, None
+    return {"index": index, "filename": filename, "status": "ok"}, result
+
+
+class FakePool:
+    """iter_pages that records its calls; pages are (data, save_path) pairs"""
+
+    def __init__(self, busy=0):
+        self.calls = []
+        self.busy = busy  # calls refused with PoolBusyError first
+
+    async def iter_pages(self, scan, pages, timeout=None):
+        if self.busy:
+            self.busy -= 1
+            raise PoolBusyError("busy")
+        self.calls.append((len(pages), timeout))
+        return self._results(scan, pages)
+
+    async def _results(self, scan, pages):
+        for position, result in enumerate(scan(pages)):
+            yield position, result
+
+
+def scan(pages):
+    return [None if data == b"bad" else data for data, _ in pages]
+
+
+def run_job(manager, pages, **kwargs):
+    async def main():
+        manager.start()
+        job = manager.submit(scan, [(data, None) for data in pages],
+                             [f"page{i}" for i in range(len(pages))], **kwargs)
+        queue = job.subscribe()
+        while (await queue.get())["event"] != "done":
+            pass
+        await manager.stop()
+        return job
+    return asyncio.run(main())
+
+
+def test_job_is_scanned_in_chunks():
+    pool = FakePool()
+    manager = JobManager(pool.iter_pages, describe, chunk_pages=4, chunk_timeout=5)
+    job = run_job(manager, [b"x"] * 10)
+    assert job.status == "done"
+    assert pool.calls == [(4, 5), (4, 5), (2, 5)]
+    assert job.images == [b"x"] * 10
+
+
+def test_job_waits_for_pool_room(monkeypatch):
+    monkeypatch.setattr("jobs.POOL_BUSY_BACKOFF", 0.01)
+    pool = FakePool(busy=1)
+    rooms = iter([False, False, True, True])
+    manager = JobManager(pool.iter_pages, describe, has_room=lambda pages: next(rooms))
+    job = run_job(manager, [b"x"] * 2)
+    assert job.status == "done"
+    assert pool.calls == [(2, manager.chunk_timeout)]
+
+
+def test_failed_pages_can_be_retried():
+    pool = FakePool()
+    manager = JobManager(pool.iter_pages, describe)
+    job = run_job(manager, [b"x", b"bad"])
+    assert job.status == "partial"
+    assert job.pages[0] is None and job.pages[1] is not None
+
+    async def retry():
+        manager.start()
+        job.pages[1] = (b"y", None)
+        queue = job.subscribe()
+        assert manager.retry(job) == 1
+        while (await queue.get())["event"] != "done":
+            pass
+        await manager.stop()
+    asyncio.run(retry())
+    assert job.status == "done"
+    assert pool.calls[-1][0] == 1
+
+
+def test_queue_is_bounded():
+    manager = JobManager(FakePool().iter_pages, describe, max_queued_pages=3)
+
+    async def main():
+        manager.start()
+        manager.submit(scan, [(b"x", None)] * 2, ["a", "b"])
+        try:
+            manager.submit(scan, [(b"x", None)] * 2, ["a", "b"])
+        except QueueFullError:
+            return True
+        finally:
+            await manager.stop()
+        return False
+    assert asyncio.run(main())
@@ -0,0 +1,69 @@
+import json
+
+
+def uploads(photo, count):
+    return [("files", (f"page{i}.jpg", photo, "image/jpeg")) for i in range(count)]
+
+
+def test_job_lifecycle(client, photo):
+    response = client.post("/jobs", files=uploads(photo, 3),
+                           data={"profile": "fast", "output_dpi": "100", "priority": "5"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    # The event stream ends once the job is done
+    with client.stream("GET", f"/jobs/{job_id}/events") as events:
+        lines = [line for line in events.iter_lines() if line.startswith("data:")]
+    done = json.loads(lines[-1][len("data:"):])
+    assert done["status"] == "done" and done["counts"] == {"ok": 3}
+
+    status = client.get(f"/jobs/{job_id}").json()
+    assert [page["status"] for page in status["results"]] == ["ok"] * 3
+    assert all(page["page_id"] is None for page in status["results"])
+    page = client.get(f"/jobs/{job_id}/pages/2")
+    assert page.headers["content-type"] == "image/jpeg" and page.content
+
+    assert client.delete(f"/jobs/{job_id}").status_code == 200
+    assert client.get(f"/jobs/{job_id}").status_code == 404
+
+
+def test_job_rejects_bad_priority(client, photo):
+    response = client.post("/jobs", files=uploads(photo, 1), data={"priority": "10"})
+    assert response.status_code == 400
+
+
+def test_two_subscribers_get_every_event():
+    import asyncio
+
+    import main
+    from jobs import JobManager
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def iter_pages(scan, pages, timeout=None):
+            async def results():
+                await gate.wait()
+                for position, (data, _) in enumerate(pages):
+                    yield position, data
+            return results()
+
+        def describe(index, filename, result):
+            return {"index": index, "filename": filename, "status": "ok"}, result
+
+        async def collect(stream):
+            return [chunk async for chunk in stream]
+
+        manager = JobManager(iter_pages, describe)
+        manager.start()
+        job = manager.submit(None, [(b"x", None)] * 2, ["a", "b"])
+        streams = [asyncio.ensure_future(collect(main.stream_job_events(job))) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        gate.set()
+        events = await asyncio.gather(*streams)
+        await manager.stop()
+        return events
+
+    first, second = asyncio.run(run())
+    assert first == second
+    assert [chunk.split("\n")[0] for chunk in first] == ["event: page", "event: page", "event: done"]
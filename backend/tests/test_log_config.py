@@ -0,0 +1,30 @@
+import json
+import logging
+
+import pytest
+
+from log_config import configure_logging
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger("pizel")
+    handlers, level = root.handlers[:], root.level
+    yield
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_records_are_json_lines(capsys, restore_logging):
+    configure_logging("DEBUG")
+    configure_logging("DEBUG")  # repeated calls do not add handlers
+    logger = logging.getLogger("pizel.test")
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("Page %d failed", 3)
+    lines = capsys.readouterr().err.strip().splitlines()
+    assert len(lines) == 1
+    entry = json.loads(lines[0])
+    assert entry["level"] == "ERROR" and entry["logger"] == "pizel.test"
+    assert entry["message"] == "Page 3 failed" and "ValueError: boom" in entry["exception"]
@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+import pytest
+
+import benchmark
+from model_logic import (DEFAULT_FILTER_PROFILE, load_image_for_scan, locate_document,
+                         order_points, process_manual_corners, process_uploaded_image,
+                         scan_documents_batch, warp_document)
+
+
+def test_process_uploaded_image_in_memory(photo):
+    result = process_uploaded_image(photo, save_path=None)
+    assert isinstance(result, np.ndarray) and result.size
+
+
+def test_process_uploaded_image_to_file(photo, tmp_path):
+    path = str(tmp_path / "page.jpg")
+    assert process_uploaded_image(photo, save_path=path) == path
+    assert (tmp_path / "page.jpg").stat().st_size > 0
+
+
+def test_process_uploaded_image_failure():
+    assert process_uploaded_image(b"not an image", save_path=None) is None
+
+
+def test_default_profile_is_benchmarked():
+    assert DEFAULT_FILTER_PROFILE in benchmark.DEFAULT_PROFILES.split(",")
+
+
+def test_process_manual_corners(photo, scene):
+    _, corners = scene
+    result = process_manual_corners(photo, corners.tolist(), output_dpi=100)
+    assert result.method == "Manual corners"
+    assert result.page.size and result.image.size
+
+
+@pytest.mark.parametrize("points", [
+    [[100, 100]] * 4,  # one repeated point
+    [[100, 100], [200, 200], [300, 300], [400, 400]],  # collinear
+    [[100, 100], [500, 100], [300, 200], [100, 500]],  # concave
+    [[100, 100], [110, 100], [110, 110], [100, 110]],  # far too small
+])
+def test_process_manual_corners_rejects_degenerate_quads(photo, points):
+    with pytest.raises(ValueError):
+        process_manual_corners(photo, points)
+
+
+@pytest.mark.parametrize("degrees", [0, 20, 45, 60])
+def test_process_manual_corners_accepts_rotated_quads(photo, degrees):
+    angles = np.radians(degrees + np.array([225, 315, 45, 135]))
+    points = np.stack([300 + 200 * np.cos(angles), 300 + 200 * np.sin(angles)], axis=1)
+    result = process_manual_corners(photo, points.tolist(), output_dpi=100)
+    assert result.page.size
+
+
+def test_order_points_on_a_diamond():
+    diamond = np.float32([[300, 100], [500, 300], [300, 500], [100, 300]])
+    for shift in range(4):
+        rect = order_points(np.roll(diamond, shift, axis=0))
+        assert len(np.unique(rect, axis=0)) == 4
+        assert cv2.isContourConvex(rect.reshape(-1, 1, 2))
+
+
+def test_batch_scan_keeps_page_order(photo):
+    results = scan_documents_batch([photo, b"junk", photo], output_dpi=100, profile="fast")
+    assert results[1] is None
+    assert results[0].image.shape == results[2].image.shape
+    assert set(results[0].timings) >= {"decode", "detect", "contours", "warp", "filter"}
+
+
+def test_corners_found_on_the_proxy_warp_the_original(scene):
+    image, corners = scene
+    data = cv2.imencode(".png", image)[1].tobytes()
+    orig, proxy, proxy_scale = load_image_for_scan(data, detection_size=320)
+    assert max(proxy.shape[:2]) == 320
+    location = locate_document(proxy, proxy_scale, None)
+    # Back in full-resolution pixels, within the proxy's rounding
+    assert np.abs(order_points(location.corners) - order_points(corners)).max() < 2 / proxy_scale
+    native = warp_document(orig, location, output_dpi=0)
+    reduced = warp_document(orig, location, output_dpi=25)
+    assert reduced.shape[0] < native.shape[0] and reduced.shape[1] < native.shape[1]
@@ -0,0 +1,37 @@
+import time
+
+from page_cache import PageCache
+
+
+def test_put_and_get():
+    cache = PageCache()
+    page_id = cache.put(b"page")
+    assert cache.get(page_id) == b"page"
+    assert cache.nbytes == 4
+    assert cache.get("unknown") is None
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = PageCache(max_bytes=10)
+    first = cache.put(b"x" * 4)
+    second = cache.put(b"y" * 4)
+    cache.get(first)
+    third = cache.put(b"z" * 4)
+    assert cache.get(second) is None
+    assert cache.get(first) is not None and cache.get(third) is not None
+    assert cache.nbytes == 8
+
+
+def test_rejects_missing_and_oversized_pages():
+    cache = PageCache(max_bytes=4)
+    assert cache.put(None) is None
+    assert cache.put(b"x" * 5) is None
+    assert len(cache) == 0
+
+
+def test_entries_expire():
+    cache = PageCache(ttl=0.01)
+    page_id = cache.put(b"page")
+    time.sleep(0.02)
+    assert cache.get(page_id) is None
+    assert cache.nbytes == 0
@@ -0,0 +1,63 @@
+import re
+
+import numpy as np
+import pytest
+
+from conftest import encode_jpeg
+from pdf_writer import IncrementalPdfWriter, is_bilevel, jpeg_header, page_image
+
+
+def build_pdf(writer, pages):
+    data = writer.start()
+    for index, image in pages:
+        data += writer.add_page(index, image)
+    return data + writer.finish()
+
+
+def xref_offsets(data):
+    table = data[data.rindex(b"xref"):].split(b"\n")
+    return [int(line[:10]) for line in table[3:] if line.endswith(b" n ")]
+
+
+def test_jpeg_pages_are_embedded_unchanged():
+    jpeg = encode_jpeg(np.full((30, 20, 3), 128, dtype=np.uint8))
+    assert jpeg_header(jpeg) == (20, 30, 3)
+    image = page_image(np.zeros((30, 20, 3), dtype=np.uint8), jpeg)
+    assert image["filter"] == "/DCTDecode" and image["data"] is jpeg
+
+
+def test_black_and_white_pages_are_one_bit():
+    page = np.full((16, 16), 255, dtype=np.uint8)
+    page[4:8] = 0
+    assert is_bilevel(page)
+    image = page_image(page)
+    assert image["bits"] == 1 and image["filter"] == "/FlateDecode"
+    page[0, 0] = 128
+    assert not is_bilevel(page)
+
+
+def test_xref_points_at_every_object_and_pages_are_in_index_order():
+    jpeg = encode_jpeg(np.zeros((40, 30, 3), dtype=np.uint8))
+    image = page_image(None, jpeg, bilevel=False)
+    writer = IncrementalPdfWriter()
+    data = build_pdf(writer, [(1, image), (0, image)])
+    assert data.startswith(b"%PDF-1.4") and data.endswith(b"%%EOF\n")
+    for offset in xref_offsets(data):
+        assert re.match(rb"\d+ 0 obj", data[offset:])
+    # Page 0 was written second: its page object (8) comes first in /Kids
+    assert b"/Kids [8 0 R 5 0 R] /Count 2" in data
+
+
+def test_paper_sizes_scale_down_and_center():
+    writer = IncrementalPdfWriter("a4", dpi=72)
+    (page_w, page_h), (x, y, w, h) = writer._placement(1190, 1684)
+    assert (page_w, page_h) == (595.28, 841.89)
+    assert w == pytest.approx(595.28, abs=0.5) and x == pytest.approx(0, abs=0.5)
+    # Landscape pages turn the paper
+    (page_w, _), _ = writer._placement(200, 100)
+    assert page_w == 841.89
+
+
+def test_unknown_page_size():
+    with pytest.raises(ValueError):
+        IncrementalPdfWriter("a5")
@@ -0,0 +1,29 @@
+from preview import STABLE_FRAMES, PreviewTracker, decode_preview_frame
+
+
+def test_tracker_settles_and_fires_capture_once(photo):
+    frame = decode_preview_frame(photo)
+    assert max(frame.shape[:2]) <= 320
+    tracker = PreviewTracker()
+    assert tracker.wants_detection()
+    tracker.set_detection(None)
+    results = [tracker.update(frame)]
+    assert not tracker.wants_detection()  # the next frame searches around the last quad
+    results += [tracker.update(frame) for _ in range(STABLE_FRAMES + 2)]
+    assert all(result["tracking"] for result in results)
+    assert [result["capture"] for result in results].count(True) == 1
+    assert results[-1]["stable"]
+    corners = results[-1]["corners"]
+    assert len(corners) == 4 and all(0 <= value <= 1 for point in corners for value in point)
+
+
+def test_undecodable_frame():
+    assert decode_preview_frame(b"junk") is None
+
+
+def test_preview_websocket(client, photo):
+    with client.websocket_connect("/preview") as websocket:
+        websocket.send_bytes(photo)
+        result = websocket.receive_json()
+    assert result["frame"] == 1 and result["tracking"]
+    assert "latency_ms" in result
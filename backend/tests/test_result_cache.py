@@ -0,0 +1,67 @@
+import os
+
+from model_logic import DEFAULT_FILTER_PROFILE, resolve_batch_options
+from result_cache import ResultCache, dump_result, load_result, result_key
+
+RESULT = {"image": b"\xff\xd8page", "method": "4-point contour", "page_id": None,
+          "encoding": {"format": "jpeg", "bytes": 6},
+          "pdf_image": {"width": 2, "height": 3, "data": b"\x00\x01"}}
+
+
+def test_results_round_trip_without_pickle():
+    data = dump_result(RESULT)
+    assert data[4:5] == b"{" and data.endswith(b"\xff\xd8page\x00\x01")
+    assert load_result(data) == RESULT
+
+
+def test_malformed_entries_are_rejected():
+    data = dump_result(RESULT)
+    for broken in (data[:-1], b"\x00\x00\x00\x02{}", b"junk"):
+        try:
+            load_result(broken)
+        except ValueError:
+            continue
+        raise AssertionError(f"accepted {broken!r}")
+
+
+def test_memory_tier_is_bounded():
+    cache = ResultCache(max_bytes=10)
+    cache.put("a", {"image": b"x" * 6})
+    cache.put("b", {"image": b"y" * 6})
+    assert cache.get("a") is None
+    assert cache.get("b") == {"image": b"y" * 6}
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    cache = ResultCache(directory=str(tmp_path))
+    cache.start()
+    cache.put("key", RESULT)
+    restarted = ResultCache(directory=str(tmp_path))
+    restarted.start()
+    assert restarted.get("key") == RESULT
+    assert restarted.stats()["hits"]["disk"] == 1
+
+
+def test_unreadable_disk_entry_is_dropped(tmp_path):
+    cache = ResultCache(directory=str(tmp_path))
+    cache.start()
+    cache.put("key", RESULT)
+    path = cache._path("key")
+    with open(path, "wb") as f:
+        f.write(b"junk")
+    restarted = ResultCache(directory=str(tmp_path))
+    restarted.start()
+    assert restarted.get("key") is None
+    assert not os.path.exists(path)
+
+
+def test_defaults_do_not_change_the_key():
+    explicit = resolve_batch_options({"filter_mode": "enhanced", "output_dpi": None,
+                                      "profile": DEFAULT_FILTER_PROFILE, "detection_size": None,
+                                      "encoding": {"fmt": "auto", "quality": None,
+                                                   "target_bytes": None}})
+    implicit = resolve_batch_options({"profile": None})
+    assert result_key(b"photo", explicit) == result_key(b"photo", implicit)
+    assert result_key(b"photo", implicit) != \
+        result_key(b"photo", resolve_batch_options({"profile": "fast"}))
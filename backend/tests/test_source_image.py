@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+import pytest
+
+from conftest import encode_jpeg
+from memory_usage import peak_rss_mb, reset_peak_rss
+from source_image import SourceImage, image_size, open_source
+
+
+@pytest.fixture(scope="module")
+def photo_2000():
+    image = np.zeros((1500, 2000, 3), dtype=np.uint8)
+    cv2.rectangle(image, (200, 200), (1800, 1300), (255, 255, 255), -1)
+    return encode_jpeg(image)
+
+
+def test_size_comes_from_the_header(photo_2000):
+    assert image_size(photo_2000) == (2000, 1500)
+    png = cv2.imencode(".png", np.zeros((7, 9), dtype=np.uint8))[1].tobytes()
+    assert image_size(png) == (9, 7)
+    assert image_size(b"junk") is None
+
+
+def test_jpeg_decodes_reduced(photo_2000):
+    source = open_source(photo_2000)
+    image, (sx, sy) = source.decode(0.3)
+    assert image.shape[:2] == (750, 1000) and (sx, sy) == (0.5, 0.5)
+    image, scale = source.decode(1.0)
+    assert image.shape[:2] == (1500, 2000) and scale == (1.0, 1.0)
+
+
+def test_memory_budget_forces_a_smaller_decode(photo_2000):
+    source = SourceImage(photo_2000, max_frame_bytes=1000 * 750 * 3)
+    image, (sx, _) = source.decode(1.0)
+    assert image.shape[:2] == (750, 1000) and sx == 0.5
+
+    # PNG has no reduced decode: the full frame is shrunk to the budget
+    png = cv2.imencode(".png", cv2.imdecode(np.frombuffer(photo_2000, np.uint8), 1))[1].tobytes()
+    image, (sx, sy) = SourceImage(png, max_frame_bytes=1000 * 750 * 3).decode(0.1)
+    assert image.shape[0] * image.shape[1] * 3 <= 1000 * 750 * 3
+    assert image.shape[1] == round(2000 * sx) and image.shape[0] == round(1500 * sy)
+
+
+def test_unreadable_sources():
+    assert open_source(b"junk") is None
+    assert open_source("/no/such/file.jpg") is None
+    array = np.zeros((4, 6, 3), dtype=np.uint8)
+    assert open_source(array).decode()[0] is array
+
+
+def test_peak_rss_is_reported():
+    reset_peak_rss()
+    assert peak_rss_mb() > 0
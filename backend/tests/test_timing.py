@@ -0,0 +1,72 @@
+import threading
+
+import metrics
+from timing import collect, merge_timings, server_timing, stage, timed
+
+
+def test_stages_are_recorded_only_inside_a_collector():
+    with stage("detect"):
+        pass  # no collector: nothing to record, nothing raised
+    with collect() as timings:
+        with stage("detect"):
+            pass
+        with stage("detect"):
+            pass
+    assert list(timings) == ["detect"] and timings["detect"] >= 0
+
+
+def test_collectors_are_per_thread():
+    seen = {}
+
+    @timed("filter")
+    def work():
+        return 1
+
+    def other_thread():
+        with collect() as timings:
+            work()
+        seen["other"] = timings
+
+    with collect() as timings:
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+    assert timings == {} and list(seen["other"]) == ["filter"]
+
+
+def test_server_timing_follows_the_pipeline_order():
+    total = merge_timings([{"encode": 1.0, "decode": 2.0}, {"decode": 3.0}, None])
+    assert total == {"encode": 1.0, "decode": 5.0}
+    assert server_timing(dict(total, custom=0.5)) == \
+        "decode;dur=5.0, encode;dur=1.0, custom;dur=0.5"
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("h", "test", "stage", (0.1, 1.0))
+    histogram.observe("detect", 0.05)
+    histogram.observe("detect", 0.5)
+    lines = list(histogram.lines())
+    assert 'h_bucket{stage="detect",le="0.1"} 1' in lines
+    assert 'h_bucket{stage="detect",le="1.0"} 2' in lines
+    assert 'h_bucket{stage="detect",le="+Inf"} 2' in lines
+    assert 'h_count{stage="detect"} 2' in lines
+
+
+def test_pages_are_counted_by_path():
+    counter = metrics.Counter("c", "test", "path")
+    counter.inc("manual")
+    counter.inc("manual", 2)
+    assert 'c{path="manual"} 3' in list(counter.lines())
+    assert metrics.METHOD_PATHS["Manual corners (snapped)"] == "manual"
+
+
+def test_metrics_endpoint(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE pizel_stage_seconds histogram" in response.text
+
+
+def test_first_scan_request_is_timed(client, photo):
+    client.post("/process-multiple", data={"profile": "fast", "output_dpi": "100"},
+                files=[("files", ("page.jpg", photo, "image/jpeg"))])
+    assert 'pizel_startup_seconds{phase="first_request"}' in client.get("/metrics").text
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+from worker_pool import PageLimitError, PoolBusyError, ScanWorkerPool
+
+
+def double_pages(chunk, seconds=0.0):
+    time.sleep(seconds)
+    return [page * 2 for page in chunk]
+
+
+def failing_pages(chunk):
+    raise RuntimeError("boom")
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = ScanWorkerPool(workers=2, max_queued=4)
+    asyncio.run(pool.start("none", "classical"))
+    yield pool
+    pool.shutdown()
+
+
+async def collect(stream):
+    return sorted([item async for item in stream], key=lambda item: item[0])
+
+
+def wait_until_idle(pool, timeout=10):
+    deadline = time.monotonic() + timeout
+    while pool.pending and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return pool.pending
+
+
+def test_results_come_back_per_page(pool):
+    async def run():
+        return await collect(pool.iter_pages(double_pages, [1, 2, 3], batch_size=2))
+    assert asyncio.run(run()) == [(0, 2), (1, 4), (2, 6)]
+    assert wait_until_idle(pool) == 0
+
+
+def test_failed_chunk_fails_its_pages(pool):
+    async def run():
+        return await collect(pool.iter_pages(failing_pages, [1, 2]))
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for _, result in results)
+    assert wait_until_idle(pool) == 0
+
+
+def test_capacity_is_reserved_before_iterating(pool):
+    async def run():
+        first = pool.iter_pages(double_pages, [1, 2, 3], 0.2)
+        # Reserved before the first stream is iterated, so the second call is turned away
+        assert pool.pending == 3
+        with pytest.raises(PoolBusyError):
+            pool.iter_pages(double_pages, [1, 2])
+        return await collect(first)
+    assert len(asyncio.run(run())) == 3
+    assert wait_until_idle(pool) == 0
+
+
+def test_more_pages_than_the_queue_holds(pool):
+    async def run():
+        pool.iter_pages(double_pages, list(range(5)))
+    with pytest.raises(PageLimitError):
+        asyncio.run(run())
+    assert pool.pending == 0
+
+
+def test_timed_out_pages_stay_counted_until_the_workers_finish(pool):
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await collect(pool.iter_pages(double_pages, [1, 2], 1.0, batch_size=1,
+                                          timeout=0.1))
+    asyncio.run(run())
+    # The request gave up, but both workers are still busy with its pages
+    assert pool.pending == 2
+    assert wait_until_idle(pool) == 0
@@ -0,0 +1,74 @@
+"""
+Per-stage timing of the scan pipeline.
+Stages are wrapped in `with stage("detect"):`; the time is added to the
+collector opened with `collect()` on the same thread, and nothing is measured
+when no collector is open. Timings are plain dicts of stage -> milliseconds,
+so they travel back from the worker processes with each page.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Pipeline order, used to sort Server-Timing entries
+STAGES = ("dedupe", "decode", "resize", "detect", "contours", "snap", "warp", "filter",
+          "straighten", "encode")
+
+_local = threading.local()
+
+
+@contextmanager
+def collect(timings=None):
+    """Record the stages run on this thread into timings (a new dict by default)"""
+    timings = {} if timings is None else timings
+    previous = getattr(_local, "timings", None)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+
+def record(name, ms):
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + ms
+
+
+@contextmanager
+def stage(name):
+    if getattr(_local, "timings", None) is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000)
+
+
+def merge_timings(timings_list):
+    """Sum several pages' timings per stage"""
+    total = {}
+    for timings in timings_list:
+        for name, ms in (timings or {}).items():
+            total[name] = total.get(name, 0.0) + ms
+    return total
+
+
+def server_timing(timings):
+    """Server-Timing header value, stages in pipeline order"""
+    order = {name: i for i, name in enumerate(STAGES)}
+    names = sorted(timings, key=lambda name: order.get(name, len(STAGES)))
+    return ", ".join(f"{name};dur={timings[name]:.1f}" for name in names)
+
+
+def timed(name):
+    """Decorator form of stage()"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
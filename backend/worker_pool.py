@@ -0,0 +1,184 @@
+"""
+Process pool that keeps the CPU-bound scanning pipeline off the FastAPI event loop.
+Each worker process preloads the detector once; pages of a request are spread
+across workers and awaited together.
+"""
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from log_config import configure_logging
+from model_logic import set_active_detector, active_model_path, active_backend, MAX_BATCH_SIZE
+
+logger = logging.getLogger("pizel.pool")
+
+SCAN_WORKERS = int(os.environ.get("PIZEL_SCAN_WORKERS", os.cpu_count() or 1))
+MAX_QUEUED_PAGES = int(os.environ.get("PIZEL_MAX_QUEUED_PAGES", 64))
+REQUEST_TIMEOUT = float(os.environ.get("PIZEL_REQUEST_TIMEOUT", 120))
+
+
+class PoolBusyError(Exception):
+    """Raised when accepting more pages would overflow the bounded queue"""
+
+
+class PageLimitError(Exception):
+    """Raised for a call with more pages than the queue ever holds (retrying cannot help)"""
+
+
+def init_worker(model_path, backend=None):
+    # Runs once in every worker process: set up logging, load + warm up the detector
+    # and make it the one every scan in this process uses
+    configure_logging()
+    set_active_detector(model_path, backend=backend)
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+class ScanWorkerPool:
+    def __init__(self, workers=SCAN_WORKERS, max_queued=MAX_QUEUED_PAGES):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.model_path = None
+        self.backend = None
+        self._executor = None
+        # Pages submitted to the workers and not finished there yet; updated from
+        # the executor's callback thread as well as the event loop
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _create_executor(self, model_path, backend):
+        # spawn: never fork a process that may already hold torch/OpenCV threads
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(model_path, backend),
+        )
+
+    async def _warm_up(self, executor):
+        # Executors start processes lazily; touch every worker so the model
+        # is loaded before traffic arrives rather than on the first request
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(executor, _worker_ready)
+                               for _ in range(self.workers)])
+
+    async def start(self, model_path=None, backend=None):
+        """(Re)start the workers on a detector; omitted settings keep the current ones"""
+        model_path = model_path or self.model_path or active_model_path()
+        backend = backend or self.backend or active_backend()
+        executor = self._create_executor(model_path, backend)
+        try:
+            await self._warm_up(executor)
+        except Exception:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        old, self._executor = self._executor, executor
+        self.model_path, self.backend = model_path, backend
+        if old is not None:
+            # Let in-flight pages finish on the old workers
+            old.shutdown(wait=False)
+        logger.info("Scan pool ready: %d workers (%s, %s detector)", self.workers, model_path,
+                    backend)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        """Run one call in a worker process (not counted against the page queue)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _release(self, page_count):
+        with self._pending_lock:
+            self._pending -= page_count
+
+    def _submit_all(self, fn, calls):
+        """
+        Submit fn(*args) for every (args, page_count) in calls, or none of them.
+        The pages are reserved up front and each call's pages are released when
+        its worker is done with it (or it is cancelled before starting), so the
+        count never drops while a worker is still busy on an abandoned request.
+        """
+        if self._executor is None:
+            raise RuntimeError("Scan pool is not running")
+        total = sum(page_count for _, page_count in calls)
+        if total > self.max_queued:
+            raise PageLimitError(f"{total} pages; at most {self.max_queued} at a time")
+        with self._pending_lock:
+            if self._pending + total > self.max_queued:
+                raise PoolBusyError(f"{self._pending} pages already queued")
+            self._pending += total
+
+        futures = []
+        try:
+            for args, page_count in calls:
+                future = self._executor.submit(fn, *args)
+                future.add_done_callback(lambda _, count=page_count: self._release(count))
+                futures.append(future)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            self._release(total - sum(page_count for _, page_count in calls[:len(futures)]))
+            raise
+        return futures
+
+    async def run_page(self, fn, *args, timeout=REQUEST_TIMEOUT):
+        """Run a one-page call in a worker, counted against the page queue"""
+        (future,) = self._submit_all(fn, [(args, 1)])
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    def iter_pages(self, fn, pages, *args, batch_size=MAX_BATCH_SIZE,
+                   timeout=REQUEST_TIMEOUT):
+        """
+        Split pages into chunks and run fn(chunk, *args) on each chunk, so every
+        worker gets a share of the request and runs detection on it as one batch.
+        fn must return one result per page. Returns an async iterator of
+        (page_index, result) pairs, yielded as soon as each chunk finishes; every
+        page of a failed chunk gets that chunk's exception as its result.
+        The pages are submitted here, before returning: this raises PoolBusyError
+        when the queue is full and PageLimitError when pages alone overflow it.
+        """
+        # Use all workers first, then cap each chunk at the detector batch size
+        chunk_size = max(1, min(batch_size, math.ceil(len(pages) / self.workers)))
+        chunks = [(i, pages[i:i + chunk_size]) for i in range(0, len(pages), chunk_size)]
+        futures = self._submit_all(fn, [((chunk,) + args, len(chunk)) for _, chunk in chunks])
+        deadline = asyncio.get_running_loop().time() + timeout
+        return self._iter_chunks({future: (start, len(chunk))
+                                  for future, (start, chunk) in zip(futures, chunks)}, deadline)
+
+    async def _iter_chunks(self, futures, deadline):
+        loop = asyncio.get_running_loop()
+        tasks = {asyncio.wrap_future(future): place for future, place in futures.items()}
+        pending = set(tasks)
+        try:
+            while pending:
+                # Timed-out pages keep running in their worker, but the request returns
+                done, pending = await asyncio.wait(pending, timeout=deadline - loop.time(),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    start, count = tasks[task]
+                    try:
+                        chunk_result = task.result()
+                    except Exception as e:
+                        chunk_result = [e] * count
+                    for offset, result in enumerate(chunk_result):
+                        yield start + offset, result
+        finally:
+            # Chunks that have not started are dropped; running ones finish in their
+            # worker and only then give their pages back
+            for task in pending:
+                task.cancel()